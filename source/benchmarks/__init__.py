@@ -0,0 +1 @@
+# Benchmarks for the transfer protocols, run them from the source directory, e.g. python3 -m benchmarks.checksum
@@ -0,0 +1,80 @@
+# Measures loopback packets per second of every send and receive path of the batching module.
+# Usage: python3 -m benchmarks.batching [packets] [chunk size]
+
+import socket
+import sys
+import time
+from include import *
+
+# Receive buffer of the benchmark sockets, each receive round drains what fits into it
+RECEIVE_BUFFER = 8 << 20
+
+def create_pair():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    receiver.bind(('127.0.0.1', 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return sender, receiver
+
+# Sends the packets with the given send path to a socket nobody reads, returns packets per second.
+def measure_send(mode, datagrams):
+    sender_socket, receiver_socket = create_pair()
+    sender = BatchSender(sender_socket, receiver_socket.getsockname(), mode)
+    start = time.perf_counter()
+    for data in datagrams:
+        sender.send(data)
+    sender.flush()
+    elapsed = time.perf_counter() - start
+    sender_socket.close()
+    receiver_socket.close()
+    return sender.mode, len(datagrams) / elapsed, sender.syscall_count
+
+# Fills the receive buffer, then drains it with the given receive path, returns packets per second.
+def measure_receive(mode, datagrams):
+    sender_socket, receiver_socket = create_pair()
+    receiver_socket.settimeout(0.05)
+    sender = BatchSender(sender_socket, receiver_socket.getsockname())
+    pool = BufferPool(2 * MAX_BATCH, constants.MSS_VALUE)
+    receiver = BatchReceiver(receiver_socket, pool, mode)
+
+    received = 0
+    elapsed = 0
+    round_size = min(len(datagrams), RECEIVE_BUFFER // (4 * constants.MSS_VALUE))
+    for start_index in range(0, len(datagrams), round_size):
+        round_datagrams = datagrams[start_index:start_index + round_size]
+        for data in round_datagrams:
+            sender.send(data)
+        sender.flush()
+
+        # Loopback delivers during the send, so the whole round is queued by now
+        start = time.perf_counter()
+        round_received = 0
+        try:
+            while round_received < len(round_datagrams):
+                for buffer, _, _ in receiver.receive():
+                    round_received += 1
+                    pool.release(buffer)
+        except socket.timeout:
+            pass  # Datagrams dropped by a full receive buffer
+        elapsed += time.perf_counter() - start
+        received += round_received
+    sender_socket.close()
+    receiver_socket.close()
+    return receiver.mode, received / elapsed, receiver.syscall_count
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else UDP_MAX_CHUNK_SIZE
+    datagram = pack_package(0, bytes(chunk_size))
+    datagrams = [datagram] * count
+
+    print('{} datagrams of {} bytes over loopback'.format(count, len(datagram)))
+    for mode in SEND_MODES:
+        used_mode, rate, syscalls = measure_send(mode, datagrams)
+        print('send    {:<9} (used {:<9}) {:10.0f} packets/s {:8} system calls'.format(mode, used_mode, rate, syscalls))
+    for mode in RECEIVE_MODES:
+        used_mode, rate, syscalls = measure_receive(mode, datagrams)
+        print('receive {:<9} (used {:<9}) {:10.0f} packets/s {:8} system calls'.format(mode, used_mode, rate, syscalls))
+
+if __name__ == "__main__":
+    main()
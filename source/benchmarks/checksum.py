@@ -0,0 +1,30 @@
+# Compares the receive path cost of the CRC32 packet checksum with the MD5 digest used before.
+# Usage: python3 -m benchmarks.checksum [iterations]
+
+import hashlib
+import os
+import sys
+import timeit
+from include import *
+
+# Times a function over the given number of calls, returns microseconds per call.
+def time_per_call(function, iterations):
+    return timeit.timeit(function, number=iterations) / iterations * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunk = os.urandom(UDP_MAX_CHUNK_SIZE)
+    packed = pack_package(0, chunk)
+
+    results = [
+        ('md5 over chunk', time_per_call(lambda: hashlib.md5(chunk).digest(), iterations)),
+        ('crc32 over chunk', time_per_call(lambda: get_checksum(chunk), iterations)),
+        ('unpack_package with crc32', time_per_call(lambda: unpack_package(packed), iterations)),
+    ]
+
+    print('Payload size: {} bytes, {} iterations'.format(len(chunk), iterations))
+    for name, microseconds in results:
+        print('{:<28} {:8.3f} us/packet {:10.1f} MB/s'.format(name, microseconds, len(chunk) / microseconds))
+
+if __name__ == "__main__":
+    main()
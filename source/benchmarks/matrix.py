@@ -0,0 +1,208 @@
+# Transfers files over TCP and over the reliable UDP protocol (RDT) on loopback, through the emulators of netem.py,
+# and writes completion time, throughput and retransmissions of every run to <output>.json and <output>.csv.
+# Usage: python3 -m benchmarks.matrix [repetitions] [output prefix] [profile,profile,...]
+
+import csv
+import json
+import os
+import random
+import socket
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+from include import *
+import client
+import server
+from .netem import Impairment, NetemProxy, DelayRelay
+
+# Network conditions of the matrix. TCP only gets their delay and jitter, see DelayRelay.
+PROFILES = {
+    'clean': Impairment(),
+    'delay': Impairment(delay=0.01),
+    'jitter': Impairment(delay=0.01, jitter=0.005),
+    'loss-1': Impairment(loss=0.01),
+    'loss-5': Impairment(loss=0.05, delay=0.005),
+    'duplicate': Impairment(duplicate=0.05),
+    'reorder': Impairment(delay=0.005, reorder=0.1),
+    'corrupt': Impairment(corrupt=0.02),
+}
+
+# Test files and their sizes in bytes, random content generated for every run of the matrix
+FILES = {'small.obj': 10 * 1024, 'large.obj': 1024 * 1024}
+
+# Seed of the first repetition, repetition i uses SEED + i for the files' content and the emulators
+SEED = 1
+
+# Offset of tcpi_total_retrans in Linux's struct tcp_info
+TCP_INFO_TOTAL_RETRANS = 100
+
+# Columns of the CSV output, in order
+COLUMNS = ['protocol', 'profile', 'file', 'size', 'repetition', 'ok', 'completion_time_ms', 'throughput_mbps',
+           'retransmissions', 'dropped', 'duplicated', 'corrupted']
+
+# Returns the number of segments the kernel retransmitted on a TCP socket, None where TCP_INFO is not available.
+def tcp_retransmissions(sock):
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_TOTAL_RETRANS + 4)
+    except (AttributeError, OSError):
+        return None
+    if len(info) < TCP_INFO_TOTAL_RETRANS + 4:
+        return None
+    return struct.unpack_from('I', info, TCP_INFO_TOTAL_RETRANS)[0]
+
+# Socket of the TCP server, records its retransmissions before handle_client_connection closes it.
+class MeasuredSocket(socket.socket):
+    retransmissions = None
+
+    def close(self):
+        if self.fileno() != -1:
+            self.retransmissions = tcp_retransmissions(self)
+        super().close()
+
+# Transfers a file over TCP through a DelayRelay, returns completion time, retransmissions and whether the copy is intact.
+def run_tcp(filename, impairment, seed):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    connections = []
+
+    def serve():
+        accepted, _ = listener.accept()
+        conn = MeasuredSocket(fileno=accepted.detach())
+        connections.append(conn)
+        server.handle_client_connection(conn)
+
+    serving_thread = threading.Thread(target=serve, daemon=True)
+    serving_thread.start()
+    relay = DelayRelay(listener.getsockname(), impairment, seed)
+
+    start_time = time.perf_counter()
+    received = client.request_files(*relay.address, [filename])
+    completion_time = time.perf_counter() - start_time
+
+    serving_thread.join()
+    relay.close()
+    listener.close()
+    ok = received == [filename] and same_content(filename, 'received_' + filename)
+    return dict(ok=ok, completion_time=completion_time, retransmissions=connections[0].retransmissions,
+                dropped=0, duplicated=0, corrupted=0)
+
+# Transfers a file over RDT through a NetemProxy, with the handshake, returns completion time, retransmissions
+# and whether the copy is intact. The completion time ends with the last delivery, the receiver's linger is not counted.
+def run_rdt(filename, impairment, seed, fec_ratio='auto'):
+    listen_socket = create_udp_socket('127.0.0.1', 0)
+    listen_socket.settimeout(constants.RECEIVE_TIMEOUT)
+    sender_result = {}
+
+    def serve():
+        try:
+            request = server.listen_for_requests(listen_socket)
+        except socket.timeout:
+            return
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        parameters = agree_parameters(request, WINDOW_SIZE, DEFAULT_OPTIONS, udp_socket)
+        sender = UDPServer(0, *request.address, server.chunk_file(request.filename, parameters.chunk_size()),
+                           fec_ratio=fec_ratio, connection_id=request.connection_id, parameters=parameters, sock=udp_socket)
+        sender_result['retransmissions'] = sender.process()
+
+    serving_thread = threading.Thread(target=serve, daemon=True)
+    serving_thread.start()
+    proxy = NetemProxy(listen_socket.getsockname(), impairment, seed)
+
+    receiver = UDPClient('127.0.0.1', 0)
+    output_filename = 'udp_' + filename
+    start_time = time.perf_counter()
+    end_time = None
+    with open(output_filename, 'wb') as output:
+        if receiver.connect(proxy.address, filename):
+            for package in receiver.process():
+                output.write(package.chunk)
+                end_time = time.perf_counter()
+
+    serving_thread.join()
+    proxy.close()
+    listen_socket.close()
+    ok = end_time is not None and same_content(filename, output_filename)
+    return dict(ok=ok, completion_time=None if end_time is None else end_time - start_time,
+                retransmissions=sender_result.get('retransmissions'), dropped=proxy.dropped_count,
+                duplicated=proxy.duplicated_count, corrupted=proxy.corrupted_count)
+
+def same_content(filename, copy_filename):
+    with open(filename, 'rb') as original, open(copy_filename, 'rb') as copy:
+        return original.read() == copy.read()
+
+# Writes the test files with reproducible random content.
+def create_files(seed):
+    rng = random.Random(seed)
+    for filename, size in FILES.items():
+        with open(filename, 'wb') as file:
+            file.write(rng.randbytes(size))
+
+# Runs every protocol, profile and file the given number of times, returns the result rows.
+def run_matrix(repetitions, profile_names):
+    runners = {'tcp': run_tcp, 'rdt': run_rdt}
+    rows = []
+    for repetition in range(repetitions):
+        seed = SEED + repetition
+        create_files(seed)
+        for profile_name in profile_names:
+            for protocol, run in runners.items():
+                for filename, size in FILES.items():
+                    result = run(filename, PROFILES[profile_name], seed)
+                    completion_time = result.pop('completion_time')
+                    row = dict(protocol=protocol, profile=profile_name, file=filename, size=size, repetition=repetition,
+                               completion_time_ms=None if completion_time is None else round(completion_time * 1000, 3),
+                               throughput_mbps=None if not completion_time else round(size * 8 / completion_time / 1e6, 3),
+                               **result)
+                    rows.append(row)
+                    print('{protocol:<4} {profile:<10} {file:<10} #{repetition} {completion_time_ms} ms '
+                          '{throughput_mbps} Mbit/s {retransmissions} retransmissions{failed}'
+                          .format(failed='' if row['ok'] else ' FAILED', **row))
+    return rows
+
+# Prints the median completion time and throughput of every cell of the matrix.
+def print_summary(rows):
+    cells = {}
+    for row in rows:
+        if row['ok']:
+            cells.setdefault((row['protocol'], row['profile'], row['file']), []).append(row)
+    print('\n{:<4} {:<10} {:<10} {:>12} {:>12} {:>8}'.format('', 'profile', 'file', 'median ms', 'Mbit/s', 'retx'))
+    for (protocol, profile_name, filename), cell in cells.items():
+        print('{:<4} {:<10} {:<10} {:12.1f} {:12.1f} {:>8}'.format(
+            protocol, profile_name, filename, statistics.median(row['completion_time_ms'] for row in cell),
+            statistics.median(row['throughput_mbps'] for row in cell),
+            statistics.median(row['retransmissions'] or 0 for row in cell)))
+
+def write_results(rows, output_prefix, repetitions, profile_names):
+    description = dict(protocol_version=constants.PROTOCOL_VERSION, repetitions=repetitions, seed=SEED, files=FILES,
+                       profiles={name: PROFILES[name].as_dict() for name in profile_names})
+    with open(output_prefix + '.json', 'w') as file:
+        json.dump(dict(description=description, results=rows), file, indent=2)
+    with open(output_prefix + '.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    output_prefix = os.path.abspath(sys.argv[2] if len(sys.argv) > 2 else 'benchmark_matrix')
+    profile_names = sys.argv[3].split(',') if len(sys.argv) > 3 else list(PROFILES)
+
+    # The transfers read and write their files in the working directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            rows = run_matrix(repetitions, profile_names)
+        finally:
+            os.chdir(working_directory)
+
+    write_results(rows, output_prefix, repetitions, profile_names)
+    print_summary(rows)
+    print('\nResults written to {0}.json and {0}.csv'.format(output_prefix))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# In-process network emulators for loopback benchmarks, in the spirit of tc netem: a UDP proxy with loss, delay,
+# jitter, duplication, reordering and corruption, and a TCP relay with delay and jitter.
+
+import heapq
+import random
+import socket
+import threading
+import time
+
+# Largest datagram the UDP proxy forwards
+MAX_DATAGRAM = 65535
+
+# Size of the reads of the TCP relay
+RELAY_CHUNK_SIZE = 64 * 1024
+
+# Impairments applied to every datagram, in both directions.
+class Impairment:
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, duplicate=0.0, reorder=0.0, corrupt=0.0):
+        """
+        :param loss: Probability of dropping a datagram.
+        :param delay: One way delay in seconds.
+        :param jitter: The delay varies uniformly within delay +- jitter, which reorders datagrams too.
+        :param duplicate: Probability of sending a datagram twice.
+        :param reorder: Probability of sending a datagram without the delay, ahead of the ones before it (netem's reorder).
+        :param corrupt: Probability of flipping one bit of a datagram.
+        """
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.corrupt = corrupt
+
+    # Returns the delay of the next datagram.
+    def sample_delay(self, rng):
+        if self.reorder and rng.random() < self.reorder:
+            return 0.0
+        return max(self.delay + rng.uniform(-self.jitter, self.jitter), 0.0)
+
+    def as_dict(self):
+        return dict(vars(self))
+
+# UDP proxy between one client and a server. Datagrams from the client go to the server, everything else goes to
+# the client, and the server's latest address is learned from it, so replies from a separate data socket work.
+class NetemProxy:
+    def __init__(self, server_address, impairment, seed=1, host='127.0.0.1', drop=None):
+        """
+        :param server_address: Address the client's first datagrams are forwarded to.
+        :param impairment: The Impairment applied to both directions.
+        :param seed: Seed of the random decisions, equal seeds give equal runs.
+        :param host: Address the proxy is bound to, the port is chosen by the system.
+        :param drop: Called with every datagram and True if it comes from the client, the datagrams it returns True for
+                     are dropped on top of the random loss, e.g. to lose the packets of one kind.
+        """
+        self.drop = drop
+        self.server_address = server_address
+        self.client_address = None
+        self.impairment = impairment
+        self.rng = random.Random(seed)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+        self.socket.bind((host, 0))
+        self.address = self.socket.getsockname()
+
+        # Datagrams waiting for their delay: heap of (due time, arrival order, data, destination)
+        self.queue = []
+        self.condition = threading.Condition()
+        self.arrival_count = 0
+        self.closed = False
+
+        # Counters of the applied impairments
+        self.forwarded_count = 0
+        self.dropped_count = 0
+        self.duplicated_count = 0
+        self.corrupted_count = 0
+
+        self.threads = [threading.Thread(target=self.receive_loop, daemon=True),
+                        threading.Thread(target=self.send_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    # Reads datagrams and queues them with their delay.
+    def receive_loop(self):
+        while not self.closed:
+            try:
+                data, address = self.socket.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                return  # Closed
+            if self.client_address is None:
+                self.client_address = address
+            if address == self.client_address:
+                destination = self.server_address
+            else:
+                self.server_address = address
+                destination = self.client_address
+
+            impairment = self.impairment
+            if self.drop is not None and self.drop(data, address == self.client_address):
+                self.dropped_count += 1
+                continue
+            if self.rng.random() < impairment.loss:
+                self.dropped_count += 1
+                continue
+            copies = 2 if self.rng.random() < impairment.duplicate else 1
+            self.duplicated_count += copies - 1
+            for _ in range(copies):
+                packet = data
+                if self.rng.random() < impairment.corrupt:
+                    packet = bytearray(data)
+                    packet[self.rng.randrange(len(packet))] ^= 1 << self.rng.randrange(8)
+                    self.corrupted_count += 1
+                with self.condition:
+                    self.arrival_count += 1
+                    due = time.monotonic() + impairment.sample_delay(self.rng)
+                    heapq.heappush(self.queue, (due, self.arrival_count, packet, destination))
+                    self.condition.notify()
+
+    # Sends the queued datagrams once their delay has passed.
+    def send_loop(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                due, _, packet, destination = self.queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                heapq.heappop(self.queue)
+            try:
+                self.socket.sendto(packet, destination)
+                self.forwarded_count += 1
+            except OSError:
+                pass  # The destination is gone
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.socket.close()
+
+# TCP relay adding delay and jitter to both directions of every connection. TCP's own retransmissions hide any
+# loss a relay could cause, so loss, duplication, reordering and corruption only apply to the UDP proxy.
+class DelayRelay:
+    def __init__(self, server_address, impairment, seed=1, host='127.0.0.1'):
+        """
+        :param server_address: Address of the TCP server.
+        :param impairment: The Impairment, only its delay and jitter are used.
+        :param seed: Seed of the jitter.
+        :param host: Address the relay listens on, the port is chosen by the system.
+        """
+        self.server_address = server_address
+        self.impairment = impairment
+        self.rng = random.Random(seed)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind((host, 0))
+        self.listener.listen()
+        self.address = self.listener.getsockname()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return  # Closed
+            server = socket.create_connection(self.server_address)
+            for source, destination in ((client, server), (server, client)):
+                DelayedPipe(source, destination, self.impairment, self.rng)
+
+    def close(self):
+        self.listener.close()
+
+# One direction of a relayed TCP connection, the bytes keep their order, each read is delivered after its delay.
+class DelayedPipe:
+    def __init__(self, source, destination, impairment, rng):
+        self.source = source
+        self.destination = destination
+        self.impairment = impairment
+        self.rng = rng
+        self.queue = []  # (due time, data), in order
+        self.condition = threading.Condition()
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def read_loop(self):
+        last_due = 0
+        while True:
+            try:
+                data = self.source.recv(RELAY_CHUNK_SIZE)
+            except OSError:
+                data = b''
+            # Jitter never reorders the stream, a read is not delivered before the one ahead of it
+            delay = self.impairment.delay + self.rng.uniform(-self.impairment.jitter, self.impairment.jitter)
+            due = max(time.monotonic() + max(delay, 0.0), last_due)
+            last_due = due
+            with self.condition:
+                self.queue.append((due, data))
+                self.condition.notify()
+            if not data:
+                return
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                due, data = self.queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.queue.pop(0)
+            try:
+                if not data:
+                    self.destination.shutdown(socket.SHUT_WR)  # Pass the end of the stream on
+                    return
+                self.destination.sendall(data)
+            except OSError:
+                return
@@ -0,0 +1,118 @@
+# Profiles one RDT transfer on loopback, through a NetemProxy with a network profile of matrix.py. A Profiler is attached
+# to both sides: its section timers are printed and written to <output>.json, the packet events of both sides to <output>.trace.
+# With --cprofile each side also runs under its own cProfile, written to <output>.sender.prof and <output>.receiver.prof
+# for pstats, snakeviz or a flame graph with flameprof. The timers then include the overhead of cProfile.
+# Usage: python3 -m benchmarks.profile_transfer [profile] [size in KiB] [output prefix] [--cprofile]
+#        python3 -m benchmarks.profile_transfer --show <output>.trace
+
+import cProfile
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from include import *
+import server
+from .matrix import PROFILES, SEED
+from .netem import NetemProxy
+
+# Name of the transferred file in the temporary directory
+FILENAME = 'profiled.obj'
+
+# Runs a profile of a callable if one is given, dumps it to the path afterwards.
+def run_profiled(profile, path, function, *args):
+    if profile is None:
+        return function(*args)
+    profile.enable()
+    try:
+        return function(*args)
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+# Transfers FILENAME through a NetemProxy with the profiler attached to both sides, returns the completion time.
+def profile_transfer(impairment, profiler, output_prefix, use_cprofile=False):
+    listen_socket = create_udp_socket('127.0.0.1', 0)
+    listen_socket.settimeout(constants.RECEIVE_TIMEOUT)
+
+    def send(request):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        parameters = agree_parameters(request, WINDOW_SIZE, DEFAULT_OPTIONS, udp_socket)
+        sender = UDPServer(0, *request.address, server.chunk_file(request.filename, parameters.chunk_size()),
+                           fec_ratio='auto', connection_id=request.connection_id, parameters=parameters, sock=udp_socket,
+                           profiler=profiler)
+        sender.process()
+
+    def serve():
+        try:
+            request = server.listen_for_requests(listen_socket)
+        except socket.timeout:
+            return
+        run_profiled(cProfile.Profile() if use_cprofile else None, output_prefix + '.sender.prof', send, request)
+
+    def receive(receiver):
+        if receiver.connect(proxy.address, FILENAME):
+            for _ in receiver.process():
+                pass
+
+    serving_thread = threading.Thread(target=serve, daemon=True)
+    serving_thread.start()
+    proxy = NetemProxy(listen_socket.getsockname(), impairment, SEED)
+
+    start_time = time.perf_counter()
+    with open('udp_' + FILENAME, 'wb') as output:
+        receiver = UDPClient('127.0.0.1', 0, writer=PositionalWriter(output.fileno(), constants.UDP_MAX_CHUNK_SIZE),
+                             profiler=profiler)
+        run_profiled(cProfile.Profile() if use_cprofile else None, output_prefix + '.receiver.prof', receive, receiver)
+    completion_time = time.perf_counter() - start_time
+
+    serving_thread.join()
+    proxy.close()
+    listen_socket.close()
+    with open(FILENAME, 'rb') as original, open('udp_' + FILENAME, 'rb') as copy:
+        if original.read() != copy.read():
+            print('The copy differs from the original')
+    return completion_time
+
+# Prints the events of a trace file, one per line.
+def show_trace(path):
+    with open(path, 'rb') as file:
+        for timestamp, event, seq_no in read_trace(file):
+            print('{:12.6f} {:<10} {}'.format(timestamp, event, seq_no))
+
+def main():
+    use_cprofile = '--cprofile' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--cprofile']
+    if args and args[0] == '--show':
+        show_trace(args[1])
+        return
+    profile_name = args[0] if args else 'clean'
+    size = int(args[1]) * 1024 if len(args) > 1 else 10 * 1024 * 1024
+    output_prefix = os.path.abspath(args[2] if len(args) > 2 else 'transfer_profile')
+
+    # The transfer reads and writes its files in a temporary directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with open(FILENAME, 'wb') as file:
+                file.write(random.Random(SEED).randbytes(size))
+            with Profiler() as profiler:
+                completion_time = profile_transfer(PROFILES[profile_name], profiler, output_prefix, use_cprofile)
+        finally:
+            os.chdir(working_directory)
+
+    print('{} KiB over {} in {:.1f} ms\n'.format(size // 1024, profile_name, completion_time * 1000))
+    profiler.print_report()
+    with open(output_prefix + '.json', 'w') as file:
+        json.dump(dict(profile=profile_name, size=size, completion_time=completion_time, sections=profiler.report(),
+                       trace_events=profiler.trace.count), file, indent=2)
+    with open(output_prefix + '.trace', 'wb') as file:
+        profiler.trace.dump(file)
+    print('\nResults written to {0}.json and {0}.trace'.format(output_prefix))
+
+if __name__ == "__main__":
+    main()
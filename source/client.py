@@ -1,3 +1,4 @@
+import os
 from include import *
 
 HOST = ''
@@ -5,6 +6,7 @@ TCP_PORT, UDP_PORT = 65432, 20001
 TARGET_HOST_IP = "172.17.0.2"
 UDP_TARGET_PORT, UDP_SENDER_PORT = 20001, 20001
 TCP_TARGET_PORT, TCP_SENDER_PORT = 65432, 65432
+STRIPE_CONTROL_PORT, STRIPE_BASE_PORT, STRIPE_COUNT = 65433, 20010, 4
 
 def create_socket(host_ip, port_number):
     connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -24,85 +26,220 @@ def chunk_file(filename, chunk_size):
                 break
             yield chunk
 
-# Calculates the average transmission time for each package and the total transmission time,
-# returns a tuple containing the average time and total transmission time in milliseconds.
-def calculate_time(timestamps):
-    """
-    :param timestamps: A list of timestamps representing sent and received times of packages.
-    """
-    if not timestamps:
-        return 0, 0  # Return 0 if there are no timestamps
-
-    total_time = (timestamps[-1] - timestamps[0]) * 1000  # Total time in milliseconds
-
-    # Calculate differences between sent and received times
-    time_diffs = [abs(timestamps[i + 1] - timestamps[i]) * 1000 for i in range(0, len(timestamps), 2)]
-    avg_time = sum(time_diffs) / len(time_diffs)  # Average time in milliseconds
-
-    return avg_time, total_time
-    
-def unpack_package(data):
+# Unpacks a TCP frame header, returns the timestamp, the length of the file and the length of its name that follow it,
+# and the frame flags.
+def unpack_header(data):
     try:
-        timestamp, chunk_length = struct.unpack('!dI', data[:constants.TCP_HEADER_BYTES])
-        aligner_size = constants.TCP_MAX_CHUNK_SIZE - chunk_length
-        chunk, _ = struct.unpack(f'!{chunk_length}s{aligner_size}s', data[constants.TCP_HEADER_BYTES:])
-        return timestamp, chunk
+        version, flags, timestamp, file_length, name_length = TCP_FRAME_HEADER.unpack_from(data)
+        if version != constants.PROTOCOL_VERSION:
+            return None
+        return timestamp, file_length, name_length, flags
     except:
         return None
 
-# Requests a file from the server and saves it.
-def request_file(host, port, filename):
+# Receives the blocks of a compressed TCP frame and writes them decompressed, returns the number of bytes missing,
+# 0 unless the connection closed or a block was invalid.
+def receive_blocks(client_socket, file, file_length):
+    """
+    :param client_socket: The connected socket.
+    :param file: The output file.
+    :param file_length: Length of the decompressed file.
+    """
+    while file_length > 0:
+        header = receive_exactly(client_socket, COMPRESSED_BLOCK_HEADER.size)
+        if header is None:
+            return file_length
+        option, stored_length, data_length = COMPRESSED_BLOCK_HEADER.unpack(header)
+        if data_length > min(file_length, TCP_COMPRESSION_BLOCK_SIZE) or stored_length > data_length:
+            return file_length
+        data = receive_exactly(client_socket, stored_length)
+        if data is not None and option:
+            codec = codec_for_options(option)
+            data = None if codec is None else decompress_data(codec, data, data_length)
+        if data is None or len(data) != data_length:
+            return file_length
+        file.write(data)
+        file_length -= data_length
+    return file_length
+
+# Requests a batch of files over a single connection and saves them, returns the names of the files received.
+def request_files(host, port, names, accepted_options=COMPRESSION_OPTIONS):
+    """
+    :param host: The server IP address.
+    :param port: The TCP port number of the server.
+    :param names: File names and glob patterns, the patterns are expanded by the server.
+    :param accepted_options: Compression codecs the server may use, OPTION_ flags of the handshake module, 0 for none.
+    """
     # client_socket = create_socket('', TCP_SENDER_PORT)
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client_socket.connect((host, port))
-    client_socket.sendall(filename.encode())
-
-    timestamps = []
+    request = pack_request(names).encode()
+    client_socket.sendall(TCP_REQUEST_HEADER.pack(constants.PROTOCOL_VERSION, accepted_options, len(request)) + request)
 
-    with open('received_' + filename, 'wb') as file:
+    received = []
+    buffer = bytearray(TCP_RECEIVE_BUFFER_SIZE)  # Every file is read as it arrives into this single buffer
+    with client_socket:
         while True:
-            buffer = b''
-            start_time = get_timestamp()
-            while len(buffer) < MSS_VALUE:
-                buffer_chunk = client_socket.recv(MSS_VALUE - len(buffer))
-                if not buffer_chunk:
-                    return  # No more data
-                buffer += buffer_chunk
-
-            _, chunk = unpack_package(buffer)
-            timestamp_received = get_timestamp()
-            timestamps.extend([start_time, timestamp_received])
-            file.write(chunk)
-            # timestamps.append(timestamp)
-
-    client_socket.close() # Code never reaches here
-
-# Starts an UDP file transmission server to receive a file.
-def receive_udp(host, udp_port, output_filename):
+            header = receive_exactly(client_socket, TCP_HEADER_BYTES)
+            result = None if header is None else unpack_header(header)
+            if result is None or result[2] == 0:
+                return received  # End of the batch, or an unknown frame version
+
+            # The header tells how long the file is, the next file's header follows its last byte
+            _, file_length, name_length, flags = result
+            name = receive_exactly(client_socket, name_length)
+            if name is None:
+                return received
+            filename = os.path.basename(name.decode(errors='replace'))
+            with open('received_' + filename, 'wb') as file:
+                if flags & FLAG_COMPRESSED:
+                    file_length = receive_blocks(client_socket, file, file_length)
+                else:
+                    for piece in receive_stream(client_socket, file_length, buffer):
+                        file.write(piece)
+                        file_length -= len(piece)
+            if file_length:
+                return received  # The connection closed in the middle of the file
+            received.append(filename)
+
+# Requests a file from the server and saves it.
+def request_file(host, port, filename):
+    request_files(host, port, [filename])
+
+# Requests a file from an UDP file transmission server and receives it.
+def receive_udp(host, udp_port, server_address, filename, output_filename, positional_writes=True, batched_io=False,
+                probe_mtu=False, metrics_export=None):
     """
     :param host: The host IP address.
-    :param udp_port: The UDP port number for the server.
+    :param udp_port: The UDP port number the file is received on.
+    :param server_address: Address the server listens for requests on.
+    :param filename: Name of the requested file.
     :param output_filename: The filename to save the received data.
+    :param positional_writes: Write chunks to their file offset as they arrive, instead of in order.
+    :param batched_io: Receive runs of packets with one GRO system call where the kernel supports it.
+    :param probe_mtu: Ask the server to probe the path MTU before the transfer.
+    :param metrics_export: Called with periodic snapshots of the transfer's metrics, e.g. export_json_lines(file).
     """
-    timestamps = []
-
     with open(output_filename, 'wb') as result_file:
-        client = UDPClient(host, udp_port)
+        if positional_writes:
+            # A lost packet does not hold back the writes of the packets after it, the chunk size is agreed in the handshake
+            client = UDPClient(host, udp_port, writer=PositionalWriter(result_file.fileno(), UDP_MAX_CHUNK_SIZE),
+                               batched_io=batched_io, metrics_export=metrics_export)
+        else:
+            client = UDPClient(host, udp_port, batched_io=batched_io, metrics_export=metrics_export)
+
+        options = DEFAULT_OPTIONS | COMPRESSION_OPTIONS
+        if probe_mtu:
+            options |= OPTION_PMTU_PROBE
+        if not client.connect(server_address, filename, options):
+            print('No answer from the server to the request of', filename)
+            return
+
         for package in client.process():
-            timestamps.extend([package.timestamp_sent, package.timestamp_received])
-            result_file.write(package.chunk)
+            if package.chunk is not None:
+                result_file.write(package.chunk)
 
-    avg_time, total_time = calculate_time(timestamps)
+    # Each package is timed from the previous delivery, the gaps add up to the time of the last delivery
+    delivery_gap = client.metrics.delivery_gap
+    avg_time, total_time = delivery_gap.mean() * 1000, delivery_gap.total * 1000
     print('UDP Packets Average Transmission Time: {:.6f} ms'.format(avg_time))
     print('UDP Communication Total Transmission Time: {:.6f} ms'.format(total_time))
     with open('total_time.txt', 'a') as f:
         f.write(str(total_time) + '\n')
 
-# Just sends a simple request with the name of the file to the server.
-def send_request_to_server(server_ip, server_port, name):
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    client_socket.sendto(("REQUEST"+name).encode(), (server_ip, server_port))
-    client_socket.close()
+# Requests a file from an UDP file transmission server into an existing copy of it, only the blocks that differ
+# from the copy are sent, see manifest.py. An interrupted transfer resumes where it stopped: the manifest stored beside
+# the copy records the blocks that were completed. Returns True if the copy is complete.
+# TCP transfers do not resume, their received_* outputs are always sent whole.
+def resume_udp(host, udp_port, server_address, filename, output_filename, batched_io=False, probe_mtu=False,
+               metrics_export=None):
+    """
+    :param host: The host IP address.
+    :param udp_port: The UDP port number the file is received on.
+    :param server_address: Address the server listens for requests on.
+    :param filename: Name of the requested file.
+    :param output_filename: The copy to update, created if it does not exist.
+    :param batched_io: Receive runs of packets with one GRO system call where the kernel supports it.
+    :param probe_mtu: Ask the server to probe the path MTU before the transfer.
+    :param metrics_export: Called with periodic snapshots of the transfer's metrics, e.g. export_json_lines(file).
+    """
+    # Larger copies get larger blocks, the manifest has to fit in the SYN next to the name
+    max_blocks = max_manifest_blocks(filename)
+    manifest = Manifest(0, MIN_BLOCK_SIZE, [])
+    if os.path.exists(output_filename):
+        manifest = load_manifest(output_filename, block_size_for(os.path.getsize(output_filename), max_blocks))
+    if len(manifest.hashes) > max_blocks:
+        manifest = None  # The name leaves no room, the whole file is sent
+
+    fd = os.open(output_filename, os.O_RDWR | os.O_CREAT, 0o644)
+    writer = BlockWriter(fd, UDP_MAX_CHUNK_SIZE)
+    client = UDPClient(host, udp_port, writer=writer, batched_io=batched_io, metrics_export=metrics_export)
+    options = DEFAULT_OPTIONS | COMPRESSION_OPTIONS
+    if probe_mtu:
+        options |= OPTION_PMTU_PROBE
+    complete = connected = False
+    delivered_length = 0  # Start of the stream written completely, packets after a gap may be written already
+    try:
+        if not client.connect(server_address, filename, options, manifest):
+            print('No answer from the server to the request of', filename)
+            return False
+        connected = True
+        if client.resume_plan is not None:
+            writer.set_plan(*client.resume_plan)
+            os.ftruncate(fd, writer.file_length)
+        for package in client.process():
+            delivered_length = (package.seq_no + 1) * writer.chunk_size
+        complete = client.has_finished and not client.window
+        if complete and writer.blocks is None:
+            os.ftruncate(fd, writer.stream_length)  # The whole file was sent, the copy may have been longer
+    finally:
+        os.close(fd)
+        if writer.blocks is not None:
+            store_received_manifest(output_filename, manifest, writer)
+        elif connected:
+            # The sender could not resume and sent the whole file, the manifest still lets the next attempt resume
+            delivered_length = min(delivered_length, writer.stream_length)
+            store_stream_manifest(output_filename, delivered_length,
+                                  block_size_for(os.path.getsize(output_filename), max_blocks))
+
+    if writer.blocks is not None:
+        print('UDP Resumed Transfer: {} of {} blocks sent'.format(len(writer.blocks), block_count(writer.file_length, writer.block_size)))
+    return complete
+
+# Requests a batch of files with a single UDP handshake, the files arrive back to back in one stream.
+# Returns the names of the files received.
+def receive_udp_files(host, udp_port, server_address, names, output_prefix='udp_', batched_io=False, probe_mtu=False):
+    """
+    :param host: The host IP address.
+    :param udp_port: The UDP port number the files are received on.
+    :param server_address: Address the server listens for requests on.
+    :param names: File names and glob patterns, the patterns are expanded by the server.
+    :param output_prefix: Prefix of the saved files' names.
+    :param batched_io: Receive runs of packets with one GRO system call where the kernel supports it.
+    :param probe_mtu: Ask the server to probe the path MTU before the transfer.
+    """
+    client = UDPClient(host, udp_port, batched_io=batched_io)
+    options = DEFAULT_OPTIONS | COMPRESSION_OPTIONS | OPTION_SESSION
+    if probe_mtu:
+        options |= OPTION_PMTU_PROBE
+    if not client.connect(server_address, pack_request(names), options):
+        print('No answer from the server to the request of', names)
+        return []
+    if not client.parameters.options & OPTION_SESSION:
+        print('The server does not serve batches of files')
+        return []
+
+    start_time = get_timestamp()
+    session = SessionReceiver(lambda filename: output_prefix + os.path.basename(filename))
+    try:
+        for package in client.process():
+            session.feed(package.chunk)
+            end_time = package.timestamp_received
+    finally:
+        session.close()
+    if session.received:
+        print('UDP Session Total Transmission Time: {:.6f} ms for {} files'.format((end_time - start_time) * 1000, len(session.received)))
+    return session.received
 
 def main(index):
 
@@ -110,11 +247,12 @@ def main(index):
 
     start_time = get_timestamp()
 
+    # All 20 files over one connection, the congestion window carries over from file to file
+    names = []
     for i in range(10):
-        # print("Requesting " + str(i) + " file from server...")
-        request_file(TARGET_HOST_IP, TCP_TARGET_PORT, 'large-' + str(i) + '.obj')
-        request_file(TARGET_HOST_IP, TCP_TARGET_PORT, 'small-' + str(i) + '.obj')
-        # print("File " + str(i) + " received from server.")
+        names.extend(['large-' + str(i) + '.obj', 'small-' + str(i) + '.obj'])
+    request_files(TARGET_HOST_IP, TCP_TARGET_PORT, names)
+    # print("Files received from server.")
 
     end_time = get_timestamp()
     print("Total time: ", end_time - start_time)
@@ -124,13 +262,23 @@ def main(index):
 
     ### UDP ###
 
-    # send_request_to_server(TARGET_HOST_IP, UDP_TARGET_PORT, 'large-'+str(index)+'.obj')
-    # print("Request sent to server, waiting to receive file...")
-    # receive_udp(HOST, UDP_PORT, 'udp_large-'+str(index)+'.obj')
+    # receive_udp(HOST, UDP_PORT, (TARGET_HOST_IP, UDP_TARGET_PORT), 'large-'+str(index)+'.obj', 'udp_large-'+str(index)+'.obj')
+
+    # receive_udp(HOST, UDP_PORT, (TARGET_HOST_IP, UDP_TARGET_PORT), 'small-'+str(index)+'.obj', 'udp_small-'+str(index)+'.obj')
+
+    ### UDP into an existing copy, only the changed or missing blocks are sent ###
+
+    # resume_udp(HOST, UDP_PORT, (TARGET_HOST_IP, UDP_TARGET_PORT), 'large-'+str(index)+'.obj', 'udp_large-'+str(index)+'.obj')
+
+    ### UDP session, every object with one handshake ###
+
+    # receive_udp_files(HOST, UDP_PORT, (TARGET_HOST_IP, UDP_TARGET_PORT), ['large-*.obj', 'small-*.obj'])
+
+    ### Striped UDP, one receiver process per stripe ###
 
-    # send_request_to_server(TARGET_HOST_IP, UDP_TARGET_PORT, 'small-'+str(index)+'.obj')
-    # print("Request sent to server, waiting to receive file...")
-    # receive_udp(HOST, UDP_PORT, 'udp_small-'+str(index)+'.obj')
+    # retransmission_count = receive_striped(TARGET_HOST_IP, STRIPE_CONTROL_PORT, 'large-'+str(index)+'.obj',
+    #                                        'udp_large-'+str(index)+'.obj', STRIPE_COUNT, STRIPE_BASE_PORT)
+    # print('Striped UDP Re-transferred Packets:', retransmission_count)
 
 
 if __name__ == "__main__":
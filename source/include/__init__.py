@@ -2,4 +2,20 @@
 
 from .constants import *
 from .utils import *
+from .window import *
+from .buffers import *
+from .batching import *
+from .file_writer import *
+from .file_reader import *
+from .manifest import *
+from .rtt import *
+from .congestion import *
+from .fec import *
+from .metrics import *
+from .handshake import *
+from .compression import *
 from .reliable_udp import *
+from .async_server import *
+from .striping import *
+from .session import *
+from .profiling import *
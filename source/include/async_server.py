@@ -0,0 +1,198 @@
+import asyncio
+import socket
+from . import constants
+from .handshake import DEFAULT_OPTIONS, OPTION_RESUME, OPTION_SESSION, agree_parameters, is_control_packet, parse_request, plan_resume
+from .manifest import chunk_blocks
+from .reliable_udp import UDPServer, WINDOW_SIZE, CONNECTION_ID_FIELD, ACK_CONNECTION_ID_OFFSET, FLAG_ACK
+from .session import chunk_files, expand_request
+
+# Socket buffer of the listening socket, shared by all sessions
+SERVER_SOCKET_BUFFER = 4 * WINDOW_SIZE * constants.MSS_VALUE
+
+
+# A transfer served by TransferServerProtocol. The sender logic of UDPServer is reused as is,
+# but it is driven by ACK arrivals and event loop timers instead of a blocking socket.
+class TransferSession(UDPServer):
+    def __init__(self, protocol, request, parameters, data, **options):
+        """
+        :param protocol: The TransferServerProtocol whose transport the session sends through.
+        :param request: The ConnectionRequest, data packets go to its address and its connection ID routes the ACKs.
+        :param parameters: The ConnectionParameters agreed for the request.
+        :param data: A generator that yields data chunks of the agreed chunk size.
+        :param options: Passed on to UDPServer, e.g. congestion_control or fec_ratio.
+        """
+        super().__init__(None, request.address[0], request.address[1], data, connection_id=request.connection_id,
+                         parameters=parameters, **options)
+        self.protocol = protocol
+        self.filename = request.filename
+        self.timer = None  # Handle of the next scheduled wake up
+
+    # Sends through the shared listening socket, the transport queues datagrams the kernel can not take yet.
+    def send_datagram(self, data):
+        self.protocol.transport.sendto(data, self.target)
+
+    # Nothing is queued, the transport sends right away.
+    def flush_datagrams(self):
+        pass
+
+    # Handles an ACK routed to this session.
+    def on_ack(self, data):
+        self.handle_ack(data)
+        self.step()
+
+    # Called by the event loop when a retransmission timer or the pacer is due.
+    def on_timer(self):
+        self.timer = None
+        self.step()
+
+    # Runs the sender, then schedules its next wake up. The session finishes once everything has been acknowledged,
+    # or is abandoned when the client has been silent for RECEIVE_TIMEOUT.
+    def step(self):
+        if self.protocol.writing_paused:
+            return  # Resumed by the protocol once the transport buffer drains
+        if not self.advance():
+            self.protocol.finish_session(self)
+            return
+
+        loop = self.protocol.loop
+        deadline = loop.time() + self.time_until_next_event()
+        if self.timer is not None:
+            if self.timer.when() <= deadline:
+                return  # An earlier wake up is already scheduled, it will look again
+            self.timer.cancel()
+        self.timer = loop.call_at(deadline, self.on_timer)
+
+    # Cancels the scheduled wake up of a finished session and reports its final metrics.
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.report_metrics(final=True)
+
+
+# Serves many concurrent transfers on one UDP port. SYNs start sessions, ACKs are routed to their session
+# by client address and connection ID, and every session runs its own window and timers on the event loop.
+class TransferServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, open_data, on_finished=None, options=DEFAULT_OPTIONS | OPTION_SESSION | OPTION_RESUME,
+                 **session_options):
+        """
+        :param open_data: Called with a requested file name and the agreed chunk size, returns a generator of the file's chunks.
+        :param on_finished: Called with every session that finished or was abandoned.
+        :param options: Handshake options the server agrees to, path MTU probing is not done by this server.
+                        Sessions read their files from disk, not through open_data.
+        :param session_options: Passed on to every TransferSession, e.g. congestion_control or fec_ratio.
+        """
+        self.open_data = open_data
+        self.on_finished = on_finished
+        self.options = options
+        self.session_options = session_options
+        self.transport = None
+        self.loop = None
+        self.writing_paused = False
+        self.sessions = {}  # Active sessions by (client address, connection ID), repeated SYNs are ignored
+        self.planning = set()  # Keys of the requests whose resume plan is being computed
+
+    # Called by the event loop once the listening socket is ready.
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+
+    # Ends every session when the listening socket is closed.
+    def connection_lost(self, exc):
+        for session in list(self.sessions.values()):
+            self.finish_session(session)
+
+    # Routes an ACK to its session by connection ID, a control packet may be a new request.
+    def datagram_received(self, data, addr):
+        if len(data) >= constants.ACK_HEADER_SIZE and data[1] & FLAG_ACK:
+            session = self.sessions.get((addr, CONNECTION_ID_FIELD.unpack_from(data, ACK_CONNECTION_ID_OFFSET)[0]))
+            if session is not None:
+                session.on_ack(data)
+        elif is_control_packet(data):
+            request = parse_request(data, addr)
+            if request is not None:
+                self.start_session(request)
+
+    # The kernel buffer is full, sessions stop sending until it drains.
+    def pause_writing(self):
+        self.writing_paused = True
+
+    # The kernel buffer drained, every session gets to send again.
+    def resume_writing(self):
+        self.writing_paused = False
+        for session in list(self.sessions.values()):
+            session.step()
+
+    # Starts sending a requested file, the session's first packet is the SYN-ACK.
+    def start_session(self, request):
+        """
+        :param request: The ConnectionRequest of a SYN.
+        """
+        key = (request.address, request.connection_id)
+        if key in self.sessions or key in self.planning:
+            return  # The client repeated its SYN, the session repeats the SYN-ACK until it is acknowledged
+
+        parameters = agree_parameters(request, WINDOW_SIZE, self.options)
+        if parameters.options & OPTION_RESUME:
+            # Hashing the file would stall every other session, the session starts once the plan is ready
+            self.planning.add(key)
+            future = self.loop.run_in_executor(None, plan_resume, request, parameters)
+            future.add_done_callback(lambda future: self.open_session(request, parameters, future))
+            return
+        self.open_session(request, parameters)
+
+    # Opens the data of a request and starts its session.
+    def open_session(self, request, parameters, plan_future=None):
+        """
+        :param request: The ConnectionRequest of a SYN.
+        :param parameters: The ConnectionParameters agreed for the request.
+        :param plan_future: Future of the plan_resume result of a resumed transfer.
+        """
+        key = (request.address, request.connection_id)
+        self.planning.discard(key)
+        try:
+            plan = None if plan_future is None else plan_future.result()
+            if parameters.options & OPTION_SESSION:
+                data = chunk_files(expand_request(request.filename), parameters.chunk_size())
+            elif plan is not None:
+                data = chunk_blocks(request.filename, plan[0], request.manifest.block_size, parameters.chunk_size())
+            else:
+                data = self.open_data(request.filename, parameters.chunk_size())
+            session = TransferSession(self, request, parameters, data, resume_plan=None if plan is None else plan[1],
+                                      **self.session_options)
+        except OSError as error:
+            print('Can not send {}: {}'.format(request.filename, error))
+            return
+        self.sessions[key] = session
+        session.step()
+
+    # Forgets a session that finished or was abandoned.
+    def finish_session(self, session):
+        session.close()
+        if self.sessions.pop((session.target, session.connection_id), None) is None:
+            return
+        if self.on_finished is not None:
+            self.on_finished(session)
+
+
+# Serves file requests on the given address until cancelled.
+async def serve_transfers(host, port, open_data, on_finished=None, **session_options):
+    """
+    :param host: IP address to listen on.
+    :param port: Port to listen on, SYNs and ACKs of every transfer arrive here.
+    :param open_data: Called with a requested file name and the agreed chunk size, returns a generator of the file's chunks.
+    :param on_finished: Called with every session that finished or was abandoned.
+    :param session_options: Passed on to every TransferServerProtocol and TransferSession, e.g. options or fec_ratio.
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: TransferServerProtocol(open_data, on_finished, **session_options), local_addr=(host, port))
+
+    # Every session may have a whole window in flight through this one socket
+    server_socket = transport.get_extra_info('socket')
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SERVER_SOCKET_BUFFER)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SERVER_SOCKET_BUFFER)
+    try:
+        await loop.create_future()
+    finally:
+        transport.close()
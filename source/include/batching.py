@@ -0,0 +1,321 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+
+# Linux UDP segmentation offload options, the socket module does not export them
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = 103
+UDP_GRO = 104
+
+# Segment size of a GSO send or a GRO receive, carried in the control message
+SEGMENT_SIZE = struct.Struct('=H')
+GRO_SEGMENT_SIZE = struct.Struct('=i')
+
+# Most datagrams moved by one batched system call, also the kernel's limit of segments per GSO send
+MAX_BATCH = 64
+
+# Largest UDP payload, a GSO send carries all of its segments in one
+MAX_UDP_PAYLOAD = 65507
+
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+
+# Errors that mean the fast path is not available for this socket or route, the plain path is used from then on
+UNSUPPORTED_ERRORS = (errno.EINVAL, errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP, errno.ENOSYS)
+
+# Errors of a full socket buffer, the remaining datagrams go through the plain path which waits for room
+BUSY_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+# Available send and receive paths. Without an explicit mode GSO and GRO are used where the kernel supports them,
+# otherwise one call per datagram: the per-datagram ctypes work of sendmmsg and recvmmsg costs about as much as
+# the system calls it saves (see benchmarks/batching.py), so they are only used when asked for.
+SEND_MODES = ('gso', 'sendmmsg', 'sendto')
+RECEIVE_MODES = ('gro', 'recvmmsg', 'recvfrom')
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(IOVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+# Port and address are kept in network byte order, as integers they compare cheaply
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint32), ('sin_zero', ctypes.c_ubyte * 8)]
+
+# Converts sin_addr to and from the packed form of socket.inet_aton
+IN_ADDR = struct.Struct('=I')
+
+
+# Loads sendmmsg and recvmmsg from the C library, returns None where they are not available.
+def load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+libc = load_libc()
+
+
+# Returns True if the kernel accepts the socket option, used to probe for GSO and GRO.
+def supports_option(sock, option, value):
+    try:
+        sock.setsockopt(SOL_UDP, option, value)
+    except OSError:
+        return False
+    return True
+
+
+# Returns a ctypes object over the buffer's data and its address, writable buffers are not copied.
+# The object keeps the data alive, it must be held until the system call returns.
+def buffer_address(buffer):
+    try:
+        view = ctypes.c_char.from_buffer(buffer)
+    except TypeError:
+        view = (ctypes.c_char * len(buffer)).from_buffer_copy(buffer)
+    return view, ctypes.addressof(view)
+
+
+# Fills a sockaddr_in, returns False for addresses the ctypes path does not handle (e.g. IPv6).
+def fill_sockaddr(sockaddr, address):
+    try:
+        sockaddr.sin_addr = IN_ADDR.unpack(socket.inet_aton(socket.gethostbyname(address[0])))[0]
+    except OSError:
+        return False
+    sockaddr.sin_family = socket.AF_INET
+    sockaddr.sin_port = socket.htons(address[1])
+    return True
+
+
+# Queues datagrams to one address and sends them with fewer system calls:
+# GSO sends runs of equally long datagrams as a single buffer the kernel splits, sendmmsg sends a whole batch.
+class BatchSender:
+    def __init__(self, sock, address, mode=None):
+        """
+        :param sock: A UDP socket.
+        :param address: Address every datagram is sent to.
+        :param mode: One of SEND_MODES, None uses GSO where supported.
+        """
+        self.socket = sock
+        self.address = address
+        self.queued = []
+        self.syscall_count = 0
+
+        # sendmmsg needs the address as a sockaddr_in
+        self.messages = None
+        self.sockaddr = SockAddrIn()
+        if mode == 'sendmmsg' and libc is not None and sock.family == socket.AF_INET and fill_sockaddr(self.sockaddr, address):
+            self.iovecs = (IOVec * MAX_BATCH)()
+            self.messages = (MMsgHdr * MAX_BATCH)()
+            for i in range(MAX_BATCH):
+                header = self.messages[i].msg_hdr
+                header.msg_name = ctypes.addressof(self.sockaddr)
+                header.msg_namelen = ctypes.sizeof(self.sockaddr)
+                header.msg_iov = ctypes.pointer(self.iovecs[i])
+                header.msg_iovlen = 1
+
+        if mode in (None, 'gso') and supports_option(sock, UDP_SEGMENT, 0):
+            self.mode = 'gso'
+        elif self.messages is not None:
+            self.mode = 'sendmmsg'
+        else:
+            self.mode = 'sendto'
+
+    # Queues a datagram, it is sent by the next flush() and must not change before.
+    def send(self, data):
+        self.queued.append(data)
+        if len(self.queued) >= MAX_BATCH:
+            self.flush()
+
+    # Sends every queued datagram.
+    def flush(self):
+        if not self.queued:
+            return
+        queued, self.queued = self.queued, []
+        if self.mode == 'gso':
+            sent = self.send_segmented(queued)
+        elif self.mode == 'sendmmsg':
+            sent = self.send_batch(queued)
+        else:
+            sent = 0
+        # Whatever the fast path did not send goes out one by one
+        for data in queued[sent:]:
+            self.socket.sendto(data, self.address)
+            self.syscall_count += 1
+
+    # Sends runs of equally long datagrams, only the last one may be shorter, with one GSO send each.
+    # Returns the number of datagrams sent.
+    def send_segmented(self, queued):
+        start = 0
+        while start < len(queued):
+            segment_size = len(queued[start])
+            limit = min(MAX_BATCH, MAX_UDP_PAYLOAD // max(segment_size, 1))
+            end = start + 1
+            while end < len(queued) and end - start < limit and len(queued[end]) == segment_size:
+                end += 1
+            if end < len(queued) and end - start < limit and len(queued[end]) < segment_size:
+                end += 1  # A shorter datagram may close the run
+
+            try:
+                if end - start == 1:
+                    self.socket.sendto(queued[start], self.address)
+                else:
+                    self.socket.sendmsg(queued[start:end], [(SOL_UDP, UDP_SEGMENT, SEGMENT_SIZE.pack(segment_size))], 0, self.address)
+            except OSError as error:
+                if error.errno in UNSUPPORTED_ERRORS:
+                    self.mode = 'sendto'  # E.g. segments larger than the route MTU
+                    return start
+                if error.errno in BUSY_ERRORS:
+                    return start
+                raise
+            self.syscall_count += 1
+            start = end
+        return start
+
+    # Sends the datagrams with sendmmsg, returns the number of datagrams sent.
+    def send_batch(self, queued):
+        count = min(len(queued), MAX_BATCH)
+        arrays = []  # Keeps the ctypes views alive until the call returns
+        for i in range(count):
+            array, address = buffer_address(queued[i])
+            arrays.append(array)
+            self.iovecs[i].iov_base = address
+            self.iovecs[i].iov_len = len(queued[i])
+
+        sent = 0
+        while sent < count:
+            result = libc.sendmmsg(self.socket.fileno(), ctypes.byref(self.messages[sent]), count - sent, 0)
+            self.syscall_count += 1
+            if result < 0:
+                error = ctypes.get_errno()
+                if error in UNSUPPORTED_ERRORS:
+                    self.mode = 'sendto'
+                elif error not in BUSY_ERRORS:
+                    raise OSError(error, os.strerror(error))
+                break
+            sent += result
+        return sent
+
+
+# Receives datagrams into buffers of a BufferPool, several per system call:
+# GRO hands over runs of datagrams coalesced by the kernel, recvmmsg takes whatever is queued on the socket.
+class BatchReceiver:
+    def __init__(self, sock, buffer_pool, mode=None):
+        """
+        :param sock: A bound UDP socket, its timeout applies whenever nothing is queued.
+        :param buffer_pool: The BufferPool the datagrams are received into.
+        :param mode: One of RECEIVE_MODES, None uses GRO where supported.
+        """
+        self.socket = sock
+        self.buffer_pool = buffer_pool
+        self.syscall_count = 0
+
+        if mode in (None, 'gro') and supports_option(sock, UDP_GRO, 1):
+            self.mode = 'gro'
+            self.scratch = memoryview(bytearray(MAX_UDP_PAYLOAD))
+            self.control_size = socket.CMSG_SPACE(GRO_SEGMENT_SIZE.size)
+        elif mode == 'recvmmsg' and libc is not None and sock.family == socket.AF_INET:
+            self.mode = 'recvmmsg'
+            # Buffers staged for recvmmsg, a slot gets a fresh buffer whenever its datagram is handed out
+            self.staged = [None] * MAX_BATCH
+            self.staged_arrays = [None] * MAX_BATCH
+            self.iovecs = (IOVec * MAX_BATCH)()
+            self.sockaddrs = (SockAddrIn * MAX_BATCH)()
+            self.messages = (MMsgHdr * MAX_BATCH)()
+            for i in range(MAX_BATCH):
+                self.stage(i)
+                header = self.messages[i].msg_hdr
+                header.msg_name = ctypes.addressof(self.sockaddrs[i])
+                header.msg_namelen = ctypes.sizeof(SockAddrIn)
+                header.msg_iov = ctypes.pointer(self.iovecs[i])
+                header.msg_iovlen = 1
+            self.last_sockaddr = None
+            self.last_address = None
+            self.last_count = 0  # The kernel overwrote the address length of this many slots
+        else:
+            self.mode = 'recvfrom'
+
+    # Puts a fresh pooled buffer into a recvmmsg slot.
+    def stage(self, slot):
+        buffer = self.buffer_pool.acquire()
+        self.staged[slot] = buffer
+        self.staged_arrays[slot], self.iovecs[slot].iov_base = buffer_address(buffer)
+        self.iovecs[slot].iov_len = len(buffer)
+
+    # Waits for datagrams, returns a list of (buffer, size, address), raises socket.timeout if none arrived.
+    # Every buffer belongs to the caller, who gives it back to the pool.
+    def receive(self):
+        if self.mode == 'gro':
+            return self.receive_coalesced()
+        if self.mode == 'recvmmsg':
+            # Only an empty socket costs the extra call, the blocking receive below waits then
+            datagrams = self.receive_queued()
+            if datagrams:
+                return datagrams
+
+        buffer = self.buffer_pool.acquire()
+        try:
+            size, address = self.socket.recvfrom_into(buffer)
+        except socket.timeout:
+            self.buffer_pool.release(buffer)
+            raise
+        self.syscall_count += 1
+        return [(buffer, size, address)]
+
+    # Takes the datagrams queued on the socket without blocking, returns an empty list if there are none.
+    def receive_queued(self):
+        for i in range(self.last_count):
+            self.messages[i].msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+        count = libc.recvmmsg(self.socket.fileno(), self.messages, MAX_BATCH, MSG_DONTWAIT, None)
+        self.syscall_count += 1
+        if count < 0:
+            if ctypes.get_errno() in UNSUPPORTED_ERRORS:
+                self.mode = 'recvfrom'
+            return []
+
+        self.last_count = count
+        datagrams = []
+        for i in range(count):
+            sockaddr = self.sockaddrs[i]
+            raw_address = (sockaddr.sin_addr, sockaddr.sin_port)
+            if raw_address != self.last_sockaddr:
+                self.last_sockaddr = raw_address
+                self.last_address = (socket.inet_ntoa(IN_ADDR.pack(raw_address[0])), socket.ntohs(raw_address[1]))
+            datagrams.append((self.staged[i], self.messages[i].msg_len, self.last_address))
+            self.stage(i)
+        return datagrams
+
+    # Receives a datagram or a GRO coalesced run of them, every datagram is copied into a pooled buffer.
+    def receive_coalesced(self):
+        size, ancdata, _, address = self.socket.recvmsg_into([self.scratch], self.control_size)
+        self.syscall_count += 1
+        segment_size = size
+        for level, kind, data in ancdata:
+            if level == SOL_UDP and kind == UDP_GRO:
+                segment_size = GRO_SEGMENT_SIZE.unpack_from(data)[0]
+
+        datagrams = []
+        for offset in range(0, max(size, 1), max(segment_size, 1)):
+            buffer = self.buffer_pool.acquire()
+            length = min(segment_size, size - offset, len(buffer))  # Longer datagrams are truncated like recvfrom_into does
+            buffer[:length] = self.scratch[offset:offset + length]
+            datagrams.append((buffer, length, address))
+        return datagrams
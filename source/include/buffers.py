@@ -0,0 +1,20 @@
+# A pool of preallocated, fixed size buffers, handed out as memoryviews.
+# Buffers are reused instead of allocating a new bytes object for every datagram.
+class BufferPool:
+    def __init__(self, count, size):
+        """
+        :param count: Number of buffers allocated up front.
+        :param size: Size of each buffer in bytes.
+        """
+        self.size = size
+        self.free = [memoryview(bytearray(size)) for _ in range(count)]
+
+    # Returns a free buffer, a new one is allocated only if the pool ran dry.
+    def acquire(self):
+        if self.free:
+            return self.free.pop()
+        return memoryview(bytearray(self.size))
+
+    # Gives a buffer back to the pool, nothing may reference its contents afterwards.
+    def release(self, buffer):
+        self.free.append(buffer)
@@ -0,0 +1,111 @@
+import lzma
+import struct
+import zlib
+from .handshake import OPTION_LZMA, OPTION_ZLIB
+
+# Packet flag of data packets whose chunk is compressed, and of TCP frames whose file is sent in compressed blocks
+FLAG_COMPRESSED = 0x20
+
+# Codecs by name, and the handshake option announcing each one. A receiver accepts all of them, the sender picks one.
+CODEC_OPTIONS = {'zlib': OPTION_ZLIB, 'lzma': OPTION_LZMA}
+COMPRESSION_OPTIONS = OPTION_ZLIB | OPTION_LZMA
+
+# Raw LZMA2 without the xz container, which would add about 60 bytes to every chunk.
+# Chunks and blocks are compressed on their own, so a dictionary of the largest block is enough, and cheap to allocate.
+LZMA_DICT_SIZE = 256 * 1024
+
+# Number of chunks in a row that have to stay incompressible before compression is skipped, and the number of chunks
+# skipped before the data is sampled again. Incompressible data costs a compression for about 1 in 60 chunks.
+SAMPLE_CHUNKS = 4
+SKIPPED_CHUNKS = 256
+
+# A chunk is sent compressed only if that saves at least this fraction of its size
+MIN_SAVING = 0.05
+
+# Size of the blocks a file is compressed in over TCP, each block is preceded by COMPRESSED_BLOCK_HEADER
+TCP_COMPRESSION_BLOCK_SIZE = 256 * 1024
+
+# Header of a block of a compressed TCP frame: option of the codec, 0 if the block is stored as is,
+# length of the block on the wire, length of the decompressed block
+COMPRESSED_BLOCK_HEADER = struct.Struct('!BII')
+
+
+# Returns the name of the codec of the agreed options, None if compression is off. zlib wins if both are set.
+def codec_for_options(options):
+    for codec, option in CODEC_OPTIONS.items():
+        if options & option:
+            return codec
+    return None
+
+
+# Returns the raw LZMA2 filter chain, the preset only matters for compression.
+def lzma_filters(level=None):
+    filters = {'id': lzma.FILTER_LZMA2, 'dict_size': LZMA_DICT_SIZE}
+    if level is not None:
+        filters['preset'] = level
+    return [filters]
+
+
+# Compresses data with the given codec.
+def compress_data(codec, data, level=None):
+    """
+    :param codec: 'zlib' or 'lzma'.
+    :param data: Any bytes-like object.
+    :param level: zlib level 0-9 or lzma preset 0-9, None for the codec's default.
+    """
+    if codec == 'zlib':
+        return zlib.compress(data, zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+    return lzma.compress(data, format=lzma.FORMAT_RAW, filters=lzma_filters(level))
+
+
+# Decompresses data, returns None if it is not valid or decompresses to more than max_length bytes.
+def decompress_data(codec, data, max_length):
+    """
+    :param codec: 'zlib' or 'lzma'.
+    :param data: The compressed bytes.
+    :param max_length: Largest size of the decompressed data, e.g. the chunk size.
+    """
+    try:
+        if codec == 'zlib':
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=lzma_filters())
+        result = decompressor.decompress(data, max_length)
+    except (zlib.error, lzma.LZMAError):
+        return None
+    if not decompressor.eof:
+        return None  # Truncated, or more than max_length bytes
+    return result
+
+
+# Compresses the chunks of a stream one by one, and stops trying for a while when the data does not compress,
+# so incompressible files do not pay for compressing every chunk.
+class ChunkCompressor:
+    def __init__(self, codec, level=None):
+        """
+        :param codec: 'zlib' or 'lzma'.
+        :param level: zlib level 0-9 or lzma preset 0-9, None for the codec's default.
+        """
+        self.codec = codec
+        self.level = level
+        self.failed_count = 0  # Incompressible chunks in a row
+        self.skip_count = 0  # Chunks left to send without trying
+        self.compressed_count = 0
+        self.saved_bytes = 0
+
+    # Returns the compressed chunk, or None if the chunk is to be sent as is.
+    def compress(self, chunk):
+        if self.skip_count:
+            self.skip_count -= 1
+            return None
+        compressed = compress_data(self.codec, chunk, self.level)
+        if len(compressed) <= len(chunk) * (1 - MIN_SAVING):
+            self.failed_count = 0
+            self.compressed_count += 1
+            self.saved_bytes += len(chunk) - len(compressed)
+            return compressed
+        self.failed_count += 1
+        if self.failed_count >= SAMPLE_CHUNKS:
+            self.failed_count = 0
+            self.skip_count = SKIPPED_CHUNKS
+        return None
@@ -0,0 +1,173 @@
+import abc
+
+# Congestion window, in packets, used at the start of a transfer
+INITIAL_WINDOW = 10
+
+# Congestion window never drops below this many packets
+MIN_WINDOW = 2
+
+# Multiplicative decrease applied by the rate based controller on loss
+RATE_DECREASE_FACTOR = 0.7
+
+# Pacing rate relative to cwnd / srtt, slightly above 1 so pacing never limits a full window
+PACING_GAIN = 1.25
+
+# Number of packets the pacer may send back to back
+PACING_BURST = 4
+
+
+# Base class of the congestion controllers, the sender reports ACK and loss events to it.
+# cwnd is the number of packets allowed in flight, pacing_rate() the number of packets per second.
+class CongestionController(abc.ABC):
+    def __init__(self, max_window):
+        """
+        :param max_window: Upper bound of the congestion window, normally the sender window size.
+        """
+        self.max_window = max_window
+        self.cwnd = min(INITIAL_WINDOW, max_window)
+        self.recovery_point = 0  # Losses of packets sent before this sequence number belong to the same event
+
+    # Called for every newly acknowledged packet.
+    @abc.abstractmethod
+    def on_ack(self, seq_no, rtt_estimator):
+        """
+        :param seq_no: Sequence number of the acknowledged packet.
+        :param rtt_estimator: The RTTEstimator of the sender.
+        """
+
+    # Called when a packet is detected as lost, reacts at most once per window of data (NewReno).
+    def on_loss(self, seq_no, next_seq_no, timeout):
+        """
+        :param seq_no: Sequence number of the lost packet.
+        :param next_seq_no: Next sequence number the sender will use, ends the recovery period.
+        :param timeout: True if the loss was detected by the retransmission timer.
+        """
+        if seq_no < self.recovery_point:
+            return
+        self.recovery_point = next_seq_no
+        self.reduce(timeout)
+
+    # Reduces the sending rate after a loss event.
+    @abc.abstractmethod
+    def reduce(self, timeout):
+        """
+        :param timeout: True if the loss was detected by the retransmission timer.
+        """
+
+    # Returns the number of packets per second the pacer should allow, None to disable pacing.
+    def pacing_rate(self, rtt_estimator):
+        if rtt_estimator.srtt is None or rtt_estimator.srtt <= 0:
+            return None
+        return PACING_GAIN * self.cwnd / rtt_estimator.srtt
+
+    def clamp_window(self, cwnd):
+        return min(max(cwnd, MIN_WINDOW), self.max_window)
+
+
+# Window based AIMD congestion control in the style of TCP Reno/NewReno.
+class RenoController(CongestionController):
+    def __init__(self, max_window):
+        super().__init__(max_window)
+        self.ssthresh = max_window
+
+    def on_ack(self, seq_no, rtt_estimator):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1  # Slow start, doubles the window every round trip
+        else:
+            self.cwnd += 1 / self.cwnd  # Congestion avoidance, one packet per round trip
+        self.cwnd = self.clamp_window(self.cwnd)
+
+    def reduce(self, timeout):
+        self.ssthresh = self.clamp_window(self.cwnd / 2)
+        self.cwnd = MIN_WINDOW if timeout else self.ssthresh
+
+
+# Rate based AIMD congestion control, the sending rate is controlled directly and the window follows it.
+class RateController(CongestionController):
+    def __init__(self, max_window):
+        super().__init__(max_window)
+        self.rate = None  # Packets per second, set from the first RTT sample
+        self.in_startup = True
+
+    def on_ack(self, seq_no, rtt_estimator):
+        srtt = rtt_estimator.srtt
+        if srtt is None or srtt <= 0:
+            return
+        if self.rate is None:
+            self.rate = self.cwnd / srtt
+
+        if self.in_startup:
+            self.rate += 1 / srtt  # Doubles the rate every round trip
+        else:
+            self.rate += 1 / (self.rate * srtt * srtt)  # One more packet per round trip, every round trip
+
+        # Allow twice the bandwidth-delay product in flight, the pacer is what limits the rate
+        self.rate = min(self.rate, self.max_window / srtt)
+        self.cwnd = self.clamp_window(2 * self.rate * srtt)
+
+    def reduce(self, timeout):
+        self.in_startup = False
+        if self.rate is not None:
+            self.rate *= 0.5 if timeout else RATE_DECREASE_FACTOR
+        self.cwnd = self.clamp_window(self.cwnd / 2 if timeout else self.cwnd * RATE_DECREASE_FACTOR)
+
+    def pacing_rate(self, rtt_estimator):
+        return self.rate
+
+
+# Available congestion controllers by name.
+CONGESTION_CONTROLLERS = {
+    'reno': RenoController,
+    'rate': RateController,
+}
+
+
+# Creates a congestion controller from its name, see CONGESTION_CONTROLLERS.
+def create_congestion_controller(name, max_window):
+    """
+    :param name: Name of the congestion controller.
+    :param max_window: Upper bound of the congestion window.
+    """
+    if name not in CONGESTION_CONTROLLERS:
+        raise ValueError('Unknown congestion controller: {}'.format(name))
+    return CONGESTION_CONTROLLERS[name](max_window)
+
+
+# Token bucket pacer, spreads the sends of a window over the round trip instead of bursting them.
+class TokenBucket:
+    def __init__(self, burst=PACING_BURST):
+        """
+        :param burst: Maximum number of tokens, i.e. packets that can be sent back to back.
+        """
+        self.burst = burst
+        self.tokens = burst
+        self.rate = None  # Tokens per second, None means unlimited
+        self.last_refill = None
+
+    # Adds the tokens accumulated since the last refill and applies the new rate.
+    def refill(self, now, rate):
+        """
+        :param now: Current timestamp.
+        :param rate: Tokens per second from now on, None for unlimited.
+        """
+        if self.last_refill is not None and self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        elif self.rate is None:
+            self.tokens = self.burst
+        self.last_refill = now
+        self.rate = rate
+
+    # Returns True if a packet may be sent now.
+    def can_send(self):
+        return self.rate is None or self.tokens >= 1
+
+    # Takes the token of a sent packet, retransmissions may drive the bucket into debt.
+    def consume(self):
+        if self.rate is not None:
+            self.tokens -= 1
+
+    # Returns the time in seconds until the next token is available.
+    def time_until_ready(self):
+        if self.can_send():
+            return 0
+        return (1 - self.tokens) / self.rate
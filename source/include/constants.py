@@ -1,8 +1,27 @@
 # Maximum Segment Size
 MSS_VALUE = 8000
 
-# The time to be waited before retransmitting
-TIMEOUT = 0.008
+# The time to be waited before retransmitting, used until the first RTT sample arrives
+TIMEOUT = 0.1
+
+# Bounds of the adaptive retransmission timeout, the lower one well above ACK_DELAY and the scheduling jitter of the hosts
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 2.0
+
+# Version of the wire format, carried in the first byte of every packet and TCP frame
+PROTOCOL_VERSION = 6
+
+# Size in bytes for the protocol version field
+VERSION_BYTES = 1
+
+# Size in bytes for the packet flags field
+FLAGS_BYTES = 1
+
+# Size in bytes for the index of a packet in its FEC parity group
+FEC_INDEX_BYTES = 1
+
+# Size in bytes for the connection ID, which tells apart the transfers served on one port
+CONNECTION_ID_BYTES = 4
 
 # Size of sequence number in bytes
 SEQUENCE_NUM_BYTES = 4
@@ -10,23 +29,48 @@ SEQUENCE_NUM_BYTES = 4
 # Size in bytes for timestamp
 TIMESTAMP_BYTES = 8
 
-# Size of ACK packets in RDTOverUDP
-ACK_PACKET_SIZE = TIMESTAMP_BYTES + SEQUENCE_NUM_BYTES
+# Length of the CRC32 checksum in bytes
+CHECKSUM_LENGTH_BYTES = 4
+
+# Size in bytes for the receive window advertised in ACKs
+RECEIVE_WINDOW_BYTES = 4
+
+# Size in bytes for the length of the selective ACK bitmap
+SACK_LENGTH_BYTES = 2
+
+# Header size of ACK packets in RDTOverUDP, the selective ACK bitmap follows it
+ACK_HEADER_SIZE = VERSION_BYTES + FLAGS_BYTES + CONNECTION_ID_BYTES + SEQUENCE_NUM_BYTES + TIMESTAMP_BYTES + RECEIVE_WINDOW_BYTES + SACK_LENGTH_BYTES + CHECKSUM_LENGTH_BYTES
+
+# Number of in-order packets acknowledged together by a delayed ACK, the most a receiver proposes in its handshake
+ACK_EVERY_PACKETS = 2
+
+# Maximum time an ACK may be delayed
+ACK_DELAY = 0.002
+
+# The time the receiver waits for a packet before giving up on the transmission
+RECEIVE_TIMEOUT = 15
 
 # Size in bytes for data length field
 DATA_LENGTH_SIZE_BYTES = 4
 
-# Header size for TCP based file transmission
-TCP_HEADER_BYTES = TIMESTAMP_BYTES + DATA_LENGTH_SIZE_BYTES
+# Size in bytes for the file length field of TCP transmission
+FILE_LENGTH_BYTES = 8
 
-# Maximum data size per chunk for TCP transmission
-TCP_MAX_CHUNK_SIZE = MSS_VALUE - TCP_HEADER_BYTES
+# Size in bytes for the file name length field of TCP transmission
+NAME_LENGTH_BYTES = 2
+
+# Header size for TCP based file transmission, a single header frame with the file name precedes every file
+TCP_HEADER_BYTES = VERSION_BYTES + FLAGS_BYTES + TIMESTAMP_BYTES + FILE_LENGTH_BYTES + NAME_LENGTH_BYTES
+
+# Size of the reusable buffer a file received over TCP is read into
+TCP_RECEIVE_BUFFER_SIZE = 256 * 1024
 
-# Length of checksum string in bytes
-CHECKSUM_LENGTH_BYTES = 16
 
 # Header size for RDTOverUDP send packages
-RDT_SEND_HEADER_SIZE = SEQUENCE_NUM_BYTES + TIMESTAMP_BYTES + CHECKSUM_LENGTH_BYTES + DATA_LENGTH_SIZE_BYTES
+RDT_SEND_HEADER_SIZE = VERSION_BYTES + FLAGS_BYTES + FEC_INDEX_BYTES + CONNECTION_ID_BYTES + SEQUENCE_NUM_BYTES + TIMESTAMP_BYTES + DATA_LENGTH_SIZE_BYTES + CHECKSUM_LENGTH_BYTES
+
+# Size in bytes for the prefix of FEC parity payloads, the XOR of the chunk lengths
+PARITY_HEADER_BYTES = 4
 
-# Maximum data size per chunk for UDP transmission
-UDP_MAX_CHUNK_SIZE = MSS_VALUE - RDT_SEND_HEADER_SIZE
+# Maximum data size per chunk for UDP transmission, leaves room for a parity packet covering full chunks
+UDP_MAX_CHUNK_SIZE = MSS_VALUE - RDT_SEND_HEADER_SIZE - PARITY_HEADER_BYTES
@@ -0,0 +1,132 @@
+import struct
+
+# Packet flag of data packets protected by a parity packet
+FLAG_FEC = 0x01
+
+# Packet flag of parity packets
+FLAG_PARITY = 0x02
+
+# Bounds of the number of data packets covered by one parity packet, the group index is carried in one byte
+MIN_FEC_GROUP_SIZE = 2
+MAX_FEC_GROUP_SIZE = 255
+
+# Below this loss rate the adaptive mode sends no parity at all
+FEC_MIN_LOSS_RATE = 0.005
+
+# Gain of the loss rate filter, roughly the number of packets it averages over is its inverse
+LOSS_RATE_GAIN = 1 / 32
+
+# Payload prefix of parity packets: XOR of the lengths of the covered chunks, PARITY_HEADER_BYTES long
+PARITY_HEADER = struct.Struct('!I')
+
+
+# Returns the number of data packets per parity packet for a redundancy ratio, 0 if FEC is disabled.
+def group_size_for_ratio(ratio):
+    """
+    :param ratio: Parity packets per data packet, e.g. 0.125 for one parity packet every 8 data packets.
+    """
+    if not ratio or ratio <= 0:
+        return 0
+    return min(max(round(1 / ratio), MIN_FEC_GROUP_SIZE), MAX_FEC_GROUP_SIZE)
+
+
+# Exponentially weighted estimate of the packet loss rate seen by the sender.
+class LossRateEstimator:
+    def __init__(self):
+        self.rate = 0.0
+
+    def on_delivered(self):
+        self.rate -= LOSS_RATE_GAIN * self.rate
+
+    def on_lost(self):
+        self.rate += LOSS_RATE_GAIN * (1 - self.rate)
+
+    # Redundancy that recovers most single losses per group: about one parity packet per 1 / (2 * loss rate) packets.
+    def redundancy_ratio(self):
+        if self.rate < FEC_MIN_LOSS_RATE:
+            return 0
+        return 2 * self.rate
+
+
+# Builds the XOR parity of a group of chunks on the sender side.
+# Chunks are XORed as little endian integers, so shorter chunks are implicitly padded with zeros.
+class ParityEncoder:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.parity = 0
+        self.length_parity = 0
+        self.max_length = 0
+        self.count = 0
+
+    # Adds a data chunk to the current group.
+    def add(self, chunk):
+        self.parity ^= int.from_bytes(chunk, 'little')
+        self.length_parity ^= len(chunk)
+        self.max_length = max(self.max_length, len(chunk))
+        self.count += 1
+
+    # Returns the payload of the parity packet of the current group.
+    def pack_parity(self):
+        return PARITY_HEADER.pack(self.length_parity) + self.parity.to_bytes(self.max_length, 'little')
+
+
+# Receiver side state of a parity group, the XOR of the chunks received so far and the parity once it arrives.
+class ParityGroup:
+    def __init__(self):
+        self.parity = 0
+        self.length_parity = 0
+        self.received_count = 0
+        self.count = None  # Number of data packets in the group, known once the parity packet arrived
+        self.parity_payload = None
+
+    # Returns the missing chunk if the group has its parity and lacks exactly one data chunk, otherwise None.
+    def recover(self):
+        if self.parity_payload is None or self.received_count != self.count - 1:
+            return None
+        length = PARITY_HEADER.unpack_from(self.parity_payload)[0] ^ self.length_parity
+        parity = int.from_bytes(self.parity_payload[PARITY_HEADER.size:], 'little') ^ self.parity
+        return parity.to_bytes(len(self.parity_payload) - PARITY_HEADER.size, 'little')[:length]
+
+
+# Collects data and parity packets on the receiver side, groups are identified by the sequence number of their first packet.
+class ParityDecoder:
+    def __init__(self):
+        self.groups = {}
+
+    def get_group(self, group_start):
+        group = self.groups.get(group_start)
+        if group is None:
+            group = self.groups[group_start] = ParityGroup()
+        return group
+
+    # Adds a newly received data chunk to its group, returns the group.
+    def add_data(self, group_start, chunk):
+        group = self.get_group(group_start)
+        group.parity ^= int.from_bytes(chunk, 'little')
+        group.length_parity ^= len(chunk)
+        group.received_count += 1
+        return group
+
+    # Adds a parity packet to its group, returns the group.
+    def add_parity(self, group_start, count, payload):
+        """
+        :param group_start: Sequence number of the first data packet of the group.
+        :param count: Number of data packets in the group.
+        :param payload: Payload of the parity packet, copied since it may be a view of a reused buffer.
+        """
+        group = self.get_group(group_start)
+        group.count = count
+        group.parity_payload = bytes(payload)
+        return group
+
+    # Drops the state of a group that is complete or no longer needed.
+    def discard(self, group_start):
+        self.groups.pop(group_start, None)
+
+    # Drops the groups that lie entirely below the given sequence number.
+    def discard_before(self, seq_no):
+        for group_start, group in list(self.groups.items()):
+            if group_start + (group.count or MAX_FEC_GROUP_SIZE) <= seq_no:
+                del self.groups[group_start]
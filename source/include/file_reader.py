@@ -0,0 +1,92 @@
+import mmap
+import os
+import queue
+import threading
+
+# Chunks read by the producer thread of read_ahead_chunks at once, and the number of such blocks it may read ahead of the sender
+READ_AHEAD_BLOCK_CHUNKS = 64
+READ_AHEAD_BLOCKS = 4
+
+# Seconds the producer waits for room in the queue before checking whether the sender has stopped
+PRODUCER_POLL_INTERVAL = 0.1
+
+
+# Yields the chunks of a file as views of a read-only memory map, nothing is copied before the sender packs a chunk.
+# The kernel is asked to read the whole file in the background, so the page faults of the sender rarely wait for the disk.
+# The map is unmapped once the last view of it is gone.
+def mmap_chunks(filename, chunk_size):
+    """
+    :param filename: The path to the file to be chunked.
+    :param chunk_size: The size of each chunk.
+    """
+    with open(filename, 'rb') as file:
+        file_length = os.fstat(file.fileno()).st_size
+        if not file_length:
+            return  # Empty files can not be mapped
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # madvise is missing before Python 3.8 and on some platforms, the map works without it
+    for advice in ('MADV_SEQUENTIAL', 'MADV_WILLNEED'):
+        if hasattr(mapping, 'madvise') and hasattr(mmap, advice):
+            mapping.madvise(getattr(mmap, advice))
+
+    view = memoryview(mapping)
+    for offset in range(0, file_length, chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+# Yields the chunks of a file read by a background thread, so disk reads overlap with sending and waiting for ACKs.
+# The thread reads blocks of READ_AHEAD_BLOCK_CHUNKS chunks into a ring of preallocated buffers, at most READ_AHEAD_BLOCKS ahead.
+# The chunks are views of those buffers, each one is only valid until the next one is requested, as with chunk_file.
+def read_ahead_chunks(filename, chunk_size):
+    """
+    :param filename: The path to the file to be chunked.
+    :param chunk_size: The size of each chunk.
+    """
+    file = open(filename, 'rb')
+    block_size = READ_AHEAD_BLOCK_CHUNKS * chunk_size
+
+    # Besides the queued blocks, the sender holds one and the producer fills one, so the ring never overwrites a block in use
+    buffers = [memoryview(bytearray(block_size)) for _ in range(READ_AHEAD_BLOCKS + 2)]
+    blocks = queue.Queue(READ_AHEAD_BLOCKS)
+    stopped = threading.Event()
+
+    # Queues a block, a read error, or None at the end of the file, gives up once the sender has stopped.
+    def put(item):
+        while not stopped.is_set():
+            try:
+                blocks.put(item, timeout=PRODUCER_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        with file:
+            index = 0
+            while True:
+                buffer = buffers[index % len(buffers)]
+                try:
+                    size = file.readinto(buffer)
+                except OSError as error:
+                    put(error)
+                    return
+                if not size:
+                    put(None)
+                    return
+                if not put(buffer[:size]):
+                    return
+                index += 1
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, OSError):
+                raise block
+            for offset in range(0, len(block), chunk_size):
+                yield block[offset:offset + chunk_size]
+    finally:
+        stopped.set()
@@ -0,0 +1,36 @@
+import os
+
+# Writes chunks straight to their offset in the output file, so they can be stored in any order.
+# Every chunk but the last one must be chunk_size bytes long, as produced by chunk_file.
+class PositionalWriter:
+    def __init__(self, fd, chunk_size, base_offset=0):
+        """
+        :param fd: File descriptor of the output file, opened for writing.
+        :param chunk_size: Size of the chunks, the chunk with sequence number n starts at n * chunk_size.
+        :param base_offset: Offset of the chunk with sequence number 0 in the file.
+        """
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.base_offset = base_offset
+
+    # Writes the chunk with the given sequence number at its offset.
+    def write(self, seq_no, chunk):
+        """
+        :param seq_no: Sequence number of the chunk.
+        :param chunk: The data, any bytes-like object.
+        """
+        offset = self.base_offset + seq_no * self.chunk_size
+        view = memoryview(chunk)
+        while view:
+            written = pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+
+# os.pwrite is not available on every platform, fall back to seek and write there
+if hasattr(os, 'pwrite'):
+    pwrite = os.pwrite
+else:
+    def pwrite(fd, data, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
@@ -0,0 +1,292 @@
+import socket
+import struct
+import time
+from . import constants
+from .utils import get_checksum, check_checksum
+from .manifest import MANIFEST_HASH_BYTES, MANIFEST_HEADER, load_manifest, pack_plan, plan_blocks, unpack_manifest
+
+# Packet flag of control packets: connection setup and teardown, path MTU probes
+FLAG_CONTROL = 0x04
+
+# Kinds of control packets
+CONTROL_SYN = 1  # Client to server: connection request with the proposed parameters and the file name
+CONTROL_SYN_ACK = 2  # Server to client: the agreed parameters, the client acknowledges it with a regular ACK
+CONTROL_PROBE = 3  # Server to client: padded to the datagram size being probed
+CONTROL_PROBE_ACK = 4  # Client to server: the size of a probe that arrived
+CONTROL_FIN = 5  # Server to client: end of the data, the client answers with a final ACK carrying FLAG_FIN
+
+# Header of control packets: version, flags, kind, connection ID, timestamp, checksum over the body and the header
+CONTROL_HEADER = struct.Struct('!BBBIdI')
+
+# Connection parameters, proposed in a SYN and agreed in a SYN-ACK:
+# largest datagram, window in packets, in-order packets per ACK, options
+CONNECTION_PARAMETERS = struct.Struct('!HHBB')
+
+# Length prefix of the file name at the end of a SYN
+NAME_LENGTH = struct.Struct('!H')
+
+# Body of a PROBE_ACK, the size of the probe
+PROBE_SIZE = struct.Struct('!H')
+
+# Body of a FIN, the sequence number following the last data packet, i.e. the number of packets
+FIN_SEQUENCE = struct.Struct('!I')
+
+# Options, the agreed options are the ones both sides support
+OPTION_SACK = 0x01  # ACKs carry the selective ACK bitmap, otherwise only the cumulative ACK
+OPTION_FEC = 0x02  # The receiver rebuilds lost chunks from parity packets
+OPTION_PMTU_PROBE = 0x04  # The sender probes the path MTU before the transfer
+OPTION_SESSION = 0x08  # The name is a batch of file names and glob patterns, sent back to back in one stream, see session.py
+OPTION_ZLIB = 0x10  # Chunks that shrink are sent compressed with zlib, see compression.py
+OPTION_LZMA = 0x20  # Chunks that shrink are sent compressed with raw LZMA2
+OPTION_RESUME = 0x40  # The SYN carries the manifest of the client's copy, only the blocks it lacks are sent, see manifest.py
+DEFAULT_OPTIONS = OPTION_SACK | OPTION_FEC
+
+# IPv4 and UDP header bytes in front of every datagram
+IPV4_UDP_OVERHEAD = 28
+
+# Linux socket options to read the route MTU and to set the don't fragment bit, not exported everywhere
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_WANT = getattr(socket, 'IP_PMTUDISC_WANT', 1)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+
+# Datagram sizes probed below the agreed one: Ethernet, PPPoE and the IPv6 minimum MTU, the last one is always assumed to pass
+PROBE_SIZES = (1472, 1452, 1232)
+MIN_DATAGRAM_SIZE = PROBE_SIZES[-1]
+
+# Time waited for the answers to a round of probes, and the number of rounds
+PROBE_TIMEOUT = 2 * constants.TIMEOUT
+PROBE_ROUNDS = 2
+
+# Number of SYNs sent before the client gives up, the wait doubles after every one
+HANDSHAKE_RETRIES = 6
+
+
+# Parameters of a connection, proposed by each side and agreed by the server.
+class ConnectionParameters:
+    def __init__(self, max_datagram, window, ack_every, options=DEFAULT_OPTIONS):
+        """
+        :param max_datagram: Largest datagram, header included, that is sent on the connection.
+        :param window: Window size in packets.
+        :param ack_every: Number of in-order packets acknowledged by one ACK.
+        :param options: Bitwise OR of the OPTION_ flags.
+        """
+        self.max_datagram = max_datagram
+        self.window = window
+        self.ack_every = ack_every
+        self.options = options
+
+    # Returns the chunk size of data packets.
+    def chunk_size(self):
+        return chunk_size_for(self.max_datagram)
+
+    def pack(self):
+        return CONNECTION_PARAMETERS.pack(self.max_datagram, self.window, self.ack_every, self.options)
+
+
+# Returns the chunk size of data packets of the given largest datagram, leaving room for the parity packets covering full chunks.
+def chunk_size_for(max_datagram):
+    return max_datagram - constants.RDT_SEND_HEADER_SIZE - constants.PARITY_HEADER_BYTES
+
+
+# Unpacks connection parameters from the start of a control packet body.
+def unpack_parameters(body):
+    return ConnectionParameters(*CONNECTION_PARAMETERS.unpack_from(body))
+
+
+# Agrees on the parameters of a connection: the smaller of both sides for sizes, the common options.
+def negotiate(proposed, supported):
+    """
+    :param proposed: The ConnectionParameters of the client's SYN.
+    :param supported: The ConnectionParameters the server is able to use.
+    """
+    return ConnectionParameters(max(min(proposed.max_datagram, supported.max_datagram), MIN_DATAGRAM_SIZE),
+                                min(proposed.window, supported.window),
+                                max(min(proposed.ack_every, supported.ack_every), 1),
+                                proposed.options & supported.options)
+
+
+# Returns the largest datagram that leaves the host toward the address without IP fragmentation,
+# from the MTU of the route (Linux), capped at MSS_VALUE.
+def route_max_datagram(address):
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe_socket:
+            probe_socket.connect(address)
+            mtu = probe_socket.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return constants.MSS_VALUE
+    return max(min(mtu - IPV4_UDP_OVERHEAD, constants.MSS_VALUE), MIN_DATAGRAM_SIZE)
+
+
+# Packs a control packet, the checksum covers the body followed by the rest of the header.
+def pack_control(kind, connection_id, body=b'', timestamp=None):
+    """
+    :param kind: One of the CONTROL_ kinds.
+    :param connection_id: ID of the connection.
+    :param body: The kind specific body.
+    :param timestamp: Send timestamp, echoed by the ACK of a SYN-ACK.
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    header = bytearray(CONTROL_HEADER.size)
+    CONTROL_HEADER.pack_into(header, 0, constants.PROTOCOL_VERSION, FLAG_CONTROL, kind, connection_id, timestamp, 0)
+    checksum = get_checksum(header[:-constants.CHECKSUM_LENGTH_BYTES], get_checksum(body))
+    struct.pack_into('!I', header, CONTROL_HEADER.size - constants.CHECKSUM_LENGTH_BYTES, checksum)
+    return bytes(header) + bytes(body)
+
+
+# Unpacks a control packet, returns kind, connection ID, timestamp and body, or None if it is not a valid control packet.
+def unpack_control(data):
+    if len(data) < CONTROL_HEADER.size:
+        return None
+    version, flags, kind, connection_id, timestamp, checksum = CONTROL_HEADER.unpack_from(data)
+    if version != constants.PROTOCOL_VERSION or not flags & FLAG_CONTROL:
+        return None
+    body = data[CONTROL_HEADER.size:]
+    if not check_checksum(checksum, data[:CONTROL_HEADER.size - constants.CHECKSUM_LENGTH_BYTES], get_checksum(body)):
+        return None
+    return kind, connection_id, timestamp, body
+
+
+# Returns True if the datagram is a control packet of this protocol version, without verifying it.
+def is_control_packet(data):
+    return len(data) >= 2 and data[0] == constants.PROTOCOL_VERSION and data[1] & FLAG_CONTROL
+
+
+# Packs the SYN of a connection request, the manifest of a resumed transfer follows the name.
+def pack_syn(connection_id, filename, parameters, manifest=None):
+    name = filename.encode()
+    body = parameters.pack() + NAME_LENGTH.pack(len(name)) + name
+    if manifest is not None:
+        body += manifest.pack()
+    return pack_control(CONTROL_SYN, connection_id, body)
+
+
+# Returns the largest number of blocks whose manifest fits in a SYN next to the file name.
+def max_manifest_blocks(filename):
+    room = (MIN_DATAGRAM_SIZE - CONTROL_HEADER.size - CONNECTION_PARAMETERS.size - NAME_LENGTH.size
+            - len(filename.encode()) - MANIFEST_HEADER.size)
+    return max(room // MANIFEST_HASH_BYTES, 0)
+
+
+# A connection request received by the server.
+class ConnectionRequest:
+    def __init__(self, address, connection_id, filename, parameters, manifest=None):
+        """
+        :param address: Address the SYN came from, the client's receiving socket.
+        :param connection_id: ID chosen by the client.
+        :param filename: The requested file.
+        :param parameters: The ConnectionParameters proposed by the client.
+        :param manifest: Manifest of the client's copy if it proposed OPTION_RESUME.
+        """
+        self.address = address
+        self.connection_id = connection_id
+        self.filename = filename
+        self.parameters = parameters
+        self.manifest = manifest
+
+
+# Parses a SYN, returns a ConnectionRequest or None if the datagram is not a valid SYN.
+def parse_request(data, address):
+    result = unpack_control(data)
+    if result is None or result[0] != CONTROL_SYN:
+        return None
+    _, connection_id, _, body = result
+    if len(body) < CONNECTION_PARAMETERS.size + NAME_LENGTH.size:
+        return None
+    name_length = NAME_LENGTH.unpack_from(body, CONNECTION_PARAMETERS.size)[0]
+    name_end = CONNECTION_PARAMETERS.size + NAME_LENGTH.size + name_length
+    name = bytes(body[CONNECTION_PARAMETERS.size + NAME_LENGTH.size:name_end])
+    parameters = unpack_parameters(body)
+    manifest = None
+    if parameters.options & OPTION_RESUME:
+        manifest = unpack_manifest(body[name_end:])
+        if manifest is None:
+            parameters.options &= ~OPTION_RESUME
+    return ConnectionRequest(address, connection_id, name.decode(errors='replace'), parameters, manifest)
+
+
+# Finds the largest datagram size that reaches the client without fragmentation, by sending padded probes
+# with the don't fragment bit set. Blocks on the socket for at most PROBE_ROUNDS * PROBE_TIMEOUT.
+def probe_path(sock, address, connection_id, max_datagram):
+    """
+    :param sock: The sender's socket, the client answers probes to it.
+    :param address: Address of the client.
+    :param connection_id: ID of the connection, probes of other connections are ignored by the client.
+    :param max_datagram: Largest size worth probing, the agreed maximum.
+    """
+    sizes = [max_datagram] + [size for size in PROBE_SIZES if size < max_datagram]
+    best = MIN_DATAGRAM_SIZE
+    previous_timeout = sock.gettimeout()
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    except OSError:
+        return max_datagram  # The don't fragment bit can not be set, probes would pass fragmented
+
+    try:
+        for _ in range(PROBE_ROUNDS):
+            for size in sizes:
+                if size <= best:
+                    continue
+                try:
+                    sock.sendto(pack_control(CONTROL_PROBE, connection_id, bytes(size - CONTROL_HEADER.size)), address)
+                except OSError:
+                    pass  # Larger than the MTU of the local interface
+
+            # Answers arrive in any order, stop early once the largest probe is confirmed
+            deadline = time.monotonic() + PROBE_TIMEOUT
+            while best < sizes[0] and time.monotonic() < deadline:
+                sock.settimeout(max(deadline - time.monotonic(), 0.0001))
+                try:
+                    data, _ = sock.recvfrom(constants.MSS_VALUE)
+                except socket.timeout:
+                    break
+                result = unpack_control(data)
+                if result is not None and result[0] == CONTROL_PROBE_ACK and result[1] == connection_id:
+                    best = max(best, PROBE_SIZE.unpack_from(result[3])[0])
+            if best == sizes[0]:
+                break
+    finally:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_WANT)
+        sock.settimeout(previous_timeout)
+    return best
+
+
+# Returns the parameters a server agrees to for a request: the client's proposal capped by the route MTU, the given window
+# and options. The path MTU is probed first if both sides asked for it and the server's socket is given.
+def agree_parameters(request, window, options=DEFAULT_OPTIONS, sock=None):
+    """
+    :param request: The ConnectionRequest.
+    :param window: Largest window the server sends with.
+    :param options: Options the server supports.
+    :param sock: The socket the transfer is sent from, probes need the client's answers on it.
+    """
+    supported = ConnectionParameters(route_max_datagram(request.address), window, constants.ACK_EVERY_PACKETS, options)
+    parameters = negotiate(request.parameters, supported)
+    if parameters.options & OPTION_SESSION:
+        parameters.options &= ~OPTION_RESUME  # A batch is not resumed, its files are sent whole
+    if parameters.options & OPTION_PMTU_PROBE:
+        if sock is None:
+            parameters.options &= ~OPTION_PMTU_PROBE
+        else:
+            parameters.max_datagram = probe_path(sock, request.address, request.connection_id, parameters.max_datagram)
+    return parameters
+
+
+# Plans a resumed transfer from the manifest of the client's copy: the blocks of the file that differ from it.
+# Returns the numbers of the blocks and the packed plan for the SYN-ACK. If the plan does not fit in the SYN-ACK,
+# OPTION_RESUME is taken out of the parameters and None is returned, the whole file is then sent.
+# Hashing a large file takes a while, asynchronous servers run this in an executor.
+def plan_resume(request, parameters):
+    """
+    :param request: The ConnectionRequest, with the client's manifest.
+    :param parameters: The ConnectionParameters agreed for the request, with OPTION_RESUME.
+    """
+    remote_manifest = request.manifest
+    manifest = load_manifest(request.filename, remote_manifest.block_size)
+    blocks = plan_blocks(manifest, remote_manifest)
+    plan = pack_plan(manifest.file_length, manifest.block_size, blocks)
+    if CONTROL_HEADER.size + CONNECTION_PARAMETERS.size + len(plan) > MIN_DATAGRAM_SIZE:
+        parameters.options &= ~OPTION_RESUME
+        return None
+    return blocks, plan
@@ -0,0 +1,314 @@
+import hashlib
+import os
+import struct
+from .file_writer import pwrite
+
+# Bytes of the hash of a block, a truncated BLAKE2b
+MANIFEST_HASH_BYTES = 8
+
+# Hash of a block whose content is not known, e.g. one cut short by an aborted transfer, it is sent again
+INVALID_HASH = bytes(MANIFEST_HASH_BYTES)
+
+# Smallest and largest block size, larger files get larger blocks so their manifest fits in one datagram
+MIN_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 1 << 30
+
+# Manifest on the wire: file length, block size, then the hash of every block
+MANIFEST_HEADER = struct.Struct('!QI')
+
+# Cached manifest stored beside a file: file length, modification time in nanoseconds, block size, then the hashes.
+# It is only used while the length and the modification time of the file still match.
+MANIFEST_CACHE_HEADER = struct.Struct('!QqI')
+MANIFEST_CACHE_SUFFIX = '.manifest'
+
+# Plan of a resumed transfer, sent by the sender in the SYN-ACK: file length, block size, then a bitmap of the blocks
+# that follow in the data stream, bit i of the little endian bitmap for block i
+RESUME_PLAN_HEADER = struct.Struct('!QI')
+
+
+# Hashes of the blocks of a file, the receiver's tells the sender which blocks it already has.
+class Manifest:
+    def __init__(self, file_length, block_size, hashes):
+        """
+        :param file_length: Length of the file.
+        :param block_size: Size of the blocks, the last one may be shorter.
+        :param hashes: The hash of every block, in file order.
+        """
+        self.file_length = file_length
+        self.block_size = block_size
+        self.hashes = hashes
+
+    def pack(self):
+        return MANIFEST_HEADER.pack(self.file_length, self.block_size) + b''.join(self.hashes)
+
+
+# Unpacks a manifest, returns None if the data is not a valid one.
+def unpack_manifest(data):
+    if len(data) < MANIFEST_HEADER.size:
+        return None
+    file_length, block_size = MANIFEST_HEADER.unpack_from(data)
+    hashes = bytes(data[MANIFEST_HEADER.size:])
+    if not is_block_size(block_size) or len(hashes) != block_count(file_length, block_size) * MANIFEST_HASH_BYTES:
+        return None
+    return Manifest(file_length, block_size, [hashes[i:i + MANIFEST_HASH_BYTES] for i in range(0, len(hashes), MANIFEST_HASH_BYTES)])
+
+
+# Returns True for the block sizes block_size_for picks, others are refused so a peer can not make blocks arbitrarily large.
+def is_block_size(block_size):
+    return MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE and not block_size & (block_size - 1)
+
+
+def block_count(file_length, block_size):
+    return (file_length + block_size - 1) // block_size
+
+
+# Returns the smallest block size, MIN_BLOCK_SIZE times a power of two, that splits the file into at most max_blocks blocks.
+def block_size_for(file_length, max_blocks):
+    block_size = MIN_BLOCK_SIZE
+    while block_count(file_length, block_size) > max_blocks and block_size < MAX_BLOCK_SIZE:
+        block_size *= 2
+    return block_size
+
+
+# Hashes the block of an open file at the given offset, reading it in pieces of MIN_BLOCK_SIZE.
+# Returns the hash and the length of the block, shorter than block_size at the end of the file.
+def hash_block(file, offset, block_size, buffer):
+    """
+    :param file: The file, opened for reading in binary mode.
+    :param offset: Offset of the block.
+    :param block_size: Size of the blocks.
+    :param buffer: A writable memoryview of MIN_BLOCK_SIZE bytes.
+    """
+    block_hash = hashlib.blake2b(digest_size=MANIFEST_HASH_BYTES)
+    file.seek(offset)
+    length = 0
+    while length < block_size:
+        size = file.readinto(buffer[:block_size - length])
+        if not size:
+            break
+        block_hash.update(buffer[:size])
+        length += size
+    return block_hash.digest(), length
+
+
+# Hashes every block of a file.
+def compute_manifest(path, block_size):
+    """
+    :param path: The path to the file.
+    :param block_size: Size of the blocks.
+    """
+    buffer = memoryview(bytearray(MIN_BLOCK_SIZE))
+    with open(path, 'rb') as file:
+        file_length = os.fstat(file.fileno()).st_size
+        hashes = [hash_block(file, offset, block_size, buffer)[0] for offset in range(0, file_length, block_size)]
+    return Manifest(file_length, block_size, hashes)
+
+
+# Returns the path of the cached manifest of a file, a hidden file beside it.
+def manifest_cache_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.' + name + MANIFEST_CACHE_SUFFIX)
+
+
+# Returns the manifest of a file, from its cache if the file has not changed since, otherwise hashed and cached.
+def load_manifest(path, block_size):
+    """
+    :param path: The path to the file.
+    :param block_size: Size of the blocks, a cached manifest with other blocks is not used.
+    """
+    manifest = read_cached_manifest(path, block_size)
+    if manifest is None:
+        manifest = compute_manifest(path, block_size)
+        store_manifest(path, manifest)
+    return manifest
+
+
+# Reads the cached manifest of a file, returns None if there is none or the file changed after it was stored.
+def read_cached_manifest(path, block_size):
+    try:
+        status = os.stat(path)
+        with open(manifest_cache_path(path), 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    if len(data) < MANIFEST_CACHE_HEADER.size:
+        return None
+    file_length, modification_time, cached_block_size = MANIFEST_CACHE_HEADER.unpack_from(data)
+    if (file_length, modification_time, cached_block_size) != (status.st_size, status.st_mtime_ns, block_size):
+        return None
+    return unpack_manifest(MANIFEST_HEADER.pack(file_length, block_size) + data[MANIFEST_CACHE_HEADER.size:])
+
+
+# Caches the manifest of a file beside it, tagged with the file's current length and modification time.
+# The cache is an optimization, a directory that can not be written to only means hashing again next time.
+def store_manifest(path, manifest):
+    cache_path = manifest_cache_path(path)
+    try:
+        status = os.stat(path)
+        if status.st_size != manifest.file_length:
+            return
+        with open(cache_path + '.tmp', 'wb') as file:
+            file.write(MANIFEST_CACHE_HEADER.pack(status.st_size, status.st_mtime_ns, manifest.block_size))
+            file.write(b''.join(manifest.hashes))
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError:
+        pass
+
+
+# Returns the numbers of the blocks of the sender's manifest that the receiver does not have.
+def plan_blocks(manifest, remote_manifest):
+    """
+    :param manifest: Manifest of the sender's file.
+    :param remote_manifest: Manifest of the receiver's copy, with the same block size.
+    """
+    remote_hashes = remote_manifest.hashes
+    return [index for index, block_hash in enumerate(manifest.hashes)
+            if index >= len(remote_hashes) or remote_hashes[index] != block_hash]
+
+
+def pack_plan(file_length, block_size, blocks):
+    bitmap = 0
+    for index in blocks:
+        bitmap |= 1 << index
+    return RESUME_PLAN_HEADER.pack(file_length, block_size) + bitmap.to_bytes((block_count(file_length, block_size) + 7) // 8, 'little')
+
+
+# Unpacks a resume plan, returns file length, block size and the numbers of the blocks sent, or None if it is not valid.
+def unpack_plan(data):
+    if len(data) < RESUME_PLAN_HEADER.size:
+        return None
+    file_length, block_size = RESUME_PLAN_HEADER.unpack_from(data)
+    if not is_block_size(block_size):
+        return None
+    count = block_count(file_length, block_size)
+    if len(data) - RESUME_PLAN_HEADER.size != (count + 7) // 8:
+        return None
+    bitmap = int.from_bytes(data[RESUME_PLAN_HEADER.size:], 'little')
+    return file_length, block_size, [index for index in range(count) if bitmap >> index & 1]
+
+
+# Yields the given blocks of a file as one stream split into chunks, every chunk but the last is chunk_size bytes long.
+# The chunks are views of a single reused buffer as in chunk_file.
+def chunk_blocks(filename, blocks, block_size, chunk_size):
+    """
+    :param filename: The path to the file.
+    :param blocks: Numbers of the blocks, in increasing order.
+    :param block_size: Size of the blocks.
+    :param chunk_size: The size of each chunk.
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    filled = 0
+    with open(filename, 'rb') as file:
+        for index in blocks:
+            file.seek(index * block_size)
+            remaining = block_size
+            while remaining:
+                size = file.readinto(buffer[filled:filled + min(remaining, chunk_size - filled)])
+                if not size:
+                    break  # The last block of the file
+                filled += size
+                remaining -= size
+                if filled == chunk_size:
+                    yield buffer
+                    filled = 0
+    if filled:
+        yield buffer[:filled]
+
+
+# Writes the chunks of a resumed transfer to the blocks of the file they belong to, and keeps track of the blocks
+# that were written completely. Without blocks the stream is the whole file, as with PositionalWriter.
+class BlockWriter:
+    def __init__(self, fd, chunk_size):
+        """
+        :param fd: File descriptor of the output file, opened for writing.
+        :param chunk_size: Size of the chunks, replaced by the agreed one in the handshake.
+        """
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.file_length = None
+        self.block_size = None
+        self.blocks = None
+        self.written = []  # Bytes written to every planned block
+        self.stream_length = 0  # Bytes written without a plan
+
+    # Sets the plan received in the SYN-ACK, the chunks then go to the planned blocks in order.
+    def set_plan(self, file_length, block_size, blocks):
+        self.file_length = file_length
+        self.block_size = block_size
+        self.blocks = blocks
+        self.written = [0] * len(blocks)
+
+    # Writes the chunk with the given sequence number, split at block boundaries.
+    def write(self, seq_no, chunk):
+        """
+        :param seq_no: Sequence number of the chunk, its offset in the stream is seq_no * chunk_size.
+        :param chunk: The data, any bytes-like object.
+        """
+        view = memoryview(chunk)
+        stream_offset = seq_no * self.chunk_size
+        if self.blocks is None:
+            self.stream_length = max(self.stream_length, stream_offset + len(view))
+            while view:
+                written = pwrite(self.fd, view, stream_offset)
+                view = view[written:]
+                stream_offset += written
+            return
+
+        while view:
+            position, offset = divmod(stream_offset, self.block_size)
+            size = min(len(view), self.block_size - offset)
+            file_offset = self.blocks[position] * self.block_size + offset
+            piece = view[:size]
+            while piece:
+                written = pwrite(self.fd, piece, file_offset)
+                piece = piece[written:]
+                file_offset += written
+            self.written[position] += size
+            view = view[size:]
+            stream_offset += size
+
+    # Returns True if the planned block at the given position in the plan has been written completely.
+    def is_complete(self, position):
+        index = self.blocks[position]
+        return self.written[position] == min(self.block_size, self.file_length - index * self.block_size)
+
+
+# Caches the manifest of a file received in a resumed transfer without hashing all of it again: blocks that were
+# not sent keep the hashes of the old copy, blocks written completely are hashed, blocks cut short get INVALID_HASH,
+# so an aborted transfer resumes with the blocks it is missing.
+def store_received_manifest(path, old_manifest, writer):
+    """
+    :param path: The path to the received file.
+    :param old_manifest: Manifest of the copy the transfer started from, sent in the SYN.
+    :param writer: The BlockWriter of the transfer, with its plan.
+    """
+    hashes = [old_manifest.hashes[index] if index < len(old_manifest.hashes) else INVALID_HASH
+              for index in range(block_count(writer.file_length, writer.block_size))]
+    buffer = memoryview(bytearray(MIN_BLOCK_SIZE))
+    with open(path, 'rb') as file:
+        for position, index in enumerate(writer.blocks):
+            hashes[index] = INVALID_HASH
+            if writer.is_complete(position):
+                hashes[index] = hash_block(file, index * writer.block_size, writer.block_size, buffer)[0]
+    store_manifest(path, Manifest(writer.file_length, writer.block_size, hashes))
+
+
+# Caches the manifest of a file received whole, without a plan, from a sender that could not resume the transfer.
+# The blocks within the part delivered in order are hashed, the others get INVALID_HASH, so an aborted transfer
+# resumes after that part instead of hashing the whole copy again.
+def store_stream_manifest(path, delivered_length, block_size):
+    """
+    :param path: The path to the received file.
+    :param delivered_length: Length of the start of the stream that was delivered in order, every byte of it is written.
+    :param block_size: Size of the blocks, the one the next transfer picks for the copy.
+    """
+    buffer = memoryview(bytearray(MIN_BLOCK_SIZE))
+    hashes = []
+    with open(path, 'rb') as file:
+        file_length = os.fstat(file.fileno()).st_size
+        for offset in range(0, file_length, block_size):
+            if min(offset + block_size, file_length) <= delivered_length:
+                hashes.append(hash_block(file, offset, block_size, buffer)[0])
+            else:
+                hashes.append(INVALID_HASH)
+    store_manifest(path, Manifest(file_length, block_size, hashes))
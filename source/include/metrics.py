@@ -0,0 +1,116 @@
+import json
+import math
+import time
+
+# Buckets per doubling of the histograms, percentiles are exact to within about 9%
+HISTOGRAM_BUCKETS_PER_OCTAVE = 8
+
+# Ranges of the histograms: durations in seconds, window occupancy in packets. Values outside land in the first or last bucket.
+DURATION_RANGE = (1e-5, 60.0)
+WINDOW_RANGE = (1, 1 << 16)
+
+# Seconds between two snapshots handed to the export hook while a transfer is running
+METRICS_INTERVAL = 1.0
+
+# Percentiles included in the summary of a histogram
+SUMMARY_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+# Histogram with logarithmic buckets over a fixed range, its memory does not grow with the number of values.
+class Histogram:
+    def __init__(self, min_value, max_value):
+        """
+        :param min_value: Upper bound of the first bucket.
+        :param max_value: Lower bound of the last bucket.
+        """
+        self.min_value = min_value
+        self.buckets = [0] * (int(math.log2(max_value / min_value) * HISTOGRAM_BUCKETS_PER_OCTAVE) + 2)
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        if value > self.min_value:
+            index = min(int(math.log2(value / self.min_value) * HISTOGRAM_BUCKETS_PER_OCTAVE) + 1, len(self.buckets) - 1)
+        else:
+            index = 0
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    # Returns the value below which the given fraction of the values lies, the upper bound of its bucket.
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        remaining = fraction * self.count
+        for index, bucket_count in enumerate(self.buckets):
+            remaining -= bucket_count
+            if remaining <= 0:
+                break
+        upper_bound = self.min_value * 2 ** (index / HISTOGRAM_BUCKETS_PER_OCTAVE)
+        return min(max(upper_bound, self.minimum), self.maximum)
+
+    # Returns count, mean, extremes and percentiles, ready for JSON.
+    def summary(self):
+        summary = dict(count=self.count, mean=self.mean(), min=self.minimum, max=self.maximum)
+        for fraction in SUMMARY_PERCENTILES:
+            summary['p{:g}'.format(fraction * 100)] = self.percentile(fraction)
+        return summary
+
+
+# Latency and occupancy histograms of a transfer, and the periodic export of its snapshots.
+# The counters are kept by the sender and the receiver themselves, they pass them in when a snapshot is taken.
+class TransferMetrics:
+    def __init__(self, export=None, interval=METRICS_INTERVAL):
+        """
+        :param export: Called with every snapshot, a dictionary ready for JSON, see export_json_lines. None disables reporting.
+        :param interval: Seconds between two snapshots while the transfer is running, a final one follows its end.
+        """
+        self.start_time = time.monotonic()
+        self.export = export
+        self.interval = interval
+        self.next_report = self.start_time + interval if export is not None else math.inf
+
+        self.rtt = Histogram(*DURATION_RANGE)  # Round trip times measured by the sender
+        self.window_occupancy = Histogram(*WINDOW_RANGE)  # Packets in flight at the sender, reordering distance at the receiver
+        self.delivery_gap = Histogram(*DURATION_RANGE)  # Time between two in-order deliveries at the receiver
+
+    # Returns a snapshot of the transfer: the given counters, the goodput and the histogram summaries.
+    def snapshot(self, role, delivered_bytes, final=False, **counters):
+        """
+        :param role: 'sender' or 'receiver'.
+        :param delivered_bytes: Payload bytes acknowledged by the receiver or delivered to the application.
+        :param final: True for the snapshot taken at the end of the transfer.
+        :param counters: Counters of the sender or the receiver.
+        """
+        elapsed = time.monotonic() - self.start_time
+        snapshot = dict(role=role, time=time.time(), elapsed=elapsed, final=final, delivered_bytes=delivered_bytes,
+                        goodput=delivered_bytes / elapsed if elapsed > 0 else 0.0)
+        snapshot.update(counters)
+        snapshot.update(rtt=self.rtt.summary(), window_occupancy=self.window_occupancy.summary(),
+                        delivery_gap=self.delivery_gap.summary())
+        return snapshot
+
+    # Hands a snapshot to the export hook and schedules the next one.
+    def report(self, snapshot):
+        self.export(snapshot)
+        self.next_report = time.monotonic() + self.interval
+
+
+# Returns an export hook that writes every snapshot as one JSON line to the given file.
+def export_json_lines(file):
+    """
+    :param file: A file opened for writing text, flushed after every line so live transfers can be followed.
+    """
+    def export(snapshot):
+        file.write(json.dumps(snapshot) + '\n')
+        file.flush()
+    return export
@@ -0,0 +1,241 @@
+import itertools
+import struct
+import threading
+import time
+from . import reliable_udp
+from .reliable_udp import STATE_RECEIVED, STATE_SENT
+
+# Packet events of the trace
+EVENT_SEND = 1  # Sender: first transmission of a data packet
+EVENT_RETRANSMIT = 2  # Sender: transmission of a data packet sent before
+EVENT_ACK = 3  # Sender: a data packet acknowledged for the first time
+EVENT_RECEIVE = 4  # Receiver: a data packet received or rebuilt for the first time
+EVENT_DELIVER = 5  # Receiver: a package handed to the application in order
+EVENT_NAMES = {EVENT_SEND: 'send', EVENT_RETRANSMIT: 'retransmit', EVENT_ACK: 'ack', EVENT_RECEIVE: 'receive',
+               EVENT_DELIVER: 'deliver'}
+
+# Record of the trace: nanoseconds since the trace started, event, lower 32 bits of the sequence number
+TRACE_RECORD = struct.Struct('<QBI')
+
+# Header of a trace file: magic, version, number of records, number of older records the ring overwrote
+TRACE_HEADER = struct.Struct('<4sBIQ')
+TRACE_MAGIC = b'RDTT'
+TRACE_VERSION = 1
+
+# Records kept by the ring, the latest ones win. About 850 KiB, a few seconds of a fast transfer.
+TRACE_CAPACITY = 1 << 16
+
+# Functions of reliable_udp timed while a profiler is attached, shared by the sender and the receiver and timed
+# for every transfer of the process
+MODULE_SECTIONS = ('pack_header_into', 'pack_package', 'unpack_package', 'decompress_data')
+
+# Profilers timing the module functions, in the order they patched them. The timers of the latest one are installed,
+# when it closes those of the one before it, and the original functions once every profiler is closed, in any order.
+MODULE_PROFILERS = []
+MODULE_ORIGINALS = {}  # The functions of reliable_udp before the first profiler patched them
+MODULE_LOCK = threading.Lock()  # The sender and the receiver of a profiled transfer may attach from different threads
+
+# Methods timed on an attached sender and receiver, their sections are prefixed with 'sender.' and 'receiver.'.
+# Times are inclusive, e.g. handle_ack contains the ack_packet calls.
+SENDER_SECTIONS = ('populate_window', 'send_packet', 'handle_ack', 'ack_packet', 'resend_packets', 'detect_lost_packets',
+                   'remove_acked_packets', 'send_datagram', 'flush_datagrams')
+RECEIVER_SECTIONS = ('mark_package_as_received_by_seq', 'recover_from_parity', 'send_ack', 'handle_control')
+
+# Socket calls timed on the sockets of attached transfers. Receiving includes the time blocked waiting for a datagram.
+SOCKET_SECTIONS = ('sendto', 'sendmsg', 'recvfrom', 'recvfrom_into', 'recvmsg_into')
+
+
+# Ring log of packet events in a preallocated buffer, recording one costs a clock read and a struct pack.
+class TraceLog:
+    def __init__(self, capacity=TRACE_CAPACITY):
+        """
+        :param capacity: Number of records kept, older ones are overwritten.
+        """
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * TRACE_RECORD.size)
+        self.count = 0  # Records ever written, the ring holds the last capacity of them
+        self.indexes = itertools.count()  # Hands out the slots, atomic when a sender and a receiver thread share the log
+        self.start_time = time.perf_counter_ns()
+
+    def record(self, event, seq_no):
+        index = next(self.indexes)
+        TRACE_RECORD.pack_into(self.buffer, index % self.capacity * TRACE_RECORD.size,
+                               time.perf_counter_ns() - self.start_time, event, seq_no & 0xFFFFFFFF)
+        self.count = max(self.count, index + 1)
+
+    # Writes the records in the order they were recorded.
+    def dump(self, file):
+        """
+        :param file: A file opened for writing in binary mode.
+        """
+        kept = min(self.count, self.capacity)
+        file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, kept, self.count - kept))
+        split = self.count % self.capacity * TRACE_RECORD.size if self.count > self.capacity else 0
+        file.write(self.buffer[split:kept * TRACE_RECORD.size])
+        file.write(self.buffer[:split])
+
+
+# Reads a trace file written by TraceLog.dump, yields seconds since the trace started, event name and sequence number.
+def read_trace(file):
+    """
+    :param file: A file opened for reading in binary mode.
+    """
+    magic, version, count, _ = TRACE_HEADER.unpack(file.read(TRACE_HEADER.size))
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError('Not a trace file of this version')
+    for timestamp, event, seq_no in TRACE_RECORD.iter_unpack(file.read(count * TRACE_RECORD.size)):
+        yield timestamp / 1e9, EVENT_NAMES.get(event, str(event)), seq_no
+
+
+# Sets the module functions of MODULE_SECTIONS to the timers of the latest profiler, or to the originals if there is none.
+# Called with MODULE_LOCK held.
+def install_module_functions():
+    functions = MODULE_PROFILERS[-1].module_functions if MODULE_PROFILERS else MODULE_ORIGINALS
+    for name, function in functions.items():
+        setattr(reliable_udp, name, function)
+
+
+# Wraps a socket so that its send and receive calls are timed, everything else is passed through.
+class TimedSocket:
+    def __init__(self, sock, profiler, role):
+        """
+        :param sock: The socket.
+        :param profiler: The Profiler whose sections the calls are added to.
+        :param role: 'sender' or 'receiver', the prefix of the sections.
+        """
+        self.socket = sock
+        for name in SOCKET_SECTIONS:
+            setattr(self, name, profiler.timed('{}.socket.{}'.format(role, name), getattr(sock, name)))
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+
+# Opt-in instrumentation of transfers: timers around the hot paths and a trace of packet events.
+# Nothing is instrumented unless a profiler is attached, the timers wrap the functions and methods of the attached
+# transfers, so transfers without one run the unmodified code.
+class Profiler:
+    def __init__(self, trace_capacity=TRACE_CAPACITY):
+        """
+        :param trace_capacity: Records kept by the packet event trace, 0 disables the trace.
+        """
+        self.sections = {}  # Calls and seconds spent by section name
+        self.trace = TraceLog(trace_capacity) if trace_capacity else None
+        self.module_functions = {}  # Timed module functions by name, installed while this profiler is in MODULE_PROFILERS
+
+    # Returns the function wrapped in a timer adding to the given section.
+    def timed(self, name, function):
+        section = self.sections.setdefault(name, [0, 0.0])
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                section[0] += 1
+                section[1] += clock() - start
+        return wrapper
+
+    # Times the module functions of MODULE_SECTIONS, once per profiler. The timers wrap the original functions,
+    # never those of another profiler, so nested profilers do not time each other.
+    def patch_module(self):
+        with MODULE_LOCK:
+            if self in MODULE_PROFILERS:
+                return
+            if not MODULE_PROFILERS:
+                MODULE_ORIGINALS.update((name, getattr(reliable_udp, name)) for name in MODULE_SECTIONS)
+            self.module_functions = {name: self.timed('reliable_udp.' + name, MODULE_ORIGINALS[name]) for name in MODULE_SECTIONS}
+            MODULE_PROFILERS.append(self)
+            install_module_functions()
+
+    # Times the given methods of a transfer by shadowing them with instance attributes.
+    def wrap_methods(self, transfer, role, names):
+        for name in names:
+            setattr(transfer, name, self.timed(role + '.' + name, getattr(transfer, name)))
+
+    # Returns the socket with timed send and receive calls.
+    def wrap_socket(self, sock, role):
+        """
+        :param sock: The socket of a transfer.
+        :param role: 'sender' or 'receiver', the prefix of the sections.
+        """
+        return sock if isinstance(sock, TimedSocket) else TimedSocket(sock, self, role)
+
+    # Instruments a UDPServer, called by its constructor when it is given this profiler.
+    def attach_sender(self, sender):
+        self.patch_module()
+        self.wrap_methods(sender, 'sender', SENDER_SECTIONS)
+        if sender.compressor is not None:
+            sender.compressor.compress = self.timed('sender.compress', sender.compressor.compress)
+        if self.trace is None:
+            return
+
+        trace = self.trace
+        send_packet, ack_packet = sender.send_packet, sender.ack_packet
+
+        def traced_send_packet(packet):
+            trace.record(EVENT_RETRANSMIT if packet.state == STATE_SENT else EVENT_SEND, packet.seq_no)
+            send_packet(packet)
+
+        def traced_ack_packet(seq_no):
+            packet = sender.window.get(seq_no)
+            if packet is not None and packet.state == STATE_SENT:
+                trace.record(EVENT_ACK, seq_no)
+            ack_packet(seq_no)
+
+        sender.send_packet, sender.ack_packet = traced_send_packet, traced_ack_packet
+
+    # Instruments a UDPClient, called by its constructor when it is given this profiler.
+    def attach_receiver(self, receiver):
+        self.patch_module()
+        self.wrap_methods(receiver, 'receiver', RECEIVER_SECTIONS)
+        if receiver.writer is not None:
+            receiver.writer.write = self.timed('receiver.write', receiver.writer.write)
+        if self.trace is None:
+            return
+
+        trace = self.trace
+        mark_received, process = receiver.mark_package_as_received_by_seq, receiver.process
+
+        def traced_mark_received(seq_no, *args, **kwargs):
+            package = receiver.window.get(seq_no)
+            if package is not None and package.state != STATE_RECEIVED:
+                trace.record(EVENT_RECEIVE, seq_no)
+            return mark_received(seq_no, *args, **kwargs)
+
+        def traced_process():
+            packages = process()
+            try:
+                for package in packages:
+                    trace.record(EVENT_DELIVER, package.seq_no)
+                    yield package
+            finally:
+                packages.close()
+
+        receiver.mark_package_as_received_by_seq, receiver.process = traced_mark_received, traced_process
+
+    # Stops timing the module functions, the instrumented transfers keep their timers. The module functions go back
+    # to the timers of a profiler patched in before and still open, or to the originals.
+    def close(self):
+        with MODULE_LOCK:
+            if self in MODULE_PROFILERS:
+                MODULE_PROFILERS.remove(self)
+                install_module_functions()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Returns calls, total and mean time of every section that ran, the most expensive first, ready for JSON.
+    def report(self):
+        rows = [dict(section=name, calls=calls, total=total, mean=total / calls)
+                for name, (calls, total) in self.sections.items() if calls]
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+    def print_report(self):
+        print('{:<40} {:>10} {:>12} {:>10}'.format('section', 'calls', 'total ms', 'mean us'))
+        for row in self.report():
+            print('{section:<40} {calls:>10} {0:>12.3f} {1:>10.2f}'.format(row['total'] * 1000, row['mean'] * 1e6, **row))
@@ -1,8 +1,23 @@
 import socket
 import struct
-import datetime
-from collections import deque
+import heapq
+import random
+import time
 from . import constants
+from .buffers import BufferPool
+from .batching import BatchReceiver, BatchSender
+from .utils import get_checksum, check_checksum
+from .rtt import RTTEstimator
+from .congestion import CongestionController, TokenBucket, create_congestion_controller
+from .metrics import METRICS_INTERVAL, TransferMetrics
+from .compression import COMPRESSION_OPTIONS, FLAG_COMPRESSED, ChunkCompressor, codec_for_options, decompress_data
+from .fec import FLAG_FEC, FLAG_PARITY, LossRateEstimator, ParityDecoder, ParityEncoder, group_size_for_ratio
+from .handshake import (CONNECTION_PARAMETERS, CONTROL_FIN, CONTROL_PROBE, CONTROL_PROBE_ACK, CONTROL_SYN_ACK, DEFAULT_OPTIONS,
+                        FIN_SEQUENCE, HANDSHAKE_RETRIES, OPTION_FEC, OPTION_RESUME, OPTION_SACK, PROBE_SIZE,
+                        ConnectionParameters, is_control_packet, pack_control, pack_syn, route_max_datagram, unpack_control,
+                        unpack_parameters)
+from .manifest import unpack_plan
+from .window import RingWindow, SEQUENCE_NUM_MODULO, unwrap_seq_no
 
 WINDOW_SIZE = 120
 
@@ -11,8 +26,42 @@ STATE_SENT = 1
 STATE_RECEIVED = 2
 STATE_ACKED = 3
 
-def get_timestamp():
-    return datetime.datetime.utcnow().timestamp()
+# Time the receiver keeps answering after its last delivery, in case its final ACK is lost,
+# at least LINGER_RTTS round trips measured in the handshake
+LINGER_TIME = 2 * constants.TIMEOUT
+LINGER_RTTS = 4
+
+# Number of times the sender repeats an unanswered FIN, the wait doubles every time. The receiver is gone if all of them are lost.
+FIN_RETRIES = 4
+
+# Shortest wait of the sender for an ACK, the pacer may allow the next packet sooner than any timer is due
+MIN_EVENT_WAIT = 0.001
+
+# A packet is considered lost once a packet this many sequence numbers later, sent after it, is acknowledged
+DUPLICATE_ACK_THRESHOLD = 3
+
+# Header of RDTOverUDP data packets: version, flags, FEC group index, connection ID, sequence number, timestamp, chunk length, checksum
+PACKAGE_HEADER = struct.Struct('!BBBIIdII')
+
+# Header of RDTOverUDP ACK packets: version, flags, connection ID, cumulative ACK, echoed timestamp, free window,
+# selective ACK bitmap length, checksum
+ACK_HEADER = struct.Struct('!BBIIdIHI')
+
+# Packet flag of ACKs, every packet starts with the version and the flags, so the kind of a datagram is known from two bytes
+FLAG_ACK = 0x08
+
+# Packet flag of the receiver's final ACK, sent once the FIN has arrived and every packet has been delivered
+FLAG_FIN = 0x10
+
+# The connection ID follows the version and the flags of ACKs, so a server can route them to their transfer without unpacking the rest
+CONNECTION_ID_FIELD = struct.Struct('!I')
+ACK_CONNECTION_ID_OFFSET = constants.VERSION_BYTES + constants.FLAGS_BYTES
+
+# The checksum closes both headers, it is the CRC32 of the payload followed by the rest of the header
+CHECKSUM_FIELD = struct.Struct('!I')
+
+# Monotonic clock, only compared with values from the same host (ACKs echo the sender's timestamps)
+get_timestamp = time.monotonic
 
 # A basic function to create and bind sockets
 def create_udp_socket(host_ip, port_number):
@@ -20,32 +69,58 @@ def create_udp_socket(host_ip, port_number):
     connection.bind((host_ip, port_number))
     return connection
 
-def pack_package(seq_no, chunk):
-    timestamp = get_timestamp()
+# Writes the packet header to the start of the buffer, the chunk is expected right after it.
+def pack_header_into(buffer, seq_no, timestamp, chunk_length, payload_checksum=None, flags=0, fec_index=0, connection_id=0):
+    """
+    :param buffer: A writable buffer of at least RDT_SEND_HEADER_SIZE bytes.
+    :param seq_no: Sequence number of the packet.
+    :param timestamp: Send timestamp of the packet.
+    :param chunk_length: Length of the chunk that follows the header.
+    :param payload_checksum: CRC32 of the chunk if already known, e.g. from a previous transmission.
+    :param flags: Packet flags, FLAG_FEC or FLAG_PARITY.
+    :param fec_index: Index of a FLAG_FEC packet in its parity group, the group size for a FLAG_PARITY packet.
+    :param connection_id: ID of the transfer the packet belongs to.
+    """
+    header_size = constants.RDT_SEND_HEADER_SIZE
+    if payload_checksum is None:
+        payload_checksum = get_checksum(buffer[header_size:header_size + chunk_length])
+    PACKAGE_HEADER.pack_into(buffer, 0, constants.PROTOCOL_VERSION, flags, fec_index, connection_id, seq_no % SEQUENCE_NUM_MODULO, timestamp, chunk_length, 0)
+    checksum = get_checksum(buffer[:header_size - constants.CHECKSUM_LENGTH_BYTES], payload_checksum)
+    CHECKSUM_FIELD.pack_into(buffer, header_size - constants.CHECKSUM_LENGTH_BYTES, checksum)
+
+# Packs a chunk into a datagram, into the given buffer if there is one, otherwise into a new bytearray.
+# Datagrams are as long as their chunk, no padding up to MSS_VALUE. Returns a memoryview of the packed bytes.
+def pack_package(seq_no, chunk, timestamp=None, buffer=None, flags=0, fec_index=0, connection_id=0):
+    if timestamp is None:
+        timestamp = get_timestamp()
     chunk_length = len(chunk)
-    # checksum = utils.get_checksum(bytes(str(seq_no), 'utf8') + bytes(str(timestamp), 'utf8') + bytes(str(chunk_length), 'utf8') + chunk)
-    checksum = b'0' * constants.CHECKSUM_LENGTH_BYTES
-    align_size = constants.UDP_MAX_CHUNK_SIZE - chunk_length
-    return struct.pack(f'!Id16sI{chunk_length}s{align_size}s', seq_no, timestamp, checksum, chunk_length, chunk, b' ' * align_size)
+    packed_length = constants.RDT_SEND_HEADER_SIZE + chunk_length
+    if buffer is None:
+        buffer = bytearray(packed_length)
+    packed = memoryview(buffer)[:packed_length]
+    packed[constants.RDT_SEND_HEADER_SIZE:] = chunk
+    pack_header_into(packed, seq_no, timestamp, chunk_length, flags=flags, fec_index=fec_index, connection_id=connection_id)
+    return packed
 
+# Unpacks a datagram without copying, the returned chunk is a view into data when data is a memoryview.
+# Returns sequence number, timestamp, chunk, flags, FEC group index and connection ID, or None for a malformed datagram.
 def unpack_package(data):
-    # Unpack the header to get sequence number, timestamp, checksum, and chunk length
-    header_form = '!Id16sI'  # format: sequence number, timestamp, checksum, chunk length
     header_size = constants.RDT_SEND_HEADER_SIZE
-    seq_no, timestamp, checksum, chunk_len = struct.unpack(header_form, data[:header_size])
+    if len(data) < header_size:
+        return None
 
-    # Calculate alignment size
-    align_size = constants.UDP_MAX_CHUNK_SIZE - chunk_len
+    # Unpack the header to get version, flags, FEC group index, connection ID, sequence number, timestamp, chunk length, and checksum
+    version, flags, fec_index, connection_id, seq_no, timestamp, chunk_len, checksum = PACKAGE_HEADER.unpack_from(data)
 
-    # Unpack the chunk data
-    chunk_form = f'!{chunk_len}s{align_size}s'  # format for chunk and alignment
-    chunk, _ = struct.unpack(chunk_form, data[header_size:])
+    # The length field is the source of truth, a truncated datagram or an unknown version is dropped
+    if version != constants.PROTOCOL_VERSION or len(data) < header_size + chunk_len:
+        return None
+    chunk = data[header_size:header_size + chunk_len]
 
     # Verify checksum
-    # checksum_data = bytes(str(seq_no), 'utf8') + bytes(str(timestamp), 'utf8') + bytes(str(chunk_len), 'utf8') + chunk
-    # if not utils.check_checksum(checksum, checksum_data):
-    #     return seq_no, timestamp, None  # Invalid checksum, return None for chunk
-    return seq_no, timestamp, chunk
+    if not check_checksum(checksum, data[:header_size - constants.CHECKSUM_LENGTH_BYTES], get_checksum(chunk)):
+        return seq_no, timestamp, None, flags, fec_index, connection_id  # Invalid checksum, return None for chunk
+    return seq_no, timestamp, chunk, flags, fec_index, connection_id
 
 
 # The PackageData class encapsulates the information about each data packet used in the RDT protocol.
@@ -56,9 +131,10 @@ class PackageData:
         :param seq_no: The sequence number of the packet. It's used to uniquely identify and order packets in the protocol.
         :param chunk: The actual data that the packet is carrying. This can be any serializable data.
         """
-        self.seq_no = seq_no % 10000  # Reset sequence number every 10000 packets to avoid overflow
+        self.seq_no = seq_no  # Full sequence number, only its lower bits are carried on the wire
         self.chunk = chunk
         self.state = STATE_WAITING  # Initial state is 'waiting' indicating the packet is yet to be processed
+        self.retransmitted = False  # Set by the sender once the packet is sent a second time
 
     # Marks the packet as sent by setting its state and recording the timestamp when it was sent.
     def mark_as_sent(self):
@@ -66,12 +142,14 @@ class PackageData:
         self.state = STATE_SENT  # Update the state to 'sent'
 
     # Marks the packet as received by setting its state and updating the timestamps.
-    def mark_as_received(self, timestamp_sent, chunk):
+    def mark_as_received(self, timestamp_sent, chunk, buffer=None):
         """
         :param timestamp_sent: The timestamp when the packet was originally sent.
         :param chunk: The chunk of data received.
+        :param buffer: The pooled buffer the chunk is a view of, released once the packet is delivered.
         """
         self.chunk = chunk
+        self.buffer = buffer
         self.timestamp_sent = timestamp_sent  # Record the original sending time
         self.timestamp_received = get_timestamp()  # Record the time of reception
         self.state = STATE_RECEIVED  # Update the state to 'received'
@@ -79,135 +157,720 @@ class PackageData:
 
 class UDPClient:
     # Initialize the RDT server with a host IP and port number.
-    def __init__(self, listen_host_ip, listen_port_no):
+    def __init__(self, listen_host_ip, listen_port_no, delayed_ack=True, writer=None, packet_count=None, batched_io=False,
+                 window_size=WINDOW_SIZE, metrics_export=None, metrics_interval=METRICS_INTERVAL, profiler=None):
         """
         :param listen_host_ip: IP address on which the server listens.
         :param listen_port_no: Port number on which the server listens.
+        :param delayed_ack: Acknowledge in-order packets in pairs or after ACK_DELAY instead of one by one.
+        :param writer: A PositionalWriter, chunks are then written as they arrive instead of being buffered
+                       until they are in order, and delivered packages carry no chunk. Its chunk size is replaced
+                       by the agreed one when connect() is used.
+        :param packet_count: Number of packets of the transfer if known in advance, processing then ends
+                             as soon as the last one is delivered.
+        :param batched_io: Receive coalesced runs of datagrams with UDP_GRO where the kernel supports it, see BatchReceiver.
+        :param window_size: Receive window in packets, proposed to the sender by connect().
+        :param metrics_export: Called with a snapshot of the metrics every metrics_interval seconds and at the end, see metrics.py.
+        :param metrics_interval: Seconds between two snapshots.
+        :param profiler: A Profiler timing the hot paths and tracing the packets of this transfer, see profiling.py.
         """
         self.listen_host = listen_host_ip
         self.listen_port = listen_port_no
+        self.packet_count = packet_count
+        self.batched_io = batched_io
+        self.socket = None
 
-        # Window for storing package data
-        self.window = deque()
+        # Window for storing package data, indexed by sequence number
+        self.window = RingWindow(window_size)
 
-        # Flag to indicate if the transmission has finished
+        # Flag to indicate if the sender's FIN has arrived, the packet count is known from then on
         self.has_finished = False
 
+        # After the last delivery the receiver lingers until this time, answering repeated FINs and data packets
+        self.linger_time = LINGER_TIME
+        self.linger_deadline = None
+
+        self.writer = writer
+
+        # ID of the transfer being received, chosen by connect() or taken from the first intact packet
+        self.connection_id = None
+
+        # ConnectionParameters agreed in the handshake, None without one, and the codec of compressed chunks they agree on
+        self.parameters = None
+        self.codec = None
+
+        # File length, block size and block numbers sent by the sender of a resumed transfer, see manifest.py
+        self.resume_plan = None
+
+        # Number of datagrams dropped because their checksum did not match
+        self.corrupted_count = 0
+
+        # Parity groups of the forward error correction, and the number of chunks rebuilt from them
+        self.parity_decoder = ParityDecoder()
+        self.recovered_count = 0
+
+        # Intact data packets received, the ones among them that had been received before,
+        # and the payload bytes of the packets received or rebuilt for the first time
+        self.received_count = 0
+        self.duplicate_count = 0
+        self.delivered_bytes = 0
+        self.metrics = TransferMetrics(metrics_export, metrics_interval)
+        self.last_delivery_time = None
+
+        # Number of packets received but not delivered yet, the rest of the window is advertised to the sender
+        self.buffered_count = 0
+
+        # Bit i is set if the package with sequence number window.base + i has been received
+        self.received_bits = 0
+        self.sack_length = (window_size + 6) // 8  # Bytes needed for the bits after window.base
+
+        # Datagrams are received into pooled buffers, a buffer is held by its package until delivery.
+        # With a writer chunks are written on arrival, so a single buffer is enough.
+        self.buffer_pool = BufferPool(window_size + 1 if writer is None else 1, constants.MSS_VALUE)
+        self.ack_buffer = bytearray(ACK_HEADER.size + self.sack_length)
+
+        # Delayed ACK state: in-order packets per ACK, packets not acknowledged yet, the timestamp to echo and when the ACK is due
+        self.ack_every = constants.ACK_EVERY_PACKETS if delayed_ack else 1
+        self.pending_ack_count = 0
+        self.pending_ack_timestamp = 0
+        self.ack_deadline = None
+
         # Initialize the window with PackageData instances
-        for i in range(WINDOW_SIZE):
+        for i in range(window_size if packet_count is None else min(window_size, packet_count)):
             package_data = PackageData(i)
             self.window.append(package_data)
 
+        # Instrumentation replaces methods of this instance, without a profiler nothing is changed
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach_receiver(self)
+
     # Mark the packet as received based on its sequence number.
-    def mark_package_as_received_by_seq(self, seq_no, timestamp, chunk):
+    # Returns True if the package keeps the buffer until delivery, False if the buffer can be reused at once.
+    def mark_package_as_received_by_seq(self, seq_no, timestamp, chunk, buffer=None, fec_group_start=None):
         """
         :param seq_no: Sequence number of the received packet.
         :param timestamp: Timestamp when the packet was sent.
         :param chunk: The data chunk of the packet.
+        :param buffer: The pooled buffer the chunk is a view of.
+        :param fec_group_start: Sequence number of the first packet of the chunk's parity group, if it has one.
         """
-        for package_data in self.window:
-            if package_data.seq_no == seq_no and package_data.state == STATE_WAITING:
-                package_data.mark_as_received(timestamp, chunk)
-                break
+        package_data = self.window.get(seq_no)
+        if package_data is None or package_data.state != STATE_WAITING:
+            self.duplicate_count += 1
+            return False
+        self.received_bits |= 1 << (seq_no - self.window.base)
+        self.delivered_bytes += len(chunk)
+
+        if fec_group_start is not None:
+            group = self.parity_decoder.add_data(fec_group_start, chunk)
+
+        if self.writer is not None:
+            # Written to its place in the file right away, only the received bit is kept in memory
+            self.writer.write(seq_no, chunk)
+            package_data.mark_as_received(timestamp, None)
+            retained = False
+        else:
+            package_data.mark_as_received(timestamp, chunk, buffer)
+            self.buffered_count += 1
+            retained = True
+
+        if fec_group_start is not None:
+            self.recover_from_parity(fec_group_start, group, timestamp)
+        return retained
+
+    # Rebuilds the single missing chunk of a parity group, returns True if a chunk was recovered.
+    def recover_from_parity(self, group_start, group, timestamp):
+        """
+        :param group_start: Sequence number of the first packet of the group.
+        :param group: The ParityGroup.
+        :param timestamp: Timestamp recorded for the rebuilt packet.
+        """
+        chunk = group.recover()
+        if chunk is None:
+            if group.count is not None and group.received_count >= group.count:
+                self.parity_decoder.discard(group_start)  # Complete, the parity is not needed
+            return False
+
+        self.parity_decoder.discard(group_start)
+        for seq_no in range(max(group_start, self.window.base), min(group_start + group.count, self.window.end)):
+            if self.window.get(seq_no).state == STATE_WAITING:
+                self.mark_package_as_received_by_seq(seq_no, timestamp, chunk)
+                self.recovered_count += 1
+                return True
+        return False
+
+    # Packs an ACK: the cumulative ACK (next expected sequence number), the echoed packet timestamp,
+    # the free receive window and a bitmap whose bit i acknowledges sequence number cumulative ACK + 1 + i.
+    def pack_ack(self, timestamp):
+        """
+        :param timestamp: Timestamp of the latest packet, echoed for RTT measurement.
+        """
+        free_window = max(self.window.capacity - self.buffered_count, 0)
+        # Without OPTION_SACK the bitmap is empty, the bits of out of order arrivals are not sent
+        sack_bitmap = (self.received_bits >> 1).to_bytes(self.sack_length, 'little') if self.sack_length else b''
+        flags = FLAG_ACK | FLAG_FIN if self.has_finished and not self.window else FLAG_ACK
+        ACK_HEADER.pack_into(self.ack_buffer, 0, constants.PROTOCOL_VERSION, flags, self.connection_id or 0,
+                             self.window.base % SEQUENCE_NUM_MODULO, timestamp, free_window, self.sack_length, 0)
+        self.ack_buffer[ACK_HEADER.size:] = sack_bitmap
+        checksum = get_checksum(self.ack_buffer[:ACK_HEADER.size - constants.CHECKSUM_LENGTH_BYTES], get_checksum(sack_bitmap))
+        CHECKSUM_FIELD.pack_into(self.ack_buffer, ACK_HEADER.size - constants.CHECKSUM_LENGTH_BYTES, checksum)
+        return self.ack_buffer
+
+    # Sends an ACK covering everything received so far.
+    def send_ack(self, address, timestamp):
+        """
+        :param address: Address of the sender.
+        :param timestamp: Timestamp of the latest packet, echoed for RTT measurement.
+        """
+        self.socket.sendto(self.pack_ack(timestamp), address)
+        self.pending_ack_count = 0
+        self.ack_deadline = None
+
+    # Acknowledges a data packet, in-order packets may be delayed and coalesced into a single ACK.
+    def acknowledge(self, address, timestamp, in_order):
+        """
+        :param address: Address of the sender.
+        :param timestamp: Timestamp of the packet.
+        :param in_order: False if the packet was out of order, a duplicate, or left a gap behind it.
+        """
+        self.pending_ack_count += 1
+        self.pending_ack_timestamp = timestamp
+        if not in_order or self.pending_ack_count >= self.ack_every:
+            # Out of order arrivals are acknowledged at once, they drive loss detection at the sender
+            self.send_ack(address, timestamp)
+        elif self.ack_deadline is None:
+            self.ack_deadline = get_timestamp() + constants.ACK_DELAY
+
+    # Creates and configures the socket, called by process() unless it was bound in advance.
+    def bind(self):
+        self.socket = create_udp_socket(self.listen_host, self.listen_port)
+        if self.profiler is not None:
+            self.socket = self.profiler.wrap_socket(self.socket, 'receiver')
+        # Leave room for a whole window of datagrams arriving in one burst
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.window.capacity * constants.MSS_VALUE)
+
+    # Requests a file with a SYN sent from the receiving socket, so the sender replies to the address it came from,
+    # and waits for the SYN-ACK with the agreed parameters, answering path MTU probes meanwhile.
+    # Returns True once the parameters are agreed, False if the sender did not answer.
+    def connect(self, server_address, filename, options=DEFAULT_OPTIONS | COMPRESSION_OPTIONS, manifest=None):
+        """
+        :param server_address: Address the sender listens for requests on.
+        :param filename: Name of the requested file.
+        :param options: Options proposed to the sender, OPTION_ flags of the handshake module. Every codec is accepted
+                        by default, the sender decides whether to compress.
+        :param manifest: Manifest of the local copy of the file, sent with OPTION_RESUME. The sender's plan of the blocks
+                         it sends is then in resume_plan, None if it sends the whole file.
+        """
+        if self.socket is None:
+            self.bind()
+        self.connection_id = random.randrange(1, 1 << 8 * constants.CONNECTION_ID_BYTES)
+        if manifest is not None:
+            options |= OPTION_RESUME
+        proposal = ConnectionParameters(min(constants.MSS_VALUE, route_max_datagram(server_address)), self.window.capacity,
+                                        self.ack_every, options)
+        syn = pack_syn(self.connection_id, filename, proposal, manifest)
+
+        timeout = constants.TIMEOUT
+        for attempt in range(HANDSHAKE_RETRIES):
+            self.socket.sendto(syn, server_address)
+            sent_time = get_timestamp()
+            deadline = get_timestamp() + timeout
+            while get_timestamp() < deadline:
+                self.socket.settimeout(max(deadline - get_timestamp(), 0.0001))
+                try:
+                    data, address = self.socket.recvfrom(constants.MSS_VALUE)
+                except socket.timeout:
+                    break
+                # Data packets overtaking the SYN-ACK are dropped, the sender repeats the SYN-ACK until it is acknowledged
+                if is_control_packet(data) and self.handle_control(data, address):
+                    if attempt == 0:
+                        # The round trip of the first SYN is unambiguous, the linger has to outlast the sender's FIN repetitions
+                        self.linger_time = max(LINGER_TIME, LINGER_RTTS * (get_timestamp() - sent_time))
+                    return True
+            timeout *= 2
+        return False
+
+    # Adopts the parameters agreed in the handshake.
+    def apply_parameters(self, parameters):
+        self.parameters = parameters
+        self.codec = codec_for_options(parameters.options)
+        self.ack_every = parameters.ack_every
+        if not parameters.options & OPTION_SACK:
+            # Cumulative ACKs only
+            self.sack_length = 0
+            self.ack_buffer = bytearray(ACK_HEADER.size)
+        if self.writer is not None:
+            self.writer.chunk_size = parameters.chunk_size()
+
+    # Handles a control packet of the connection: answers path MTU probes, acknowledges the SYN-ACK and takes the
+    # packet count from the FIN. Returns True if the packet was a SYN-ACK.
+    def handle_control(self, data, address):
+        """
+        :param data: The received datagram.
+        :param address: Address of the sender.
+        """
+        result = unpack_control(data)
+        if result is None or result[1] != self.connection_id:
+            return False
+        kind, _, timestamp, body = result
+        if kind == CONTROL_PROBE:
+            self.socket.sendto(pack_control(CONTROL_PROBE_ACK, self.connection_id, PROBE_SIZE.pack(len(data))), address)
+        elif kind == CONTROL_SYN_ACK:
+            if self.parameters is None:
+                self.apply_parameters(unpack_parameters(body))
+                if self.parameters.options & OPTION_RESUME:
+                    self.resume_plan = unpack_plan(body[CONNECTION_PARAMETERS.size:])
+            # Confirms the parameters and gives the sender its first RTT sample, a repeated SYN-ACK means this ACK was lost
+            self.send_ack(address, timestamp)
+            return True
+        elif kind == CONTROL_FIN:
+            if not self.has_finished:
+                self.has_finished = True
+                self.packet_count = unwrap_seq_no(FIN_SEQUENCE.unpack_from(body)[0], self.window.base)
+                self.window.truncate(self.packet_count)
+            if not self.window:
+                self.finish(address, timestamp)
+            # Otherwise the FIN-ACK goes out once the missing packets are delivered
+        return False
+
+    # Sends the final ACK, with FLAG_FIN once the FIN has arrived, then lingers in case it is lost.
+    def finish(self, address, timestamp):
+        self.send_ack(address, timestamp)
+        self.linger_deadline = get_timestamp() + self.linger_time
+
+    # Answers the sender after the last delivery: a repeated FIN or data packet means the final ACK was lost.
+    def handle_lingering(self, data, address):
+        if is_control_packet(data):
+            self.handle_control(data, address)
+            return
+        result = unpack_package(data)
+        if result is not None and result[2] is not None and result[5] == self.connection_id:
+            self.finish(address, result[1])
 
     # The main processing loop of the server.
     def process(self):
-        # Create and configure the server socket
-        self.socket = create_udp_socket(self.listen_host, self.listen_port)
-        self.socket.settimeout(15)  # Set a timeout for the socket operations, adjust this with the rules
+        if self.socket is None:
+            self.bind()
+        receiver = BatchReceiver(self.socket, self.buffer_pool, None if self.batched_io else 'recvfrom')
+
+        address = None
+        self.last_delivery_time = get_timestamp()
+        while self.window or self.linger_deadline is not None and get_timestamp() < self.linger_deadline:
+            if self.metrics.export is not None:
+                self.report_metrics()
+
+            # Wake up for a delayed ACK or the end of the linger, otherwise give up after RECEIVE_TIMEOUT
+            if self.ack_deadline is not None:
+                self.socket.settimeout(max(self.ack_deadline - get_timestamp(), 0.0001))
+            elif self.linger_deadline is not None:
+                self.socket.settimeout(max(self.linger_deadline - get_timestamp(), 0.0001))
+            else:
+                self.socket.settimeout(constants.RECEIVE_TIMEOUT)
 
-        while len(self.window) > 0:
             try:
-                # Receive a packet from the socket
-                packed, address = self.socket.recvfrom(constants.MSS_VALUE)
+                # Receive packets from the socket, straight into pooled buffers
+                datagrams = receiver.receive()
             except socket.timeout:
+                if self.ack_deadline is not None:
+                    self.send_ack(address, self.pending_ack_timestamp)
+                    continue
                 break  # Break the loop if a timeout occurs
 
-            if packed and len(packed) == constants.MSS_VALUE:
-                result = unpack_package(packed)  # Unpack the received package
+            for buffer, size, address in datagrams:
+                retained = False
+                if self.window:
+                    retained = yield from self.handle_datagram(buffer, size, address)
+                elif size:
+                    self.handle_lingering(buffer[:size], address)
+                if not retained:
+                    self.buffer_pool.release(buffer)
+        # Close the socket at the end
+        self.socket.close()
+        self.socket = None
+        self.report_metrics(final=True)
+
+    # Returns a snapshot of the receiver's counters and histograms, see TransferMetrics.snapshot.
+    def metrics_snapshot(self, final=False):
+        return self.metrics.snapshot('receiver', self.delivered_bytes, final, connection_id=self.connection_id,
+                                     packets_received=self.received_count, duplicates=self.duplicate_count,
+                                     corrupted=self.corrupted_count, recovered=self.recovered_count,
+                                     buffered=self.buffered_count, window_base=self.window.base)
 
-                if result:
-                    seq_no, timestamp, chunk = result
+    # Hands a snapshot to the export hook when one is due, or at the end of the transfer.
+    def report_metrics(self, final=False):
+        if self.metrics.export is not None and (final or get_timestamp() >= self.metrics.next_report):
+            self.metrics.report(self.metrics_snapshot(final))
 
-                    # Check if it's the last packet (indicated by a zero-length chunk)
-                    if (chunk is not None) and len(chunk) == 0:
-                        # Send multiple ACKs for the last packet
-                        for _ in range(5):
-                            self.socket.sendto(struct.pack('!Id', seq_no, get_timestamp()), address)
-                        # Clear remaining packages as the transmission has ended
-                        while len(self.window) > 0 and self.window[-1].seq_no != seq_no:
-                            self.window.pop()
+    # Handles a received datagram, yields the packages it completes in order.
+    # Returns True if a package keeps the buffer until delivery, False if the buffer can be reused at once.
+    def handle_datagram(self, buffer, size, address):
+        """
+        :param buffer: The pooled buffer the datagram was received into.
+        :param size: Length of the datagram.
+        :param address: Address of the sender.
+        """
+        retained = False
+        if size and is_control_packet(buffer[:size]):
+            self.handle_control(buffer[:size], address)
+        elif size:
+            result = unpack_package(buffer[:size])  # Unpack the received package, the chunk is a view of the buffer
 
-                        self.window.pop()
-                        self.has_finished = True
-                    elif chunk:
-                        # Send ACK for the received packet
-                        self.socket.sendto(struct.pack('!Id', seq_no, get_timestamp()), address)
+            if result:
+                wire_seq_no, timestamp, chunk, flags, fec_index, connection_id = result
+                seq_no = unwrap_seq_no(wire_seq_no, self.window.base)
+                deliver = False
+                if self.connection_id is None and chunk is not None:
+                    self.connection_id = connection_id
 
-                        # Mark the packet as received
-                        self.mark_package_as_received_by_seq(seq_no, timestamp, chunk)
+                # Corrupted packets are dropped without an ACK, the sender will resend them
+                if chunk is None:
+                    self.corrupted_count += 1
+                # Late packets of another transfer to the same port are dropped too
+                elif connection_id != self.connection_id:
+                    pass
+                # Parity packets are not acknowledged, they only matter if they rebuild a lost chunk
+                elif flags & FLAG_PARITY:
+                    group = self.parity_decoder.add_parity(seq_no, fec_index, chunk)
+                    deliver = self.recover_from_parity(seq_no, group, timestamp)
+                    in_order = False
+                    self.parity_decoder.discard_before(self.window.base)
+                elif flags & FLAG_COMPRESSED and self.codec is None:
+                    self.corrupted_count += 1  # Compression was not agreed
+                else:
+                    in_order = seq_no == self.window.base
+                    self.received_count += 1
+                    if seq_no >= self.window.base:
+                        self.metrics.window_occupancy.add(seq_no - self.window.base)  # How far ahead of the gap it arrived
 
-                        # Process and remove received packets from the window
-                        while len(self.window) > 0:
-                            if self.window[0].state != STATE_RECEIVED:
-                                break
+                    # Mark the packet as received
+                    fec_group_start = seq_no - fec_index if flags & FLAG_FEC else None
+                    package_buffer = buffer
+                    if flags & FLAG_COMPRESSED:
+                        # Decompressed into a new object, the datagram's buffer is not kept
+                        chunk = decompress_data(self.codec, chunk, constants.MSS_VALUE)
+                        package_buffer = None
+                    if chunk is None:
+                        self.corrupted_count += 1
+                    else:
+                        retained = self.mark_package_as_received_by_seq(seq_no, timestamp, chunk, package_buffer, fec_group_start)
+                        retained = retained and package_buffer is not None
+                        deliver = True
 
-                            yield self.window[0]
+                if deliver:
+                    # Process and remove received packets from the window
+                    while len(self.window) > 0:
+                        if self.window.first().state != STATE_RECEIVED:
+                            break
 
-                            new_sequential_number = self.window[-1].seq_no + 1
-                            self.window.popleft()
+                        self.received_bits >>= 1
+                        package = self.window.popleft()
 
-                            # Add new package data if more packets are expected
-                            if not self.has_finished:
-                                new_package_data = PackageData(new_sequential_number)
-                                self.window.append(new_package_data)
-        # Close the socket at the end
-        self.socket.close()
+                        # Gaps between arrivals of in-order packets, the time lost waiting for a missing packet counts once
+                        gap = package.timestamp_received - self.last_delivery_time
+                        if gap > 0:
+                            self.last_delivery_time = package.timestamp_received
+                        self.metrics.delivery_gap.add(max(gap, 0))
+                        yield package
+
+                        # The consumer is done with the chunk, its buffer can be reused
+                        if self.writer is None:
+                            self.buffered_count -= 1
+                            if package.buffer is not None:
+                                self.buffer_pool.release(package.buffer)
+                            package.chunk = package.buffer = None
+
+                        # Add new package data if more packets are expected
+                        if self.packet_count is None or self.window.end < self.packet_count:
+                            self.window.append(PackageData(self.window.end))
+
+                    # ACK after delivery so the cumulative ACK covers the packet, gaps are acknowledged at once
+                    if self.window:
+                        self.acknowledge(address, timestamp, in_order and self.received_bits == 0)
+                    else:
+                        # Everything has been delivered, a FIN-ACK if the FIN has arrived, otherwise the FIN is awaited while lingering
+                        self.finish(address, timestamp)
+
+        return retained
 
 
 class UDPServer:
-    def __init__(self, sender_port, target_host, target_port, data):
+    def __init__(self, sender_port, target_host, target_port, data, congestion_control='reno', fec_ratio=0, connection_id=0,
+                 batched_io=False, parameters=None, sock=None, metrics_export=None, metrics_interval=METRICS_INTERVAL,
+                 compression_level=None, resume_plan=None, profiler=None):
         """
         :param sender_port: Port for the client to use for sending data.
         :param target_host: Host address of the target server.
         :param target_port: Port number of the target server.
         :param data: A generator that yields data chunks to be sent.
+        :param congestion_control: Name of a congestion controller in CONGESTION_CONTROLLERS, or a CongestionController.
+        :param fec_ratio: Parity packets sent per data packet, 0 disables FEC, 'auto' follows the measured loss rate.
+        :param connection_id: ID of the transfer, carried in every packet and echoed in the ACKs.
+        :param batched_io: Send runs of datagrams with one UDP_SEGMENT (GSO) call where the kernel supports it, see BatchSender.
+        :param parameters: ConnectionParameters agreed with the client's SYN, the SYN-ACK carrying them is sent first and
+                           repeated until the client acknowledges it. data must then yield chunks of their chunk size.
+        :param sock: Socket to send from, e.g. the one the path MTU was probed on, a new one is created by default.
+        :param metrics_export: Called with a snapshot of the metrics every metrics_interval seconds and at the end, see metrics.py.
+        :param metrics_interval: Seconds between two snapshots.
+        :param compression_level: Level of the codec agreed in the parameters, None for the codec's default.
+        :param resume_plan: The packed plan of a resumed transfer, sent in the SYN-ACK after the parameters, see plan_resume.
+                            data must then yield the planned blocks, see chunk_blocks.
+        :param profiler: A Profiler timing the hot paths and tracing the packets of this transfer, see profiling.py.
         """
         self.sender_port = sender_port
         self.target = (target_host, target_port)
+        self.connection_id = connection_id
+        self.batched_io = batched_io
+        self.socket = sock
+        self.sender = None
         self.data = data
+        self.data_exhausted = False
+
+        # Time of the latest ACK, the client is taken for gone after RECEIVE_TIMEOUT of silence
+        self.last_ack_time = get_timestamp()
+
+        # Teardown state: FINs sent, when the FIN is repeated, and whether the client's FIN-ACK arrived
+        self.fin_count = 0
+        self.fin_deadline = 0
+        self.fin_acked = False
+
+        # Handshake state: the agreed parameters, and when the SYN-ACK is repeated while it is not acknowledged
+        self.parameters = parameters
+        self.resume_plan = resume_plan
+        self.syn_ack_pending = parameters is not None
+        self.syn_ack_deadline = 0
+        window_size = WINDOW_SIZE if parameters is None else parameters.window
+        if parameters is not None and not parameters.options & OPTION_FEC:
+            fec_ratio = 0
+
+        # Chunks are compressed if a codec was agreed, those that do not shrink are sent as they are
+        codec = None if parameters is None else codec_for_options(parameters.options)
+        self.compressor = None if codec is None else ChunkCompressor(codec, compression_level)
         self.retransmission_count = 0
-        
-        # Initialize the sender window
-        self.window = deque()
+        self.corrupted_count = 0  # Number of ACKs dropped because their checksum did not match
+
+        # Packets sent for the first time, losses detected by timeout or fast retransmission, data bytes acknowledged before compression
+        self.sent_count = 0
+        self.lost_count = 0
+        self.acked_bytes = 0
+        self.metrics = TransferMetrics(metrics_export, metrics_interval)
+
+        # Adaptive retransmission timeout and the queue of pending retransmission timers
+        self.rtt_estimator = RTTEstimator()
+        self.timers = []  # Heap of (deadline, seq_no, timestamp_sent) entries
+
+        # Congestion control, pacing and the free window last advertised by the client
+        if isinstance(congestion_control, CongestionController):
+            self.congestion_controller = congestion_control
+        else:
+            self.congestion_controller = create_congestion_controller(congestion_control, window_size)
+        self.pacer = TokenBucket()
+        self.peer_window = window_size
+
+        # Forward error correction: XOR parity over groups of consecutive packets
+        self.fec_ratio = fec_ratio
+        self.loss_rate = LossRateEstimator()
+        self.parity_encoder = ParityEncoder()
+        self.fec_group_size = 0  # Size of the group being built, 0 while FEC is off
+        self.pending_parity = []  # Parity packets to send before any new data packet
+        self.parity_count = 0
+
+        # Every window slot owns a preallocated packet buffer, chunks are copied into it once and resent from it
+        self.packet_buffers = [memoryview(bytearray(constants.MSS_VALUE)) for _ in range(window_size)]
+        self.ack_buffer = memoryview(bytearray(constants.MSS_VALUE))
+
+        # Instrumentation replaces methods of this instance, without a profiler nothing is changed
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach_sender(self)
+
+        # Initialize the sender window, packets below next_seq_no have been sent at least once
+        self.window = RingWindow(window_size)
+        self.next_seq_no = 0
         self.populate_window()
 
+        # Bit i is set if the packet with sequence number window.base + i has been acknowledged
+        self.acked_bits = 0
+        self.highest_acked_seq_no = -1
+        self.newly_acked_count = 0  # Packets acknowledged for the first time by the ACK being handled
+        self.newly_acked_resent_count = 0  # The retransmitted ones among them
+
     # Fills the sender window with package data up to the window size.
     def populate_window(self):
-        while len(self.window) < WINDOW_SIZE:
+        while not self.data_exhausted and not self.window.is_full():
             try:
                 chunk = next(self.data)
-                seq_no = self.window[-1].seq_no + 1 if self.window else 0
-                self.window.append(PackageData(seq_no, chunk))
             except StopIteration:
+                self.data_exhausted = True
+                self.flush_parity_group()
                 break
 
+            compressed = None if self.compressor is None else self.compressor.compress(chunk)
+            payload = chunk if compressed is None else compressed
+
+            # The chunk may be a view of a buffer reused by the generator, so it is copied into the slot right away
+            buffer = self.packet_buffers[self.window.end % self.window.capacity]
+            packed_length = constants.RDT_SEND_HEADER_SIZE + len(payload)
+            buffer[constants.RDT_SEND_HEADER_SIZE:packed_length] = payload
+            package = PackageData(self.window.end, buffer[constants.RDT_SEND_HEADER_SIZE:packed_length])
+            package.packed = buffer[:packed_length]
+            package.payload_checksum = get_checksum(package.chunk)  # Computed once, reused by retransmissions
+            package.flags = 0 if compressed is None else FLAG_COMPRESSED
+            package.data_length = len(chunk)
+            package.fec_index = None
+            package.parity = None
+            self.window.append(package)
+            self.add_to_parity_group(package, chunk)
+
+    # Returns the size of the next parity group, 0 to send it without parity.
+    def next_fec_group_size(self):
+        if self.fec_ratio == 'auto':
+            return group_size_for_ratio(self.loss_rate.redundancy_ratio())
+        return group_size_for_ratio(self.fec_ratio)
+
+    # Adds a new package to the current parity group, the parity goes out right after the last package of the group.
+    # The parity covers the uncompressed chunk, the receiver adds chunks to its groups after decompressing them.
+    def add_to_parity_group(self, package, chunk):
+        if self.parity_encoder.count == 0:
+            self.fec_group_size = self.next_fec_group_size()
+        if not self.fec_group_size:
+            return
+
+        package.fec_index = self.parity_encoder.count
+        self.parity_encoder.add(chunk)
+        if self.parity_encoder.count == self.fec_group_size:
+            package.parity = self.pack_parity(package.seq_no - package.fec_index)
+
+    # Closes a parity group cut short by the end of the data.
+    def flush_parity_group(self):
+        if self.parity_encoder.count == 0:
+            return
+        parity = self.pack_parity(self.window.end - self.parity_encoder.count)
+        last_package = self.window.get(self.window.end - 1)
+        if last_package is not None and last_package.state == STATE_WAITING:
+            last_package.parity = parity
+        elif last_package is not None:
+            self.pending_parity.append(parity)
+
+    # Packs the parity packet of the current group and starts a new group.
+    def pack_parity(self, group_start):
+        """
+        :param group_start: Sequence number of the first packet of the group.
+        """
+        parity = pack_package(group_start, self.parity_encoder.pack_parity(), flags=FLAG_PARITY, fec_index=self.parity_encoder.count,
+                              connection_id=self.connection_id)
+        self.parity_encoder.reset()
+        return parity
+
+    # Queues a datagram to the target, the only place the sender touches the socket for sending.
+    def send_datagram(self, data):
+        self.sender.send(data)
+
+    # Sends the queued datagrams, called before the sender waits for anything.
+    def flush_datagrams(self):
+        self.sender.flush()
+
+    # Sends the SYN-ACK when it is due, until the client acknowledges it. Every copy carries a fresh timestamp,
+    # so the ACK echoing it is the first RTT sample of the connection.
+    def send_syn_ack(self):
+        current_time = get_timestamp()
+        if not self.syn_ack_pending or current_time < self.syn_ack_deadline:
+            return
+        if self.syn_ack_deadline:
+            self.rtt_estimator.backoff()
+        body = self.parameters.pack()
+        if self.resume_plan is not None:
+            body += self.resume_plan
+        self.send_datagram(pack_control(CONTROL_SYN_ACK, self.connection_id, body, current_time))
+        self.syn_ack_deadline = current_time + self.rtt_estimator.rto
+
+    # Sends the FIN with the number of packets as soon as every packet has been sent once. It is repeated once every packet
+    # is acknowledged, until the client's FIN-ACK arrives or FIN_RETRIES repetitions went unanswered.
+    def send_fin(self):
+        if not self.data_exhausted or self.next_seq_no < self.window.end or self.fin_acked:
+            return
+        current_time = get_timestamp()
+        if self.fin_count > 0 and (self.window or current_time < self.fin_deadline or self.fin_count > FIN_RETRIES):
+            return
+        if self.fin_count > 0:
+            self.rtt_estimator.backoff()
+        self.send_datagram(pack_control(CONTROL_FIN, self.connection_id, FIN_SEQUENCE.pack(self.window.end % SEQUENCE_NUM_MODULO),
+                                        current_time))
+        self.fin_count += 1
+        self.fin_deadline = current_time + self.rtt_estimator.rto
+
+    # Returns True while the FIN is waiting for its FIN-ACK, i.e. is sent and may still be repeated.
+    def fin_pending(self):
+        return self.fin_count > 0 and not self.fin_acked and (self.fin_count <= FIN_RETRIES or get_timestamp() < self.fin_deadline)
+
+    # Sends a parity packet, parity packets are never retransmitted.
+    # The group was closed when its last packet entered the window, so the parity is stamped again now: the ACK of a
+    # packet rebuilt from it echoes this timestamp, and an old one would be taken as a long RTT sample.
+    def send_parity(self, parity):
+        _, flags, fec_index, connection_id, seq_no, _, chunk_length, _ = PACKAGE_HEADER.unpack_from(parity)
+        pack_header_into(parity, seq_no, get_timestamp(), chunk_length, flags=flags, fec_index=fec_index,
+                         connection_id=connection_id)
+        self.pacer.consume()
+        self.send_datagram(parity)
+        self.parity_count += 1
+
     # Sends a packet to the target server.
     def send_packet(self, packet):
         """
         :param packet: The package data to be sent.
         """
-        packed_data = pack_package(packet.seq_no, packet.chunk)
-        self.socket.sendto(packed_data, self.target)
+        if packet.state == STATE_SENT:
+            # The header is rewritten in place, an earlier transmission may still be queued in the BatchSender
+            self.flush_datagrams()
         self.update_packet_state_on_send(packet)
+        self.pacer.consume()
+        # Only the header changes between transmissions, the chunk is already in place
+        if packet.fec_index is None:
+            pack_header_into(packet.packed, packet.seq_no, packet.timestamp_sent, len(packet.chunk), packet.payload_checksum,
+                             packet.flags, connection_id=self.connection_id)
+        else:
+            pack_header_into(packet.packed, packet.seq_no, packet.timestamp_sent, len(packet.chunk), packet.payload_checksum,
+                             packet.flags | FLAG_FEC, packet.fec_index, self.connection_id)
+        self.send_datagram(packet.packed)
 
-    # Resends packets that have not been acknowledged within the timeout period.
+        # The parity of a group follows the first transmission of its last packet
+        if packet.parity is not None:
+            self.send_parity(packet.parity)
+            packet.parity = None
+        heapq.heappush(self.timers, (packet.timestamp_sent + self.rtt_estimator.rto, packet.seq_no, packet.timestamp_sent))
+
+    # Resends packets whose retransmission timer has expired, only the due timers are visited.
     def resend_packets(self):
         current_time = get_timestamp()
-        threshold_time = current_time - constants.TIMEOUT
-        for packet in self.window:
-            if packet.state == STATE_SENT and packet.timestamp_sent < threshold_time:
-                self.send_packet(packet)
+        expired = False
+        while self.timers and self.timers[0][0] <= current_time:
+            _, seq_no, timestamp_sent = heapq.heappop(self.timers)
+            packet = self.window.get(seq_no)
+            # Timers of acknowledged or already resent packets are stale, skip them
+            if packet is None or packet.state != STATE_SENT or packet.timestamp_sent != timestamp_sent:
+                continue
+            if not expired:
+                # Back off once per expiry round, not once per packet
+                self.rtt_estimator.backoff()
+                expired = True
+            self.congestion_controller.on_loss(seq_no, self.next_seq_no, timeout=True)
+            self.loss_rate.on_lost()
+            self.lost_count += 1
+            self.send_packet(packet)
+
+    # Returns the time in seconds until the sender has something to do without an ACK arriving:
+    # the earliest retransmission timer is due, or the pacer allows the next new packet.
+    def time_until_next_event(self):
+        timeout = self.rtt_estimator.rto
+        if self.timers:
+            timeout = min(timeout, self.timers[0][0] - get_timestamp())
+        if self.syn_ack_pending:
+            timeout = min(timeout, self.syn_ack_deadline - get_timestamp())
+        if not self.window and self.fin_pending():
+            timeout = min(timeout, self.fin_deadline - get_timestamp())
+        if self.has_sendable_packets():
+            timeout = min(timeout, self.pacer.time_until_ready())
+        return max(timeout, MIN_EVENT_WAIT)
 
     # Updates the state of a packet after sending it.
     def update_packet_state_on_send(self, packet):
@@ -216,49 +879,188 @@ class UDPServer:
         """
         if packet.state == STATE_SENT:
             self.retransmission_count += 1
+            packet.retransmitted = True
+        else:
+            self.window.in_flight += 1
+            self.sent_count += 1
         packet.mark_as_sent()
 
-    # Handles incoming ACK packets from the server.
+    # Returns the number of packets allowed in flight by the congestion and receive windows.
+    def allowed_in_flight(self):
+        # At least one packet may always be in flight, so a stale zero window can not stall the transfer
+        return max(1, min(int(self.congestion_controller.cwnd), self.peer_window))
+
+    # Returns True if a new packet is waiting and the windows allow sending it.
+    def has_sendable_packets(self):
+        return self.next_seq_no < self.window.end and self.window.in_flight < self.allowed_in_flight()
+
+    # Sends the packets in the window that have not been transmitted yet, as far as the windows and the pacer allow.
+    def send_waiting_packets(self):
+        self.pacer.refill(get_timestamp(), self.congestion_controller.pacing_rate(self.rtt_estimator))
+        while self.pending_parity:
+            self.send_parity(self.pending_parity.pop())
+        while self.has_sendable_packets() and self.pacer.can_send():
+            self.send_packet(self.window.get(self.next_seq_no))
+            self.next_seq_no += 1
+
+    # Waits for an incoming ACK packet from the client until the next timer or pacer event.
     def handle_incoming_ack_packets(self):
-        while any(packet.state == STATE_SENT for packet in self.window):
-            try:
-                packed_data, _ = self.socket.recvfrom(constants.ACK_PACKET_SIZE)
-                if packed_data:
-                    ack_result = struct.unpack('!Id', packed_data)
-                    if ack_result:
-                        seq_no, _ = ack_result
-                        self.ack_packet(seq_no)
-            except socket.timeout:
-                self.resend_packets()
+        if self.window.in_flight == 0 and not self.syn_ack_pending and not self.fin_pending():
+            # Nothing to wait for but the pacer
+            time.sleep(self.pacer.time_until_ready())
+            return
+
+        self.socket.settimeout(self.time_until_next_event())
+        try:
+            size, _ = self.socket.recvfrom_into(self.ack_buffer)
+            self.handle_ack(self.ack_buffer[:size])
+        except socket.timeout:
+            pass
+
+    # Processes a cumulative + selective ACK, a single datagram may acknowledge many packets.
+    def handle_ack(self, packed_data):
+        """
+        :param packed_data: The received ACK datagram.
+        """
+        if len(packed_data) < constants.ACK_HEADER_SIZE:
+            return
+        version, flags, connection_id, wire_seq_no, echoed_timestamp, peer_window, sack_length, checksum = ACK_HEADER.unpack_from(packed_data)
+        if version != constants.PROTOCOL_VERSION or not flags & FLAG_ACK:
+            return  # Path MTU probe answers arriving late, or datagrams of another protocol version
+        sack_bitmap = packed_data[constants.ACK_HEADER_SIZE:constants.ACK_HEADER_SIZE + sack_length]
+        if not check_checksum(checksum, packed_data[:constants.ACK_HEADER_SIZE - constants.CHECKSUM_LENGTH_BYTES], get_checksum(sack_bitmap)):
+            self.corrupted_count += 1
+            return
+        if connection_id != self.connection_id:
+            return  # A late ACK of another transfer
+        self.last_ack_time = get_timestamp()
+        self.syn_ack_pending = False  # Any ACK of the connection confirms the handshake
+        if flags & FLAG_FIN:
+            self.fin_acked = True  # Also acknowledges every packet, the client sends it after the last delivery
+
+        self.peer_window = peer_window
+        cumulative_ack = unwrap_seq_no(wire_seq_no, self.window.base)
+
+        self.metrics.window_occupancy.add(self.window.in_flight)
+        self.newly_acked_count = self.newly_acked_resent_count = 0
+
+        # Everything below the cumulative ACK has been received
+        for seq_no in range(self.window.base, min(cumulative_ack, self.next_seq_no)):
+            self.ack_packet(seq_no)
+
+        # Bit i of the bitmap stands for cumulative_ack + 1 + i, align it to the window base
+        sack_bits = int.from_bytes(sack_bitmap, 'little')
+        shift = cumulative_ack + 1 - self.window.base
+        sack_bits = sack_bits << shift if shift >= 0 else sack_bits >> -shift
+        sack_bits &= (1 << (self.next_seq_no - self.window.base)) - 1  # Only packets that have been sent
+
+        # Visit only the packets this ACK acknowledges for the first time
+        new_bits = sack_bits & ~self.acked_bits
+        while new_bits:
+            lowest_bit = new_bits & -new_bits
+            self.ack_packet(self.window.base + lowest_bit.bit_length() - 1)
+            new_bits ^= lowest_bit
+
+        # An ACK acknowledging only retransmitted packets may echo any of their transmissions, it gives no RTT sample
+        rtt = get_timestamp() - echoed_timestamp
+        if rtt >= 0:
+            retransmitted = self.newly_acked_count > 0 and self.newly_acked_count == self.newly_acked_resent_count
+            self.rtt_estimator.add_sample(rtt, retransmitted)
+            self.metrics.rtt.add(rtt)
+
+        self.detect_lost_packets()
 
     # Marks a packet as acknowledged based on its sequence number.
     def ack_packet(self, seq_no):
         """
         :param seq_no: Sequence number of the packet that was acknowledged.
         """
-        for packet in self.window:
-            if packet.seq_no == seq_no:
-                packet.state = STATE_ACKED
-                break
+        packet = self.window.get(seq_no)
+        if packet is not None and packet.state == STATE_SENT:
+            packet.state = STATE_ACKED
+            self.window.in_flight -= 1
+            self.newly_acked_count += 1
+            self.newly_acked_resent_count += packet.retransmitted
+            self.acked_bits |= 1 << (seq_no - self.window.base)
+            self.highest_acked_seq_no = max(self.highest_acked_seq_no, seq_no)
+            self.acked_bytes += packet.data_length
+            self.congestion_controller.on_ack(seq_no, self.rtt_estimator)
+            self.loss_rate.on_delivered()
+
+    # Fast retransmission: resends unacknowledged packets that were sent before a packet
+    # DUPLICATE_ACK_THRESHOLD sequence numbers later, which has already been acknowledged.
+    def detect_lost_packets(self):
+        hole_count = self.highest_acked_seq_no - DUPLICATE_ACK_THRESHOLD + 1 - self.window.base
+        if hole_count <= 0:
+            return
+
+        reference_packet = self.window.get(self.highest_acked_seq_no)
+        holes = ~self.acked_bits & ((1 << hole_count) - 1)
+        while holes:
+            lowest_bit = holes & -holes
+            holes ^= lowest_bit
+            packet = self.window.get(self.window.base + lowest_bit.bit_length() - 1)
+            # A packet resent after the reference packet was sent may still be on its way
+            if packet.state == STATE_SENT and packet.timestamp_sent < reference_packet.timestamp_sent:
+                self.congestion_controller.on_loss(packet.seq_no, self.next_seq_no, timeout=False)
+                self.loss_rate.on_lost()
+                self.lost_count += 1
+                self.send_packet(packet)
 
     # Removes packets, which have been acknowledged, from the window.
     def remove_acked_packets(self):
-        while self.window and self.window[0].state == STATE_ACKED:
+        while self.window and self.window.first().state == STATE_ACKED:
             self.window.popleft()
+            self.acked_bits >>= 1
+
+    # Runs one round of the sender without blocking: resends expired packets, slides and refills the window,
+    # then sends what the windows and the pacer allow. Returns False once every packet and the FIN have been acknowledged,
+    # or the client stopped answering.
+    def advance(self):
+        current_time = get_timestamp()
+        if current_time - self.last_ack_time > constants.RECEIVE_TIMEOUT:
+            return False  # The client is gone, retransmitting any longer is pointless
+        if current_time >= self.metrics.next_report:
+            self.report_metrics()
+        self.send_syn_ack()
+        # Checked after every ACK too, a steady ACK stream must not hide a lost packet
+        self.resend_packets()
+        self.remove_acked_packets()
+        self.populate_window()
+        self.send_waiting_packets()
+        self.send_fin()
+        self.flush_datagrams()
+        return bool(self.window) or self.syn_ack_pending or self.fin_count == 0 or self.fin_pending()
 
     # Main method to process the sending of data packets.
     def process(self):
         # self.socket = create_udp_socket('', self.sender_port)
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.settimeout(constants.TIMEOUT)
-
-        while self.window:
-            if self.window[0].state == STATE_WAITING:
-                self.send_packet(self.window[0])
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.profiler is not None:
+            self.socket = self.profiler.wrap_socket(self.socket, 'sender')
+        self.sender = BatchSender(self.socket, self.target, None if self.batched_io else 'sendto')
 
+        # Selective repeat: keep the whole window in flight, only expired packets are resent
+        while self.advance():
             self.handle_incoming_ack_packets()
-            self.remove_acked_packets()
-            self.populate_window()
 
         self.socket.close()
+        self.report_metrics(final=True)
         return self.retransmission_count
+
+    # Returns a snapshot of the sender's counters and histograms, see TransferMetrics.snapshot.
+    def metrics_snapshot(self, final=False):
+        return self.metrics.snapshot('sender', self.acked_bytes, final, connection_id=self.connection_id,
+                                     packets_sent=self.sent_count, retransmissions=self.retransmission_count,
+                                     lost=self.lost_count, loss_rate=self.lost_count / self.sent_count if self.sent_count else 0.0,
+                                     parity_sent=self.parity_count, corrupted_acks=self.corrupted_count,
+                                     compressed=self.compressor.compressed_count if self.compressor else 0,
+                                     compression_saved_bytes=self.compressor.saved_bytes if self.compressor else 0,
+                                     in_flight=self.window.in_flight, cwnd=self.congestion_controller.cwnd,
+                                     srtt=self.rtt_estimator.srtt, rto=self.rtt_estimator.rto)
+
+    # Hands a snapshot to the export hook when one is due, or at the end of the transfer.
+    def report_metrics(self, final=False):
+        if self.metrics.export is not None and (final or get_timestamp() >= self.metrics.next_report):
+            self.metrics.report(self.metrics_snapshot(final))
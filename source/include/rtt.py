@@ -0,0 +1,49 @@
+from . import constants
+
+# Gains of the smoothed RTT and RTT variance filters, as in RFC 6298
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+
+# Weight of the RTT variance in the retransmission timeout
+RTT_VARIANCE_FACTOR = 4
+
+# Clock granularity assumed for the retransmission timeout
+CLOCK_GRANULARITY = 0.001
+
+
+# Estimates the round trip time from ACK samples and derives the retransmission timeout (Jacobson/Karn).
+class RTTEstimator:
+    def __init__(self, initial_timeout=constants.TIMEOUT, min_timeout=constants.MIN_TIMEOUT, max_timeout=constants.MAX_TIMEOUT):
+        """
+        :param initial_timeout: Retransmission timeout used before the first sample arrives.
+        :param min_timeout: Lower bound of the retransmission timeout.
+        :param max_timeout: Upper bound of the retransmission timeout, also caps the backoff.
+        """
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None  # Smoothed round trip time
+        self.rttvar = None  # Round trip time variance
+        self.rto = initial_timeout  # Current retransmission timeout
+
+    # Feeds a new round trip time sample, which also cancels any backoff.
+    # Karn's rule: samples that may belong to a retransmitted packet are ignored and the backoff is kept.
+    def add_sample(self, rtt, retransmitted=False):
+        """
+        :param rtt: Measured round trip time in seconds.
+        :param retransmitted: True if the sample was taken from the ACK of a packet sent more than once.
+        """
+        if retransmitted:
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+
+        rto = self.srtt + max(CLOCK_GRANULARITY, RTT_VARIANCE_FACTOR * self.rttvar)
+        self.rto = min(max(rto, self.min_timeout), self.max_timeout)
+
+    # Doubles the retransmission timeout after a timer expired.
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.max_timeout)
@@ -0,0 +1,98 @@
+import glob
+import os
+import struct
+
+# Header of every file in the data stream of a session, a chunk of its own: file length, file name length, then the file name.
+# The file's chunks follow it, the next header comes right after the file's last byte.
+SESSION_FILE_HEADER = struct.Struct('!QH')
+
+# Separator of the file names and glob patterns of a session request
+NAME_SEPARATOR = '\n'
+
+
+# Expands the file names and glob patterns of a session request into the list of files to send, in request order.
+# Patterns are expanded in sorted order, names that are not patterns are kept even if missing, so the sender reports them.
+def expand_request(request):
+    """
+    :param request: File names and glob patterns separated by NAME_SEPARATOR, as sent by the client.
+    """
+    filenames = []
+    for name in request.split(NAME_SEPARATOR):
+        if not name:
+            continue
+        if glob.has_magic(name):
+            filenames.extend(sorted(glob.glob(name)))
+        else:
+            filenames.append(name)
+    return filenames
+
+
+# Joins the file names and glob patterns of a session request.
+def pack_request(names):
+    return NAME_SEPARATOR.join(names)
+
+
+# Packs the header chunk announcing a file in a session.
+def pack_file_header(filename, file_length):
+    name = filename.encode()
+    return SESSION_FILE_HEADER.pack(file_length, len(name)) + name
+
+
+# Yields the chunks of a session: for every file a header chunk, then the file's chunks. The file chunks are views
+# of a single reused buffer as in chunk_file. Files that can not be opened or whose name does not fit a chunk are skipped.
+def chunk_files(filenames, chunk_size):
+    """
+    :param filenames: The paths of the files, in sending order.
+    :param chunk_size: The size of each chunk.
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    for filename in filenames:
+        try:
+            file = open(filename, 'rb')
+        except OSError as error:
+            print('Can not send {}: {}'.format(filename, error))
+            continue
+        with file:
+            header = pack_file_header(filename, os.fstat(file.fileno()).st_size)
+            if len(header) > chunk_size:
+                continue
+            yield header
+            while True:
+                size = file.readinto(buffer)
+                if not size:
+                    break
+                yield buffer[:size]
+
+
+# Splits the in-order chunks of a session back into files.
+class SessionReceiver:
+    def __init__(self, output_filename):
+        """
+        :param output_filename: Called with the sender's file name, returns the path the file is written to.
+        """
+        self.output_filename = output_filename
+        self.file = None
+        self.filename = None
+        self.remaining = 0
+        self.received = []  # Names of the files received completely
+
+    # Consumes the next chunk of the session, a file header or a piece of the current file.
+    def feed(self, chunk):
+        if self.file is None:
+            file_length, name_length = SESSION_FILE_HEADER.unpack_from(chunk)
+            self.filename = bytes(chunk[SESSION_FILE_HEADER.size:SESSION_FILE_HEADER.size + name_length]).decode(errors='replace')
+            self.file = open(self.output_filename(self.filename), 'wb')
+            self.remaining = file_length
+        else:
+            self.file.write(chunk)
+            self.remaining -= len(chunk)
+        if self.remaining <= 0:
+            self.file.close()
+            self.file = None
+            self.received.append(self.filename)
+
+    # Closes a file cut short by the end of the session.
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,218 @@
+import os
+import queue
+import random
+import socket
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from . import constants
+from .utils import get_checksum, receive_exactly
+from .file_writer import PositionalWriter
+from .handshake import chunk_size_for, route_max_datagram
+from .reliable_udp import UDPClient, UDPServer
+
+# Upper bound of the number of stripes, i.e. sender and receiver processes, of one transfer
+MAX_STRIPES = 64
+
+# Striped transfer request, sent over the TCP control connection:
+# version, number of stripes, first receiver port (stripe i uses port + i), file name length, then the file name
+STRIPE_REQUEST = struct.Struct('!BHHH')
+
+# Reply to a request: version, file size, number of stripes the file is split into,
+# chunk size, chosen by the sender so that datagrams fit the MTU of its route to the receiver
+STRIPE_LAYOUT = struct.Struct('!BQHH')
+
+# Sent by the receiver once all of its stripe sockets are bound, the senders start then
+STRIPE_START = b'\x01'
+
+# Seconds the receiver waits for a stripe socket to be bound before it checks whether a worker has failed
+WORKER_POLL_INTERVAL = 0.5
+
+# Sent by the sender for every stripe once all stripes are acknowledged: CRC32 of the stripe, retransmissions
+STRIPE_RESULT = struct.Struct('!II')
+
+
+# Returns the number of chunks a byte range is sent in.
+def chunk_count(length, chunk_size=constants.UDP_MAX_CHUNK_SIZE):
+    return -(-length // chunk_size)
+
+
+# Splits a file into at most stripe_count byte ranges of whole chunks, returns a list of (offset, length).
+# Both sides compute the layout from the file size, so only the size goes over the wire.
+def split_ranges(file_size, stripe_count, chunk_size):
+    """
+    :param file_size: Size of the file in bytes.
+    :param stripe_count: Requested number of stripes.
+    :param chunk_size: Size of the chunks, stripes start at chunk boundaries.
+    """
+    total_chunks = chunk_count(file_size, chunk_size)
+    if total_chunks == 0:
+        return []
+    chunks_per_stripe = -(-total_chunks // min(max(stripe_count, 1), total_chunks))
+    stripe_size = chunks_per_stripe * chunk_size
+    return [(offset, min(stripe_size, file_size - offset)) for offset in range(0, file_size, stripe_size)]
+
+
+# Yields the chunks of a byte range of a file, views of a single reused buffer as in chunk_file.
+def chunk_range(filename, offset, length, chunk_size):
+    """
+    :param filename: The path to the file.
+    :param offset: Offset of the range in the file.
+    :param length: Length of the range in bytes.
+    :param chunk_size: The size of each chunk.
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        while length > 0:
+            size = file.readinto(buffer[:min(chunk_size, length)])
+            if not size:
+                break
+            length -= size
+            yield buffer[:size]
+
+
+# Returns the CRC32 of a byte range of a file.
+def range_checksum(filename, offset, length, chunk_size=1 << 20):
+    checksum = 0
+    for chunk in chunk_range(filename, offset, length, chunk_size):
+        checksum = get_checksum(chunk, checksum)
+    return checksum
+
+
+# Sender worker process: sends one stripe with its own socket, returns its CRC32 and the number of retransmissions.
+def send_stripe(filename, offset, length, chunk_size, target_host, target_port, fec_ratio):
+    checksum = 0
+
+    def chunks():
+        nonlocal checksum
+        for chunk in chunk_range(filename, offset, length, chunk_size):
+            checksum = get_checksum(chunk, checksum)
+            yield chunk
+
+    server = UDPServer(0, target_host, target_port, chunks(), fec_ratio=fec_ratio, connection_id=random.getrandbits(32))
+    retransmission_count = server.process()
+    return checksum, retransmission_count
+
+
+# Receiver worker process: receives one stripe into its range of the output file, returns the number of chunks delivered.
+def receive_stripe(host, port, output_filename, offset, length, chunk_size, ready):
+    """
+    :param ready: Queue the port is put into once the socket is bound.
+    """
+    fd = os.open(output_filename, os.O_WRONLY)
+    try:
+        writer = PositionalWriter(fd, chunk_size, offset)
+        client = UDPClient(host, port, writer=writer, packet_count=chunk_count(length, chunk_size))
+        client.bind()
+        ready.put(port)
+        return sum(1 for _ in client.process())
+    finally:
+        os.close(fd)
+
+
+# Serves one striped transfer request on an accepted control connection.
+def serve_striped_request(conn, fec_ratio='auto'):
+    """
+    :param conn: The accepted TCP control connection.
+    :param fec_ratio: Parity packets per data packet of every stripe, see UDPServer.
+    """
+    header = receive_exactly(conn, STRIPE_REQUEST.size)
+    if header is None:
+        return
+    version, stripe_count, base_port, name_length = STRIPE_REQUEST.unpack(header)
+    name = receive_exactly(conn, name_length)
+    if version != constants.PROTOCOL_VERSION or name is None:
+        return
+    filename = name.decode(errors='replace')
+    try:
+        file_size = os.path.getsize(filename)
+    except OSError as error:
+        print('Can not send {}: {}'.format(filename, error))
+        return  # Closing the connection tells the receiver
+
+    target_host = conn.getpeername()[0]
+    chunk_size = chunk_size_for(route_max_datagram((target_host, base_port)))
+    stripes = split_ranges(file_size, min(stripe_count, MAX_STRIPES), chunk_size)
+    conn.sendall(STRIPE_LAYOUT.pack(constants.PROTOCOL_VERSION, file_size, len(stripes), chunk_size))
+    if not stripes or receive_exactly(conn, len(STRIPE_START)) != STRIPE_START:
+        return
+
+    with ProcessPoolExecutor(len(stripes)) as pool:
+        futures = [pool.submit(send_stripe, filename, offset, length, chunk_size, target_host, base_port + i, fec_ratio)
+                   for i, (offset, length) in enumerate(stripes)]
+        results = [future.result() for future in futures]
+    conn.sendall(b''.join(STRIPE_RESULT.pack(*result) for result in results))
+
+
+# Accepts striped transfer requests on the control port, one transfer at a time.
+def serve_striped(host, control_port, fec_ratio='auto'):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Restarts do not wait for old connections
+    listener.bind((host, control_port))
+    listener.listen()
+    while True:
+        conn, _ = listener.accept()
+        with conn:
+            serve_striped_request(conn, fec_ratio)
+
+
+# Receives a file in stripes, one receiver process per stripe, then checks every stripe against the sender's CRC32.
+# Returns the total number of retransmissions, or None if the transfer failed or the file is corrupt.
+# Raises the exception of a stripe worker that fails before its socket is bound, e.g. because its port is in use.
+def receive_striped(server_host, control_port, filename, output_filename, stripe_count, base_port, host=''):
+    """
+    :param server_host: Address of the sender.
+    :param control_port: TCP port of the sender's control connection.
+    :param filename: Name of the requested file.
+    :param output_filename: Path the file is written to.
+    :param stripe_count: Number of stripes requested, the sender may use fewer.
+    :param base_port: UDP port of the first stripe, stripe i is received on base_port + i.
+    :param host: Address the stripe sockets are bound to.
+    """
+    name = filename.encode()
+    with socket.create_connection((server_host, control_port)) as control:
+        control.sendall(STRIPE_REQUEST.pack(constants.PROTOCOL_VERSION, stripe_count, base_port, len(name)) + name)
+        layout = receive_exactly(control, STRIPE_LAYOUT.size)
+        if layout is None:
+            return None  # The sender does not have the file
+        version, file_size, stripe_count, chunk_size = STRIPE_LAYOUT.unpack(layout)
+        if version != constants.PROTOCOL_VERSION:
+            return None
+
+        stripes = split_ranges(file_size, stripe_count, chunk_size)
+        with open(output_filename, 'wb') as output_file:
+            output_file.truncate(file_size)  # Every stripe writes into its own range of the full size file
+        if not stripes:
+            return 0
+
+        with Manager() as manager, ProcessPoolExecutor(len(stripes)) as pool:
+            ready = manager.Queue()
+            futures = [pool.submit(receive_stripe, host, base_port + i, output_filename, offset, length, chunk_size, ready)
+                       for i, (offset, length) in enumerate(stripes)]
+            bound_count = 0
+            while bound_count < len(stripes):
+                try:
+                    ready.get(timeout=WORKER_POLL_INTERVAL)
+                    bound_count += 1
+                except queue.Empty:
+                    # A worker that failed before binding never reports, its exception is raised here
+                    for future in futures:
+                        if future.done():
+                            future.result()
+            control.sendall(STRIPE_START)
+
+            results = receive_exactly(control, STRIPE_RESULT.size * len(stripes))
+            delivered_counts = [future.result() for future in futures]
+        if results is None:
+            return None
+
+    # Completion and integrity: every stripe delivered all of its chunks and matches the sender's checksum
+    retransmission_count = 0
+    for i, (offset, length) in enumerate(stripes):
+        checksum, retransmissions = STRIPE_RESULT.unpack_from(results, i * STRIPE_RESULT.size)
+        retransmission_count += retransmissions
+        if delivered_counts[i] != chunk_count(length, chunk_size) or range_checksum(output_filename, offset, length) != checksum:
+            print('Stripe {} of {} is incomplete or corrupt'.format(i, filename))
+            return None
+    return retransmission_count
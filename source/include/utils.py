@@ -1,7 +1,45 @@
-import hashlib
+import struct
+import zlib
 
-def get_checksum(data):
-    return hashlib.md5(data).digest()
+# Header frame sent ahead of every file over TCP: version, flags, timestamp, file length, file name length.
+# The file name and then the file follow it, unframed or in compressed blocks, a frame without a name ends the batch.
+TCP_FRAME_HEADER = struct.Struct('!BBdQH')
 
-def check_checksum(checksum, data):
-    return checksum == get_checksum(data)
+# Request of a batch of files over TCP: version, handshake options the client accepts (the compression codecs),
+# length of the file names and glob patterns that follow it
+TCP_REQUEST_HEADER = struct.Struct('!BBI')
+
+# CRC32 of the data, start continues a running checksum so a packet can be covered in parts.
+def get_checksum(data, start=0):
+    return zlib.crc32(data, start)
+
+def check_checksum(checksum, data, start=0):
+    return checksum == get_checksum(data, start)
+
+# Receives exactly size bytes from a stream socket into a new bytearray, returns None if the connection is closed before.
+def receive_exactly(client_socket, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = client_socket.recv_into(view[received:])
+        if not count:
+            return None
+        received += count
+    return buffer
+
+# Receives the next length bytes of a stream socket in pieces as they arrive, yields views of the reusable buffer,
+# each one is only valid until the next one is requested. Stops early if the connection is closed.
+def receive_stream(client_socket, length, buffer):
+    """
+    :param client_socket: A connected stream socket.
+    :param length: Number of bytes to receive.
+    :param buffer: A writable buffer, the most received by one system call.
+    """
+    view = memoryview(buffer)
+    while length > 0:
+        count = client_socket.recv_into(view[:min(length, len(view))])
+        if not count:
+            return
+        length -= count
+        yield view[:count]
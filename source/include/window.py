@@ -0,0 +1,79 @@
+from . import constants
+
+# Number of distinct sequence numbers that fit in the header field
+SEQUENCE_NUM_MODULO = 1 << (8 * constants.SEQUENCE_NUM_BYTES)
+
+# Restores the full sequence number from the value carried on the wire.
+# Wire sequence numbers wrap at SEQUENCE_NUM_MODULO, the full one is the closest to the reference.
+def unwrap_seq_no(wire_seq_no, reference):
+    """
+    :param wire_seq_no: Sequence number as read from a packet header.
+    :param reference: A full sequence number close to the expected one, e.g. the window base.
+    """
+    distance = (wire_seq_no - reference) % SEQUENCE_NUM_MODULO
+    if distance >= SEQUENCE_NUM_MODULO // 2:
+        distance -= SEQUENCE_NUM_MODULO
+    return reference + distance
+
+
+# A sliding window of packages backed by a ring buffer.
+# The package with sequence number n lives in slot n % capacity, so lookups by sequence number,
+# appends and removals from the front are all constant time.
+class RingWindow:
+    def __init__(self, capacity, base_seq_no=0):
+        """
+        :param capacity: Maximum number of packages the window can hold.
+        :param base_seq_no: Sequence number of the first package to be stored.
+        """
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.base = base_seq_no  # Sequence number of the oldest package in the window
+        self.end = base_seq_no  # Sequence number right after the newest package in the window
+        self.in_flight = 0  # Number of packages sent but not acknowledged yet, maintained by the sender
+
+    def __len__(self):
+        return self.end - self.base
+
+    def __bool__(self):
+        return self.end != self.base
+
+    def __contains__(self, seq_no):
+        return self.base <= seq_no < self.end
+
+    def __iter__(self):
+        for seq_no in range(self.base, self.end):
+            yield self.slots[seq_no % self.capacity]
+
+    def is_full(self):
+        return self.end - self.base >= self.capacity
+
+    # Returns the package with the given sequence number, None if it is outside of the window.
+    def get(self, seq_no):
+        if self.base <= seq_no < self.end:
+            return self.slots[seq_no % self.capacity]
+        return None
+
+    # Returns the oldest package in the window.
+    def first(self):
+        return self.slots[self.base % self.capacity]
+
+    # Appends a package right after the newest one, its sequence number must be self.end.
+    def append(self, package):
+        if package.seq_no != self.end or self.is_full():
+            raise ValueError('Package {} does not fit the window [{}, {})'.format(package.seq_no, self.base, self.base + self.capacity))
+        self.slots[self.end % self.capacity] = package
+        self.end += 1
+
+    # Removes and returns the oldest package in the window.
+    def popleft(self):
+        index = self.base % self.capacity
+        package = self.slots[index]
+        self.slots[index] = None
+        self.base += 1
+        return package
+
+    # Drops every package with a sequence number greater than or equal to the given one.
+    def truncate(self, seq_no):
+        while self.end > max(seq_no, self.base):
+            self.end -= 1
+            self.slots[self.end % self.capacity] = None
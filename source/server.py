@@ -1,3 +1,5 @@
+import os
+from collections import deque
 from include import *
 
 HOST = ''
@@ -5,86 +7,161 @@ TCP_PORT, UDP_PORT = 65432, 20001
 TARGET_HOST_IP = "172.17.0.3"
 UDP_TARGET_PORT, UDP_SENDER_PORT = 20001, 20001
 TCP_TARGET_PORT, TCP_SENDER_PORT = 65432, 65432
+STRIPE_CONTROL_PORT = 65433
+
+# Connections served recently, a SYN repeated while its transfer was running is not served twice
+SERVED_CONNECTIONS = deque(maxlen=64)
 
 def create_socket(host_ip, port_number):
     connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     connection.bind((host_ip, port_number))
     return connection
 
-def pack_package(chunk):
-    timestamp = get_timestamp()
-    chunk_length = len(chunk)
-    aligner_size = constants.TCP_MAX_CHUNK_SIZE - chunk_length
-    return struct.pack(f'!dI{chunk_length}s{aligner_size}s', timestamp, chunk_length, chunk, b' ' * aligner_size)
-
-# Sends the file data using the TCP protocol.
-def send_file(conn, filename):
-    with open(filename, 'rb') as file:
-        while True:
-            chunk = file.read(TCP_MAX_CHUNK_SIZE)
-            if not chunk:
-                break
-            packed = pack_package(chunk)
-            conn.sendall(packed)
-
-# Handles the client connection to receive a file request and send the file.
-def handle_client_connection(conn):
-    request = conn.recv(1024).decode()  # Assuming the request is a simple file name
-    # print(f"Client requested file: {request}")
-    send_file(conn, request)
-    conn.close()
+# Sends the file data using the TCP protocol: a header frame with the file length and name, then the file itself,
+# copied by the kernel with sendfile where available, so the data never passes through Python.
+# With a compressor the file is sent in compressed blocks instead, unless its first block does not shrink.
+def send_file(conn, filename, compressor=None):
+    """
+    :param conn: The connected socket.
+    :param filename: The path to the file.
+    :param compressor: A ChunkCompressor, None sends the file as it is.
+    """
+    try:
+        file = open(filename, 'rb')
+    except OSError as error:
+        print('Can not send {}: {}'.format(filename, error))
+        return
+    with file:
+        file_length = os.fstat(file.fileno()).st_size
+        name = filename.encode()
+        block = file.read(TCP_COMPRESSION_BLOCK_SIZE) if compressor is not None else b''
+        compressed = compressor.compress(block) if block else None
+        flags = 0 if compressed is None else FLAG_COMPRESSED
+        conn.sendall(TCP_FRAME_HEADER.pack(constants.PROTOCOL_VERSION, flags, get_timestamp(), file_length, len(name)) + name)
+        if compressed is None:
+            conn.sendfile(file, offset=0, count=file_length)
+            return
+
+        # Every block says whether it is compressed, blocks that do not shrink are sent as they are
+        option = CODEC_OPTIONS[compressor.codec]
+        while block:
+            if compressed is None:
+                conn.sendall(COMPRESSED_BLOCK_HEADER.pack(0, len(block), len(block)) + block)
+            else:
+                conn.sendall(COMPRESSED_BLOCK_HEADER.pack(option, len(compressed), len(block)) + compressed)
+            block = file.read(TCP_COMPRESSION_BLOCK_SIZE)
+            compressed = compressor.compress(block) if block else None
+
+# Handles the client connection: receives a batch request and sends the files back to back on the same connection.
+def handle_client_connection(conn, compression=None, compression_level=None):
+    """
+    :param conn: The accepted socket.
+    :param compression: Codec the files are compressed with if the client accepts it, 'zlib' or 'lzma', None sends them as they are.
+    :param compression_level: Level of the codec, None for its default.
+    """
+    with conn:
+        header = receive_exactly(conn, TCP_REQUEST_HEADER.size)
+        if header is None:
+            return
+        version, accepted_options, request_length = TCP_REQUEST_HEADER.unpack(header)
+        request = receive_exactly(conn, request_length)
+        if version != constants.PROTOCOL_VERSION or request is None:
+            return
+        # print(f"Client requested files: {request}")
+        compressor = None
+        if compression is not None and accepted_options & CODEC_OPTIONS[compression]:
+            compressor = ChunkCompressor(compression, compression_level)
+        for filename in expand_request(request.decode(errors='replace')):
+            send_file(conn, filename, compressor)
+        conn.sendall(TCP_FRAME_HEADER.pack(constants.PROTOCOL_VERSION, 0, get_timestamp(), 0, 0))  # End of the batch
 
 # Splits a file into chunks, yields the chunks respectively.
+# The chunks are views of a single reused buffer, each one is only valid until the next one is requested.
 def chunk_file(filename, chunk_size):
     """
     :param filename: The path to the file to be chunked.
     :param chunk_size: The size of each chunk.
     """
+    buffer = memoryview(bytearray(chunk_size))
     with open(filename, 'rb') as file:
         while True:
-            chunk = file.read(chunk_size)
-            if not chunk:
+            size = file.readinto(buffer)
+            if not size:
                 break
-            yield chunk
-
-# Calculates the average transmission time for each package and the total transmission time,
-# returns a tuple containing the average time and total transmission time in milliseconds.
-# Used for UDP.
-def calculate_time(timestamps):
-    """
-    :param timestamps: A list of timestamps representing sent and received times of packages.
-    """
-    if not timestamps:
-        return 0, 0  # Return 0 if there are no timestamps
-
-    total_time = (timestamps[-1] - timestamps[0]) * 1000  # Total time in milliseconds
+            yield buffer[:size]
 
-    # Calculate differences between sent and received times
-    time_diffs = [abs(timestamps[i + 1] - timestamps[i]) * 1000 for i in range(0, len(timestamps), 2)]
-    avg_time = sum(time_diffs) / len(time_diffs)  # Average time in milliseconds
+# Sources of the chunks of a file sent over UDP: read inline, memory mapped, or read ahead by a background thread
+CHUNK_SOURCES = {'read': chunk_file, 'mmap': mmap_chunks, 'read_ahead': read_ahead_chunks}
 
-    return avg_time, total_time
-
-# Sends the file data using the UDP protocol.
-def send_udp(filename, sender_port, target_host, target_port):
+# Sends the requested file using the UDP protocol, with the parameters agreed for the request.
+def send_udp(request, sender_port, fec_ratio='auto', batched_io=False, probe_mtu=False, metrics_export=None,
+             source='mmap', compression=None, compression_level=None):
     """
-    :param filename: Name of the file to be sent.
+    :param request: The ConnectionRequest of the client's SYN.
     :param sender_port: Port number for the UDP client.
-    :param target_host: Target host address.
-    :param target_port: Target port number.
+    :param fec_ratio: Parity packets per data packet, 0 disables FEC, 'auto' follows the measured loss rate.
+    :param batched_io: Send runs of packets with one GSO system call where the kernel supports it.
+    :param probe_mtu: Probe the path MTU before the transfer if the client asked for it too.
+    :param metrics_export: Called with periodic snapshots of the transfer's metrics, e.g. export_json_lines(file).
+    :param source: Name of the chunk source of a single file in CHUNK_SOURCES.
+    :param compression: Codec the chunks are compressed with if the client accepts it, 'zlib' or 'lzma', None sends them as they are.
+    :param compression_level: Level of the codec, None for its default.
     """
-    data = chunk_file(filename, UDP_MAX_CHUNK_SIZE)
-    server = UDPServer(sender_port, target_host, target_port, data) 
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    options = DEFAULT_OPTIONS | OPTION_SESSION | OPTION_RESUME
+    if probe_mtu:
+        options |= OPTION_PMTU_PROBE
+    if compression is not None:
+        options |= CODEC_OPTIONS[compression]
+    parameters = agree_parameters(request, WINDOW_SIZE, options, udp_socket)
+    plan = None
+    try:
+        if parameters.options & OPTION_RESUME:
+            plan = plan_resume(request, parameters)
+        if parameters.options & OPTION_SESSION:
+            # A batch of files in one stream, the window, RTT and congestion state carry over from file to file
+            data = chunk_files(expand_request(request.filename), parameters.chunk_size())
+        elif plan is not None:
+            # Only the blocks the client's copy lacks
+            data = chunk_blocks(request.filename, plan[0], request.manifest.block_size, parameters.chunk_size())
+        else:
+            data = CHUNK_SOURCES[source](request.filename, parameters.chunk_size())
+        server = UDPServer(sender_port, *request.address, data, fec_ratio=fec_ratio, connection_id=request.connection_id,
+                           batched_io=batched_io, parameters=parameters, sock=udp_socket, metrics_export=metrics_export,
+                           compression_level=compression_level, resume_plan=None if plan is None else plan[1])
+    except OSError as error:
+        udp_socket.close()
+        print('Can not send {}: {}'.format(request.filename, error))
+        return
 
     retransmission_count = server.process()
     print('UDP Transmission Re-transferred Packets:', retransmission_count)
 
+# Serves UDP file requests of many clients at once on a single port, runs until interrupted.
+def serve_udp(fec_ratio='auto', source='mmap', compression=None, compression_level=None):
+    """
+    :param fec_ratio: Parity packets per data packet, 0 disables FEC, 'auto' follows the measured loss rate.
+    :param source: Name of the chunk source of a single file in CHUNK_SOURCES.
+    :param compression: Codec the chunks are compressed with if the client accepts it, 'zlib' or 'lzma', None sends them as they are.
+    :param compression_level: Level of the codec, None for its default.
+    """
+    def report(session):
+        print('UDP Transmission Re-transferred Packets:', session.retransmission_count)
+
+    options = DEFAULT_OPTIONS | OPTION_SESSION | OPTION_RESUME
+    if compression is not None:
+        options |= CODEC_OPTIONS[compression]
+    asyncio.run(serve_transfers(HOST, UDP_PORT, CHUNK_SOURCES[source], report, options=options, fec_ratio=fec_ratio,
+                                compression_level=compression_level))
+
+# Waits for the SYN of a new connection, returns its ConnectionRequest.
 def listen_for_requests(udp_socket):
     while True:
-        data, addr = udp_socket.recvfrom(1024)  # buffer size is 1024 bytes for req message
-        if data.decode()[:7] == "REQUEST":
-            return addr, data.decode()[7:]
-        
+        data, addr = udp_socket.recvfrom(constants.MSS_VALUE)
+        request = parse_request(data, addr)
+        if request is not None and (addr, request.connection_id) not in SERVED_CONNECTIONS:
+            SERVED_CONNECTIONS.append((addr, request.connection_id))
+            return request
 
 def main():
 
@@ -100,10 +177,17 @@ def main():
     ### Running UDP Server ###
     # udp_socket = create_udp_socket(HOST, UDP_PORT)
     # # print("Server is waiting for client requests...")
-    # client_addr, name = listen_for_requests(udp_socket)
-    # # print(f"Received request from {client_addr}, sending files...")
-  
-    # send_udp(name, UDP_SENDER_PORT, client_addr[0], UDP_TARGET_PORT)
+    # request = listen_for_requests(udp_socket)
+    # # print(f"Received request from {request.address}, sending files...")
+    # udp_socket.close()
+
+    # send_udp(request, UDP_SENDER_PORT)
+
+    ### Running asyncio UDP Server, serves concurrent clients on UDP_PORT ###
+    # serve_udp()
+
+    ### Running striped UDP Server, one sender process per stripe ###
+    # serve_striped(HOST, STRIPE_CONTROL_PORT)
 
 if __name__ == "__main__":
     while True:
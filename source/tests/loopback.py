@@ -0,0 +1,53 @@
+# Helpers of the tests: transfers over loopback, through a NetemProxy when the network is impaired.
+
+import socket
+import threading
+from include import *
+from benchmarks.netem import Impairment, NetemProxy
+
+# Runs one RDT transfer of the given bytes, returns the sender, the receiver and the bytes delivered in order.
+# drop is passed on to the NetemProxy, which is then used even without an impairment.
+def transfer(data, impairment=None, fec_ratio=0, server_options=DEFAULT_OPTIONS, client_options=DEFAULT_OPTIONS, seed=1,
+             drop=None):
+    listen_socket = create_udp_socket('127.0.0.1', 0)
+    listen_socket.settimeout(constants.RECEIVE_TIMEOUT)
+    senders = []
+
+    def serve():
+        request = None
+        while request is None:
+            request = parse_request(*listen_socket.recvfrom(constants.MSS_VALUE))
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        parameters = agree_parameters(request, WINDOW_SIZE, server_options, udp_socket)
+        chunk_size = parameters.chunk_size()
+        chunks = (data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size))
+        sender = UDPServer(0, *request.address, chunks, fec_ratio=fec_ratio, connection_id=request.connection_id,
+                           parameters=parameters, sock=udp_socket)
+        senders.append(sender)
+        sender.process()
+
+    serving_thread = threading.Thread(target=serve, daemon=True)
+    serving_thread.start()
+    address = listen_socket.getsockname()
+    if impairment is None and drop is not None:
+        impairment = Impairment()
+    proxy = None if impairment is None else NetemProxy(address, impairment, seed, drop=drop)
+
+    receiver = UDPClient('127.0.0.1', 0)
+    received = bytearray()
+    try:
+        if receiver.connect(address if proxy is None else proxy.address, 'test.obj', client_options):
+            for package in receiver.process():
+                received += package.chunk
+        serving_thread.join()
+    finally:
+        if proxy is not None:
+            proxy.close()
+        listen_socket.close()
+    return senders[0] if senders else None, receiver, bytes(received)
+
+# Returns a socket bound to a free loopback port, with a timeout so a missing datagram fails the test instead of hanging it.
+def bound_socket(timeout=2.0):
+    sock = create_udp_socket('127.0.0.1', 0)
+    sock.settimeout(timeout)
+    return sock
@@ -0,0 +1,84 @@
+import random
+import unittest
+from include import *
+from benchmarks.netem import Impairment
+from .loopback import bound_socket, transfer
+
+# Chunk size of the unit tests, small enough for any loopback MTU
+CHUNK_SIZE = 1000
+
+
+class AckCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.sender_socket = bound_socket()
+        self.receiver = UDPClient('127.0.0.1', 0, delayed_ack=False)
+        self.receiver.bind()
+        self.receiver.connection_id = 7
+        self.receiver.last_delivery_time = get_timestamp()  # Set by process(), the tests feed handle_datagram directly
+        self.address = self.sender_socket.getsockname()
+
+    def tearDown(self):
+        self.sender_socket.close()
+        self.receiver.socket.close()
+
+    # Feeds the data packets with the given sequence numbers to the receiver, returns the last ACK it sent.
+    def feed(self, seq_nos):
+        ack = None
+        for seq_no in seq_nos:
+            datagram = pack_package(seq_no, bytes(CHUNK_SIZE), connection_id=7)
+            buffer = memoryview(bytearray(constants.MSS_VALUE))
+            buffer[:len(datagram)] = datagram
+            for _ in self.receiver.handle_datagram(buffer, len(datagram), self.address):
+                pass
+            ack = self.sender_socket.recv(constants.MSS_VALUE)
+        return ack
+
+    # Returns the cumulative ACK, the SACK bitmap length and the bitmap of an ACK, checking its checksum.
+    def unpack(self, ack):
+        _, flags, connection_id, cumulative_ack, _, _, sack_length, checksum = ACK_HEADER.unpack_from(ack)
+        sack_bitmap = ack[ACK_HEADER.size:]
+        self.assertTrue(flags & FLAG_ACK)
+        self.assertEqual(connection_id, 7)
+        self.assertTrue(check_checksum(checksum, ack[:ACK_HEADER.size - constants.CHECKSUM_LENGTH_BYTES], get_checksum(sack_bitmap)))
+        return cumulative_ack, sack_length, sack_bitmap
+
+    def test_sack_bitmap_marks_out_of_order_arrivals(self):
+        cumulative_ack, sack_length, sack_bitmap = self.unpack(self.feed([0, 1, 3, 6]))
+        self.assertEqual(cumulative_ack, 2)
+        self.assertEqual(sack_length, len(sack_bitmap))
+        # Bit i stands for cumulative ACK + 1 + i
+        self.assertEqual(int.from_bytes(sack_bitmap, 'little'), 1 << 0 | 1 << 3)
+
+    def test_cumulative_only_without_sack(self):
+        self.receiver.apply_parameters(ConnectionParameters(constants.MSS_VALUE, WINDOW_SIZE, 1, OPTION_FEC))
+        cumulative_ack, sack_length, sack_bitmap = self.unpack(self.feed([0, 1, 3, 6]))
+        self.assertEqual(cumulative_ack, 2)
+        self.assertEqual(sack_length, 0)
+        self.assertEqual(sack_bitmap, b'')
+
+    def test_sender_acknowledges_sack_bits(self):
+        # The sender's packets go to the receiver's socket, which is never read, the test feeds the receiver itself
+        sender = UDPServer(0, *self.receiver.socket.getsockname(), iter([bytes(CHUNK_SIZE)] * 8), connection_id=7,
+                           sock=bound_socket())
+        sender.sender = BatchSender(sender.socket, sender.target, 'sendto')
+        for seq_no in range(8):
+            sender.send_packet(sender.window.get(seq_no))
+        sender.next_seq_no = 8
+        sender.flush_datagrams()
+        sender.socket.close()
+
+        sender.handle_ack(self.feed([0, 1, 3, 6]))
+        sender.remove_acked_packets()
+        self.assertEqual(sender.window.base, 2)
+        self.assertEqual([packet.seq_no for packet in sender.window if packet.state == STATE_ACKED], [3, 6])
+
+
+class CumulativeAckTransferTest(unittest.TestCase):
+    def test_transfer_without_sack_under_loss(self):
+        data = random.Random(3).randbytes(1 << 20)
+        _, _, received = transfer(data, Impairment(loss=0.05), client_options=OPTION_FEC)
+        self.assertEqual(received, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
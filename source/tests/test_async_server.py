@@ -0,0 +1,102 @@
+import asyncio
+import random
+import socket
+import threading
+import unittest
+from include import *
+from .loopback import bound_socket
+
+# Files served by the tests, by name
+FILES = {'a.obj': random.Random(6).randbytes(600 * 1024), 'b.obj': random.Random(7).randbytes(300 * 1024 + 17),
+         'c.obj': b''}
+
+
+# Yields the chunks of a served file.
+def open_data(filename, chunk_size):
+    data = FILES[filename]
+    return (data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size))
+
+
+# Runs a TransferServerProtocol on an event loop of its own thread.
+class ServerThread:
+    def __init__(self):
+        self.finished = []
+        self.loop = asyncio.new_event_loop()
+        self.protocol = TransferServerProtocol(open_data, self.finished.append)
+        self.transport, _ = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(lambda: self.protocol, local_addr=('127.0.0.1', 0)))
+        self.address = self.transport.get_extra_info('sockname')
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class ConcurrentSessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ServerThread()
+
+    def tearDown(self):
+        self.server.close()
+
+    # Receives the given files at once with one receiver each, all of them on one socket so that only the connection ID
+    # tells their packets apart. Returns the bytes delivered to every receiver, in the order of the file names.
+    def receive_all(self, filenames):
+        sock = bound_socket(timeout=0.01)
+        receivers = {}
+        received = {}
+        for filename in filenames:
+            receiver = UDPClient('127.0.0.1', 0, delayed_ack=False)
+            receiver.socket = sock
+            receiver.connection_id = len(receivers) + 1
+            receiver.last_delivery_time = get_timestamp()
+            proposal = ConnectionParameters(constants.MSS_VALUE, receiver.window.capacity, 1, DEFAULT_OPTIONS)
+            sock.sendto(pack_syn(receiver.connection_id, filename, proposal), self.server.address)
+            receivers[receiver.connection_id] = receiver
+            received[receiver.connection_id] = bytearray()
+
+        deadline = get_timestamp() + 30
+        while (any(receiver.window for receiver in receivers.values()) or len(self.server.finished) < len(filenames)) \
+                and get_timestamp() < deadline:
+            buffer = memoryview(bytearray(constants.MSS_VALUE))
+            try:
+                size, address = sock.recvfrom_into(buffer)
+            except socket.timeout:
+                continue
+            if is_control_packet(buffer[:size]):
+                result = unpack_control(buffer[:size])
+                receiver = receivers.get(result[1]) if result is not None else None
+                if receiver is not None:
+                    receiver.handle_control(buffer[:size], address)
+                continue
+            result = unpack_package(buffer[:size])
+            receiver = receivers.get(result[5]) if result is not None else None
+            if receiver is None:
+                continue
+            if receiver.window:
+                for package in receiver.handle_datagram(buffer, size, address):
+                    received[result[5]] += package.chunk
+            else:
+                receiver.handle_lingering(buffer[:size], address)
+        sock.close()
+        return [bytes(data) for data in received.values()]
+
+    def test_concurrent_clients_on_one_address(self):
+        received = self.receive_all(list(FILES))
+        for filename, data in zip(FILES, received):
+            self.assertEqual(data, FILES[filename], filename)
+        self.assertEqual(sorted(session.filename for session in self.server.finished), sorted(FILES))
+        self.assertEqual(len({session.target for session in self.server.finished}), 1)
+        self.assertFalse(self.server.protocol.sessions)
+
+    def test_same_file_twice(self):
+        received = self.receive_all(['a.obj', 'a.obj'])
+        self.assertEqual(received, [FILES['a.obj']] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import random
+import socket
+import time
+import unittest
+from include import *
+from .loopback import bound_socket
+
+
+class BatchedPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(8)
+        # Runs of equal sizes for GSO, a shorter datagram closing a run, and single odd sizes
+        self.datagrams = [self.rng.randbytes(size) for size in [1200] * 70 + [500] + [1200] * 3 + [1, 7000, 300] * 5]
+
+    # Sends the datagrams with one send mode and receives them with one receive mode, returns both ends.
+    def run_modes(self, send_mode, receive_mode):
+        receiving_socket = bound_socket()
+        receiving_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 21)
+        sending_socket = bound_socket()
+        try:
+            sender = BatchSender(sending_socket, receiving_socket.getsockname(), send_mode)
+            receiver = BatchReceiver(receiving_socket, BufferPool(8, constants.MSS_VALUE), receive_mode)
+            for datagram in self.datagrams:
+                sender.send(datagram)
+            sender.flush()
+
+            received = []
+            while len(received) < len(self.datagrams):
+                for buffer, size, address in receiver.receive():
+                    received.append(bytes(buffer[:size]))
+                    self.assertEqual(address, sending_socket.getsockname())
+            return sender, receiver, received
+        finally:
+            sending_socket.close()
+            receiving_socket.close()
+
+    def test_every_mode(self):
+        for send_mode in SEND_MODES:
+            for receive_mode in RECEIVE_MODES:
+                with self.subTest(send_mode=send_mode, receive_mode=receive_mode):
+                    sender, receiver, received = self.run_modes(send_mode, receive_mode)
+                    self.assertEqual(received, self.datagrams)
+                    # Where the kernel or the C library lacks the fast path, the plain one is used
+                    self.assertIn(sender.mode, (send_mode, 'sendto'))
+                    self.assertIn(receiver.mode, (receive_mode, 'recvfrom'))
+                    if sender.mode != 'sendto':
+                        self.assertLess(sender.syscall_count, len(self.datagrams))
+
+    def test_default_modes(self):
+        sender, receiver, received = self.run_modes(None, None)
+        self.assertEqual(received, self.datagrams)
+        self.assertIn(sender.mode, ('gso', 'sendto'))
+        self.assertIn(receiver.mode, ('gro', 'recvfrom'))
+
+
+class QueuedRetransmissionTest(unittest.TestCase):
+    # A packet resent before its first transmission left the queue shares its buffer, both copies must keep their header
+    def test_retransmission_of_a_queued_packet(self):
+        receiving_socket = bound_socket()
+        sender = UDPServer(0, *receiving_socket.getsockname(), iter([bytes(1000)] * 2), connection_id=7, sock=bound_socket())
+        sender.sender = BatchSender(sender.socket, sender.target, 'sendto')
+        try:
+            packet = sender.window.get(0)
+            sender.send_packet(packet)
+            first_timestamp = packet.timestamp_sent
+            time.sleep(0.01)
+            sender.send_packet(packet)
+            sender.flush_datagrams()
+            timestamps = [unpack_package(receiving_socket.recv(constants.MSS_VALUE))[1] for _ in range(2)]
+        finally:
+            sender.socket.close()
+            receiving_socket.close()
+        self.assertEqual(timestamps, [first_timestamp, packet.timestamp_sent])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import os
+import random
+import socket
+import tempfile
+import threading
+import unittest
+import client
+import server
+from include import *
+from include.compression import MIN_SAVING, SAMPLE_CHUNKS, SKIPPED_CHUNKS
+from .loopback import transfer
+
+# Codecs of the tests
+CODECS = tuple(CODEC_OPTIONS)
+
+
+# Returns text-like bytes of the given length that compress well but not trivially.
+def compressible_data(length, seed=12):
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randint(2, 9)) for _ in range(64)]
+    data = bytearray()
+    while len(data) < length:
+        data += rng.choice(words) + b' '
+    return bytes(data[:length])
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = compressible_data(100000)
+        for codec in CODECS:
+            for level in (None, 1, 9):
+                with self.subTest(codec=codec, level=level):
+                    compressed = compress_data(codec, data, level)
+                    self.assertLess(len(compressed), len(data) // 2)
+                    self.assertEqual(decompress_data(codec, compressed, len(data)), data)
+
+    def test_invalid_data(self):
+        data = compressible_data(10000)
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                compressed = compress_data(codec, data)
+                self.assertIsNone(decompress_data(codec, compressed[:len(compressed) // 2], len(data)))  # Truncated
+                self.assertIsNone(decompress_data(codec, compressed, len(data) - 1))  # Longer than allowed
+                self.assertIsNone(decompress_data(codec, b'\xff' * 100, len(data)))
+
+    def test_codec_for_options(self):
+        self.assertIsNone(codec_for_options(DEFAULT_OPTIONS))
+        self.assertEqual(codec_for_options(OPTION_LZMA), 'lzma')
+        self.assertEqual(codec_for_options(OPTION_ZLIB | OPTION_LZMA), 'zlib')
+
+
+class ChunkCompressorTest(unittest.TestCase):
+    def test_round_trip(self):
+        chunk = compressible_data(constants.MSS_VALUE)
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                compressor = ChunkCompressor(codec)
+                compressed = compressor.compress(chunk)
+                self.assertEqual(decompress_data(codec, compressed, constants.MSS_VALUE), chunk)
+                self.assertEqual((compressor.compressed_count, compressor.saved_bytes), (1, len(chunk) - len(compressed)))
+
+    def test_data_that_does_not_shrink_is_sent_raw(self):
+        rng = random.Random(13)
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                compressor = ChunkCompressor(codec)
+                self.assertIsNone(compressor.compress(rng.randbytes(1000)))
+                # Shrinking by less than MIN_SAVING is not worth it either
+                chunk = compressible_data(50) + rng.randbytes(950)
+                self.assertGreater(len(compress_data(codec, chunk)), len(chunk) * (1 - MIN_SAVING))
+                self.assertIsNone(compressor.compress(chunk))
+                self.assertEqual((compressor.compressed_count, compressor.saved_bytes), (0, 0))
+
+    def test_incompressible_data_is_skipped_then_sampled_again(self):
+        rng = random.Random(14)
+        compressor = ChunkCompressor('zlib')
+        for _ in range(SAMPLE_CHUNKS):
+            self.assertIsNone(compressor.compress(rng.randbytes(1000)))
+        # Compressible chunks are not even tried while skipping
+        chunk = compressible_data(1000)
+        for _ in range(SKIPPED_CHUNKS):
+            self.assertIsNone(compressor.compress(chunk))
+        self.assertIsNotNone(compressor.compress(chunk))
+
+
+class UDPCompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.data = compressible_data(300 * 1024 + 5)
+
+    def test_each_codec_negotiated(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                sender, receiver, received = transfer(self.data, server_options=DEFAULT_OPTIONS | CODEC_OPTIONS[codec],
+                                                      client_options=DEFAULT_OPTIONS | COMPRESSION_OPTIONS)
+                self.assertEqual(received, self.data)
+                self.assertEqual((sender.compressor.codec, receiver.codec), (codec, codec))
+                self.assertGreater(sender.compressor.compressed_count, 0)
+                self.assertEqual(sender.acked_bytes, len(self.data))  # Counted before compression
+
+    def test_not_accepted_by_the_client(self):
+        sender, receiver, received = transfer(self.data, server_options=DEFAULT_OPTIONS | COMPRESSION_OPTIONS)
+        self.assertEqual(received, self.data)
+        self.assertIsNone(sender.compressor)
+        self.assertIsNone(receiver.codec)
+
+    # Incompressible chunks in the middle of a compressed transfer travel without FLAG_COMPRESSED
+    def test_mixed_data(self):
+        data = compressible_data(100 * 1024) + random.Random(15).randbytes(100 * 1024) + compressible_data(100 * 1024, 16)
+        sender, receiver, received = transfer(data, server_options=DEFAULT_OPTIONS | OPTION_ZLIB,
+                                              client_options=DEFAULT_OPTIONS | COMPRESSION_OPTIONS)
+        self.assertEqual(received, data)
+        self.assertLess(sender.compressor.compressed_count, len(data) // sender.parameters.chunk_size())
+
+
+class TCPCompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.working_directory = os.getcwd()
+        os.chdir(self.directory.name)  # request_files saves the files in the working directory
+        # A compressible file of several blocks, one whose second block does not shrink, and an incompressible one
+        rng = random.Random(17)
+        self.files = {'text.obj': compressible_data(2 * TCP_COMPRESSION_BLOCK_SIZE + 1000),
+                      'mixed.obj': compressible_data(TCP_COMPRESSION_BLOCK_SIZE) + rng.randbytes(TCP_COMPRESSION_BLOCK_SIZE // 2),
+                      'random.obj': rng.randbytes(TCP_COMPRESSION_BLOCK_SIZE + 1)}
+        for filename, data in self.files.items():
+            with open(filename, 'wb') as file:
+                file.write(data)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    # Returns the flags of the frame send_file sends for a file and the options of its blocks, checks the data they carry.
+    def send_blocks(self, filename, compressor):
+        sending_socket, receiving_socket = socket.socketpair()
+        sending_thread = threading.Thread(target=server.send_file, args=(sending_socket, filename, compressor), daemon=True)
+        sending_thread.start()
+        with receiving_socket:
+            header = client.unpack_header(receive_exactly(receiving_socket, TCP_HEADER_BYTES))
+            _, file_length, name_length, flags = header
+            receive_exactly(receiving_socket, name_length)
+            options = []
+            data = bytearray()
+            if flags & FLAG_COMPRESSED:
+                while len(data) < file_length:
+                    option, stored_length, data_length = COMPRESSED_BLOCK_HEADER.unpack(
+                        receive_exactly(receiving_socket, COMPRESSED_BLOCK_HEADER.size))
+                    block = receive_exactly(receiving_socket, stored_length)
+                    data += decompress_data(codec_for_options(option), block, data_length) if option else block
+                    options.append(option)
+            else:
+                data = receive_exactly(receiving_socket, file_length)
+        sending_thread.join()
+        sending_socket.close()
+        self.assertEqual(data, self.files[filename])
+        return flags, options
+
+    def test_blocks(self):
+        for codec in CODECS:
+            option = CODEC_OPTIONS[codec]
+            with self.subTest(codec=codec):
+                self.assertEqual(self.send_blocks('text.obj', ChunkCompressor(codec)), (FLAG_COMPRESSED, [option] * 3))
+                self.assertEqual(self.send_blocks('mixed.obj', ChunkCompressor(codec)), (FLAG_COMPRESSED, [option, 0]))
+                # The first block decides, a file starting incompressible goes out as it is
+                self.assertEqual(self.send_blocks('random.obj', ChunkCompressor(codec)), (0, []))
+        self.assertEqual(self.send_blocks('text.obj', None), (0, []))
+
+    # Serves one batch request with handle_client_connection, returns the names the client received.
+    def request(self, accepted_options, compression):
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket.bind(('127.0.0.1', 0))
+        listen_socket.listen()
+
+        def serve():
+            conn, _ = listen_socket.accept()
+            server.handle_client_connection(conn, compression)
+
+        serving_thread = threading.Thread(target=serve, daemon=True)
+        serving_thread.start()
+        try:
+            received = client.request_files('127.0.0.1', listen_socket.getsockname()[1], list(self.files), accepted_options)
+            serving_thread.join()
+        finally:
+            listen_socket.close()
+        return received
+
+    def test_each_codec_negotiated(self):
+        for codec in CODECS:
+            for accepted_options in (CODEC_OPTIONS[codec], COMPRESSION_OPTIONS, 0):
+                with self.subTest(codec=codec, accepted_options=accepted_options):
+                    self.assertEqual(self.request(accepted_options, codec), list(self.files))
+                    for filename, data in self.files.items():
+                        with open('received_' + filename, 'rb') as file:
+                            self.assertEqual(file.read(), data, filename)
+                        os.remove('received_' + filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+from include import *
+
+
+# The controllers only read srtt from the sender's RTTEstimator
+class FixedRTT:
+    def __init__(self, srtt):
+        self.srtt = srtt
+
+
+class CongestionControllerTest(unittest.TestCase):
+    def test_abstract_base(self):
+        with self.assertRaises(TypeError):
+            CongestionController(100)
+
+    def test_create_by_name(self):
+        self.assertIsInstance(create_congestion_controller('reno', 100), RenoController)
+        self.assertIsInstance(create_congestion_controller('rate', 100), RateController)
+        with self.assertRaises(ValueError):
+            create_congestion_controller('vegas', 100)
+
+
+class RenoControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = RenoController(100)
+        self.rtt = FixedRTT(0.01)
+
+    # Acknowledges a round trip worth of packets, one per packet of the current window.
+    def ack_round(self, seq_no):
+        count = int(self.controller.cwnd)
+        for i in range(count):
+            self.controller.on_ack(seq_no + i, self.rtt)
+        return seq_no + count
+
+    def test_slow_start_doubles_every_round_trip(self):
+        self.assertEqual(self.controller.cwnd, INITIAL_WINDOW)
+        self.ack_round(0)
+        self.assertEqual(self.controller.cwnd, 2 * INITIAL_WINDOW)
+        self.ack_round(INITIAL_WINDOW)
+        self.assertEqual(self.controller.cwnd, 4 * INITIAL_WINDOW)
+
+    def test_window_is_capped(self):
+        seq_no = 0
+        for _ in range(10):
+            seq_no = self.ack_round(seq_no)
+        self.assertEqual(self.controller.cwnd, 100)
+
+    def test_congestion_avoidance_adds_one_packet_per_round_trip(self):
+        self.controller.ssthresh = self.controller.cwnd = 20
+        self.ack_round(0)
+        self.assertAlmostEqual(self.controller.cwnd, 21, delta=0.05)
+
+    def test_fast_recovery_halves_once_per_window(self):
+        self.controller.cwnd = 40
+        self.controller.on_loss(5, 45, timeout=False)
+        self.assertEqual((self.controller.cwnd, self.controller.ssthresh), (20, 20))
+        # Further losses of the same window belong to the same event
+        self.controller.on_loss(10, 50, timeout=False)
+        self.assertEqual(self.controller.cwnd, 20)
+        # A loss of a packet sent after the recovery started is a new event
+        self.controller.on_loss(45, 70, timeout=False)
+        self.assertEqual(self.controller.cwnd, 10)
+
+    def test_timeout_collapses_the_window(self):
+        self.controller.cwnd = 40
+        self.controller.on_loss(5, 45, timeout=True)
+        self.assertEqual((self.controller.cwnd, self.controller.ssthresh), (MIN_WINDOW, 20))
+        # Slow start again up to ssthresh
+        self.ack_round(45)
+        self.assertEqual(self.controller.cwnd, 2 * MIN_WINDOW)
+
+    def test_pacing_rate(self):
+        self.assertIsNone(self.controller.pacing_rate(FixedRTT(None)))
+        self.assertAlmostEqual(self.controller.pacing_rate(self.rtt), PACING_GAIN * INITIAL_WINDOW / 0.01)
+
+
+class RateControllerTest(unittest.TestCase):
+    def test_startup_and_decrease(self):
+        controller = RateController(1000)
+        rtt = FixedRTT(0.01)
+        controller.on_ack(0, rtt)
+        self.assertAlmostEqual(controller.rate, INITIAL_WINDOW / 0.01 + 1 / 0.01)
+        rate = controller.rate
+        controller.on_loss(0, 10, timeout=False)
+        self.assertFalse(controller.in_startup)
+        self.assertAlmostEqual(controller.rate, rate * RATE_DECREASE_FACTOR)
+        controller.on_loss(10, 20, timeout=True)
+        self.assertAlmostEqual(controller.rate, rate * RATE_DECREASE_FACTOR * 0.5)
+        self.assertEqual(controller.pacing_rate(rtt), controller.rate)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_unlimited_without_a_rate(self):
+        bucket = TokenBucket()
+        bucket.refill(0.0, None)
+        for _ in range(100):
+            self.assertTrue(bucket.can_send())
+            bucket.consume()
+        self.assertEqual(bucket.time_until_ready(), 0)
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(burst=4)
+        bucket.refill(0.0, 100)
+        for _ in range(4):
+            self.assertTrue(bucket.can_send())
+            bucket.consume()
+        self.assertFalse(bucket.can_send())
+        self.assertAlmostEqual(bucket.time_until_ready(), 0.01)
+        bucket.refill(0.025, 100)
+        self.assertAlmostEqual(bucket.tokens, 2.5)
+
+    def test_tokens_are_capped_at_the_burst(self):
+        bucket = TokenBucket(burst=4)
+        bucket.refill(0.0, 100)
+        bucket.refill(10.0, 100)
+        self.assertEqual(bucket.tokens, 4)
+
+    def test_retransmissions_drive_the_bucket_into_debt(self):
+        bucket = TokenBucket(burst=1)
+        bucket.refill(0.0, 100)
+        bucket.consume()
+        bucket.consume()
+        self.assertAlmostEqual(bucket.time_until_ready(), 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import random
+import time
+import unittest
+from include import *
+from include.reliable_udp import PACKAGE_HEADER
+from benchmarks.netem import Impairment
+from .loopback import bound_socket, transfer
+
+# Chunk size of the unit tests, small enough for any loopback MTU
+CHUNK_SIZE = 1000
+
+# One way delay of the impaired path, in seconds
+PATH_DELAY = 0.01
+
+
+class ParityRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1)
+        self.sender_socket = bound_socket()
+        # One packet more than the group, so the window stays open and every arrival is acknowledged at once
+        self.receiver = UDPClient('127.0.0.1', 0, packet_count=5, delayed_ack=False)
+        self.receiver.bind()
+        self.receiver.connection_id = 7
+        self.receiver.last_delivery_time = get_timestamp()  # Set by process(), the tests feed handle_datagram directly
+        self.address = self.sender_socket.getsockname()
+
+    def tearDown(self):
+        self.sender_socket.close()
+        self.receiver.socket.close()
+
+    # Feeds a datagram to the receiver, returns copies of the chunks it delivers, their buffers are reused afterwards.
+    def feed(self, datagram):
+        buffer = memoryview(bytearray(constants.MSS_VALUE))
+        buffer[:len(datagram)] = datagram
+        return [bytes(package.chunk) for package in self.receiver.handle_datagram(buffer, len(datagram), self.address)]
+
+    def receive_ack(self):
+        data = self.sender_socket.recv(constants.MSS_VALUE)
+        return ACK_HEADER.unpack_from(data)
+
+    def test_single_loss_is_rebuilt_from_parity(self):
+        chunks = [self.rng.randbytes(CHUNK_SIZE) for _ in range(3)] + [self.rng.randbytes(CHUNK_SIZE // 2)]
+        encoder = ParityEncoder()
+        for chunk in chunks:
+            encoder.add(chunk)
+        parity = pack_package(0, encoder.pack_parity(), flags=FLAG_PARITY, fec_index=len(chunks), connection_id=7)
+
+        delivered = []
+        for seq_no in (0, 2, 3):  # Packet 1 is lost
+            delivered += self.feed(pack_package(seq_no, chunks[seq_no], flags=FLAG_FEC, fec_index=seq_no, connection_id=7))
+            self.receive_ack()
+        parity_timestamp = PACKAGE_HEADER.unpack_from(parity)[5]
+        delivered += self.feed(parity)
+
+        self.assertEqual(delivered, chunks)
+        self.assertEqual(self.receiver.recovered_count, 1)
+        # The ACK of the rebuilt packet echoes the parity packet's timestamp, the sender takes it as an RTT sample
+        self.assertEqual(self.receive_ack()[4], parity_timestamp)
+
+    def test_parity_is_stamped_when_sent(self):
+        sender = UDPServer(0, *self.receiver.socket.getsockname(), iter([bytes(CHUNK_SIZE)] * 4), fec_ratio=0.25,
+                           connection_id=7, sock=bound_socket())
+        sender.sender = BatchSender(sender.socket, sender.target, 'sendto')
+        parity = sender.window.get(3).parity
+        self.assertIsNotNone(parity)
+
+        time.sleep(0.2)  # The group was closed when the window was filled, its parity goes out later
+        send_time = get_timestamp()
+        sender.send_parity(parity)
+        sender.flush_datagrams()
+        sender.socket.close()
+
+        self.receiver.socket.settimeout(2.0)
+        data = self.receiver.socket.recv(constants.MSS_VALUE)
+        seq_no, timestamp, chunk, flags, fec_index, connection_id = unpack_package(data)
+        self.assertIsNotNone(chunk)  # The checksum still matches
+        self.assertTrue(flags & FLAG_PARITY)
+        self.assertGreaterEqual(timestamp, send_time)
+
+
+class ForwardErrorCorrectionTransferTest(unittest.TestCase):
+    # With FEC on, ACKs of rebuilt packets must not inflate the RTT estimate, or the pacer throttles the transfer.
+    # The parity of the last groups of a window waits several RTTs to be sent, a stale timestamp shows up as such a delay.
+    def test_srtt_stays_near_path_rtt_under_loss(self):
+        data = random.Random(2).randbytes(2 << 20)
+        sender, receiver, received = transfer(data, Impairment(loss=0.15, delay=PATH_DELAY), fec_ratio='auto')
+        self.assertEqual(received, data)
+        self.assertGreater(sender.parity_count, 0)
+        self.assertGreater(receiver.recovered_count, 0)
+        self.assertLess(sender.rtt_estimator.srtt, 5 * 2 * PATH_DELAY)
+
+if __name__ == '__main__':
+    unittest.main()
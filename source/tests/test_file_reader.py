@@ -0,0 +1,67 @@
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+import server
+from include import *
+from include.file_reader import READ_AHEAD_BLOCK_CHUNKS, READ_AHEAD_BLOCKS
+
+# Chunk size of the tests, small so that the ring of read_ahead_chunks wraps around several times
+CHUNK_SIZE = 100
+
+
+class ChunkSourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Writes a file of the given length, returns its path.
+    def create_file(self, length):
+        filename = os.path.join(self.directory.name, '{}.obj'.format(length))
+        with open(filename, 'wb') as file:
+            file.write(random.Random(length).randbytes(length))
+        return filename
+
+    # Returns copies of the chunks of a source, each chunk is only valid until the next one is requested.
+    def read_chunks(self, source, filename):
+        return [bytes(chunk) for chunk in source(filename, CHUNK_SIZE)]
+
+    def test_same_chunks_as_the_plain_reader(self):
+        ring_length = (READ_AHEAD_BLOCKS + 2) * READ_AHEAD_BLOCK_CHUNKS * CHUNK_SIZE
+        for length in (0, 1, CHUNK_SIZE, 10 * CHUNK_SIZE + 37, 3 * ring_length, 3 * ring_length + 1):
+            filename = self.create_file(length)
+            expected = self.read_chunks(server.chunk_file, filename)
+            with open(filename, 'rb') as file:
+                self.assertEqual(b''.join(expected), file.read())
+            for source in (mmap_chunks, read_ahead_chunks):
+                with self.subTest(source=source.__name__, length=length):
+                    self.assertEqual(self.read_chunks(source, filename), expected)
+
+    def test_chunk_sources(self):
+        self.assertEqual(set(server.CHUNK_SOURCES), {'read', 'mmap', 'read_ahead'})
+
+    def test_missing_file(self):
+        for source in (mmap_chunks, read_ahead_chunks):
+            with self.assertRaises(OSError):
+                next(source(os.path.join(self.directory.name, 'missing.obj'), CHUNK_SIZE))
+
+    # A sender that stops early must not leave the producer thread blocked on the full queue
+    def test_read_ahead_producer_stops_with_the_sender(self):
+        filename = self.create_file(20 * READ_AHEAD_BLOCKS * READ_AHEAD_BLOCK_CHUNKS * CHUNK_SIZE)
+        thread_count = threading.active_count()
+        chunks = read_ahead_chunks(filename, CHUNK_SIZE)
+        next(chunks)
+        self.assertEqual(threading.active_count(), thread_count + 1)
+        chunks.close()
+        deadline = time.monotonic() + 2
+        while threading.active_count() > thread_count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(threading.active_count(), thread_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import os
+import random
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import client
+from include import *
+from benchmarks.netem import Impairment, NetemProxy
+
+# Chunk size of the tests, not a divisor of the block size so chunks straddle block boundaries
+CHUNK_SIZE = 7000
+
+# Silence after which the ends of an interrupted transfer give up, instead of RECEIVE_TIMEOUT
+INTERRUPTED_TIMEOUT = 0.5
+
+
+# Drops every data packet of the sender after the first count, as if the connection broke.
+class Interruption:
+    def __init__(self, count):
+        self.count = count
+        self.sent_count = 0
+
+    def __call__(self, data, from_client):
+        if from_client or is_control_packet(data):
+            return False
+        self.sent_count += 1
+        return self.sent_count > self.count
+
+
+class ManifestCodecTest(unittest.TestCase):
+    def test_pack_unpack_round_trip(self):
+        hashes = [bytes([i]) * MANIFEST_HASH_BYTES for i in range(3)]
+        manifest = unpack_manifest(Manifest(2 * MIN_BLOCK_SIZE + 1, MIN_BLOCK_SIZE, hashes).pack())
+        self.assertEqual((manifest.file_length, manifest.block_size, manifest.hashes), (2 * MIN_BLOCK_SIZE + 1, MIN_BLOCK_SIZE, hashes))
+
+    def test_invalid_manifests_are_refused(self):
+        hashes = [bytes(MANIFEST_HASH_BYTES)]
+        self.assertIsNone(unpack_manifest(b'\x00'))
+        self.assertIsNone(unpack_manifest(Manifest(100, MIN_BLOCK_SIZE + 1, hashes).pack()))  # Not a power of two
+        self.assertIsNone(unpack_manifest(Manifest(100, MIN_BLOCK_SIZE // 2, hashes).pack()))  # Too small
+        self.assertIsNone(unpack_manifest(Manifest(MIN_BLOCK_SIZE + 1, MIN_BLOCK_SIZE, hashes).pack()))  # A hash is missing
+
+    def test_block_size_for(self):
+        self.assertEqual(block_size_for(0, 10), MIN_BLOCK_SIZE)
+        self.assertEqual(block_size_for(10 * MIN_BLOCK_SIZE, 10), MIN_BLOCK_SIZE)
+        self.assertEqual(block_size_for(10 * MIN_BLOCK_SIZE + 1, 10), 2 * MIN_BLOCK_SIZE)
+
+
+class ResumePlanTest(unittest.TestCase):
+    def test_plan_blocks(self):
+        hashes = [bytes([i]) * MANIFEST_HASH_BYTES for i in range(5)]
+        manifest = Manifest(5 * MIN_BLOCK_SIZE, MIN_BLOCK_SIZE, hashes)
+        remote_hashes = hashes[:1] + [INVALID_HASH] + hashes[2:3] + [bytes(range(MANIFEST_HASH_BYTES))]  # One block short
+        self.assertEqual(plan_blocks(manifest, Manifest(4 * MIN_BLOCK_SIZE, MIN_BLOCK_SIZE, remote_hashes)), [1, 3, 4])
+
+    def test_pack_unpack_round_trip(self):
+        for file_length, blocks in ((0, []), (MIN_BLOCK_SIZE, [0]), (20 * MIN_BLOCK_SIZE - 1, [0, 7, 8, 19])):
+            self.assertEqual(unpack_plan(pack_plan(file_length, MIN_BLOCK_SIZE, blocks)), (file_length, MIN_BLOCK_SIZE, blocks))
+
+    def test_invalid_plans_are_refused(self):
+        plan = pack_plan(9 * MIN_BLOCK_SIZE, MIN_BLOCK_SIZE, [1, 8])
+        self.assertIsNone(unpack_plan(plan[:-1]))  # The bitmap is cut short
+        self.assertIsNone(unpack_plan(plan + b'\x00'))
+        self.assertIsNone(unpack_plan(pack_plan(9 * MIN_BLOCK_SIZE, MIN_BLOCK_SIZE + 1, [1])))
+
+
+class BlockTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rng = random.Random(4)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    # Sends the planned blocks of source into the copy the way a resumed transfer does, returns the writer.
+    def send_blocks(self, source_path, copy_path, blocks):
+        manifest = compute_manifest(source_path, MIN_BLOCK_SIZE)
+        file_length, block_size, blocks = unpack_plan(pack_plan(manifest.file_length, MIN_BLOCK_SIZE, blocks))
+        fd = os.open(copy_path, os.O_RDWR)
+        try:
+            writer = BlockWriter(fd, CHUNK_SIZE)
+            writer.set_plan(file_length, block_size, blocks)
+            for seq_no, chunk in enumerate(chunk_blocks(source_path, blocks, block_size, CHUNK_SIZE)):
+                writer.write(seq_no, chunk)
+            os.ftruncate(fd, file_length)
+        finally:
+            os.close(fd)
+        return writer
+
+    def test_changed_blocks_rebuild_the_file(self):
+        data = self.rng.randbytes(5 * MIN_BLOCK_SIZE + 1234)
+        copy = bytearray(data)
+        copy[MIN_BLOCK_SIZE + 10] ^= 0xFF
+        copy[4 * MIN_BLOCK_SIZE:] = bytes(len(copy) - 4 * MIN_BLOCK_SIZE)
+        source_path = self.write_file('source.bin', data)
+        copy_path = self.write_file('copy.bin', bytes(copy))
+
+        blocks = plan_blocks(compute_manifest(source_path, MIN_BLOCK_SIZE), compute_manifest(copy_path, MIN_BLOCK_SIZE))
+        self.assertEqual(blocks, [1, 4, 5])
+        writer = self.send_blocks(source_path, copy_path, blocks)
+        self.assertTrue(all(writer.is_complete(position) for position in range(len(blocks))))
+        with open(copy_path, 'rb') as file:
+            self.assertEqual(file.read(), data)
+
+    def test_received_manifest_marks_incomplete_blocks(self):
+        data = self.rng.randbytes(3 * MIN_BLOCK_SIZE)
+        source_path = self.write_file('source.bin', data)
+        copy = bytes(MIN_BLOCK_SIZE) + data[MIN_BLOCK_SIZE:2 * MIN_BLOCK_SIZE] + bytes(MIN_BLOCK_SIZE)  # Block 1 is up to date
+        copy_path = self.write_file('copy.bin', copy)
+        old_manifest = compute_manifest(copy_path, MIN_BLOCK_SIZE)
+
+        fd = os.open(copy_path, os.O_RDWR)
+        try:
+            writer = BlockWriter(fd, CHUNK_SIZE)
+            writer.set_plan(len(data), MIN_BLOCK_SIZE, [0, 2])
+            for seq_no, chunk in enumerate(chunk_blocks(source_path, [0, 2], MIN_BLOCK_SIZE, CHUNK_SIZE)):
+                if seq_no * CHUNK_SIZE >= MIN_BLOCK_SIZE + CHUNK_SIZE:
+                    break  # The transfer is aborted early in block 2
+                writer.write(seq_no, chunk)
+        finally:
+            os.close(fd)
+
+        store_received_manifest(copy_path, old_manifest, writer)
+        manifest = read_cached_manifest(copy_path, MIN_BLOCK_SIZE)
+        self.assertEqual(manifest.hashes, [compute_manifest(source_path, MIN_BLOCK_SIZE).hashes[0], old_manifest.hashes[1], INVALID_HASH])
+        self.assertEqual(plan_blocks(compute_manifest(source_path, MIN_BLOCK_SIZE), manifest), [2])
+
+    def test_stream_manifest(self):
+        data = self.rng.randbytes(3 * MIN_BLOCK_SIZE + 10)
+        path = self.write_file('file.bin', data)
+        hashes = compute_manifest(path, MIN_BLOCK_SIZE).hashes
+        store_stream_manifest(path, 2 * MIN_BLOCK_SIZE + 5, MIN_BLOCK_SIZE)
+        self.assertEqual(read_cached_manifest(path, MIN_BLOCK_SIZE).hashes, hashes[:2] + [INVALID_HASH] * 2)
+        store_stream_manifest(path, len(data), MIN_BLOCK_SIZE)
+        self.assertEqual(read_cached_manifest(path, MIN_BLOCK_SIZE).hashes, hashes)
+
+    def test_cached_manifest(self):
+        path = self.write_file('file.bin', self.rng.randbytes(2 * MIN_BLOCK_SIZE))
+        manifest = load_manifest(path, MIN_BLOCK_SIZE)
+        self.assertTrue(os.path.exists(manifest_cache_path(path)))
+        self.assertEqual(read_cached_manifest(path, MIN_BLOCK_SIZE).hashes, manifest.hashes)
+        self.assertIsNone(read_cached_manifest(path, 2 * MIN_BLOCK_SIZE))  # Other blocks
+
+        status = os.stat(path)
+        os.utime(path, ns=(status.st_atime_ns, status.st_mtime_ns + 1))  # The file changed after the cache was stored
+        self.assertIsNone(read_cached_manifest(path, MIN_BLOCK_SIZE))
+
+
+
+class ResumedTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = random.Random(18).randbytes(10 * MIN_BLOCK_SIZE + 999)
+        self.source_path = os.path.join(self.directory.name, 'source.bin')
+        self.copy_path = os.path.join(self.directory.name, 'copy.bin')
+        with open(self.source_path, 'wb') as file:
+            file.write(self.data)
+        self.hashes = compute_manifest(self.source_path, MIN_BLOCK_SIZE).hashes
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Runs resume_udp against a sender offering the given options, through a proxy that cuts the transfer after
+    # packet_count data packets if given. Returns whether the copy is complete and the blocks the sender planned,
+    # None if it sent the whole file.
+    def attempt(self, options, packet_count=None):
+        listen_socket = create_udp_socket('127.0.0.1', 0)
+        listen_socket.settimeout(5)
+        plans = []
+
+        def serve():
+            request = None
+            while request is None:
+                request = parse_request(*listen_socket.recvfrom(constants.MSS_VALUE))
+            udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            parameters = agree_parameters(request, WINDOW_SIZE, options, udp_socket)
+            plan = plan_resume(request, parameters) if parameters.options & OPTION_RESUME else None
+            if plan is None:
+                data = mmap_chunks(request.filename, parameters.chunk_size())
+            else:
+                data = chunk_blocks(request.filename, plan[0], request.manifest.block_size, parameters.chunk_size())
+            plans.append(None if plan is None else plan[0])
+            UDPServer(0, *request.address, data, connection_id=request.connection_id, parameters=parameters,
+                      sock=udp_socket, resume_plan=None if plan is None else plan[1]).process()
+
+        serving_thread = threading.Thread(target=serve, daemon=True)
+        serving_thread.start()
+        drop = None if packet_count is None else Interruption(packet_count)
+        proxy = NetemProxy(listen_socket.getsockname(), Impairment(), drop=drop)
+        try:
+            with mock.patch.object(constants, 'RECEIVE_TIMEOUT', INTERRUPTED_TIMEOUT):
+                complete = client.resume_udp('127.0.0.1', 0, proxy.address, self.source_path, self.copy_path)
+                serving_thread.join()
+        finally:
+            proxy.close()
+            listen_socket.close()
+        return complete, plans[0]
+
+    # Returns the numbers of the blocks the cached manifest of the copy does not have right.
+    def missing_blocks(self):
+        manifest = read_cached_manifest(self.copy_path, MIN_BLOCK_SIZE)
+        self.assertIsNotNone(manifest)
+        return plan_blocks(Manifest(len(self.data), MIN_BLOCK_SIZE, self.hashes), manifest)
+
+    # The first attempt falls back to the whole file, both interrupted attempts leave a manifest the next one resumes from
+    def test_two_interruptions(self):
+        complete, plan = self.attempt(DEFAULT_OPTIONS, packet_count=20)
+        self.assertFalse(complete)
+        self.assertIsNone(plan)
+        missing = self.missing_blocks()
+        self.assertTrue(0 < len(missing) < len(self.hashes))
+
+        complete, plan = self.attempt(DEFAULT_OPTIONS | OPTION_RESUME, packet_count=20)
+        self.assertFalse(complete)
+        self.assertEqual(plan, missing)
+        previous_missing, missing = missing, self.missing_blocks()
+        self.assertTrue(0 < len(missing) < len(previous_missing))
+
+        complete, plan = self.attempt(DEFAULT_OPTIONS | OPTION_RESUME)
+        self.assertTrue(complete)
+        self.assertEqual(plan, missing)
+        self.assertEqual(self.missing_blocks(), [])
+        with open(self.copy_path, 'rb') as file:
+            self.assertEqual(file.read(), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
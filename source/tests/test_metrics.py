@@ -0,0 +1,95 @@
+import io
+import json
+import unittest
+from include import *
+from include.metrics import HISTOGRAM_BUCKETS_PER_OCTAVE, SUMMARY_PERCENTILES
+
+# Ratio of the bounds of a bucket
+BUCKET_RATIO = 2 ** (1 / HISTOGRAM_BUCKETS_PER_OCTAVE)
+
+
+class HistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.histogram = Histogram(1, 1 << 16)
+
+    # Returns the index of the only bucket holding a value after adding it to an empty histogram.
+    def bucket_of(self, value):
+        histogram = Histogram(1, 1 << 16)
+        histogram.add(value)
+        return histogram.buckets.index(1)
+
+    def test_bucket_boundaries(self):
+        self.assertEqual(len(self.histogram.buckets), 16 * HISTOGRAM_BUCKETS_PER_OCTAVE + 2)
+        # Values up to the minimum share the first bucket, everything from the maximum on the last one
+        self.assertEqual(self.bucket_of(0), 0)
+        self.assertEqual(self.bucket_of(1), 0)
+        self.assertEqual(self.bucket_of(1 << 16), len(self.histogram.buckets) - 1)
+        self.assertEqual(self.bucket_of(1 << 20), len(self.histogram.buckets) - 1)
+        # Bucket i holds the values from BUCKET_RATIO ** (i - 1) up to BUCKET_RATIO ** i
+        for index in (1, 2, 8, 9, 100):
+            self.assertEqual(self.bucket_of(BUCKET_RATIO ** (index - 1) * 1.001), index)
+            self.assertEqual(self.bucket_of(BUCKET_RATIO ** index * 0.999), index)
+        self.assertEqual(self.bucket_of(2.001), HISTOGRAM_BUCKETS_PER_OCTAVE + 1)  # One octave up
+
+    def test_empty(self):
+        self.assertIsNone(self.histogram.percentile(0.5))
+        self.assertEqual(self.histogram.summary(), dict(count=0, mean=0, min=None, max=None, p50=None, p90=None, p99=None))
+
+    def test_single_value(self):
+        self.histogram.add(42)
+        for fraction in (0, 0.5, 1):
+            self.assertEqual(self.histogram.percentile(fraction), 42)  # Clamped to the extremes
+
+    def test_percentiles(self):
+        for value in range(1, 101):
+            self.histogram.add(value)
+        self.assertEqual(self.histogram.percentile(0), 1)
+        self.assertEqual(self.histogram.percentile(1), 100)
+        for fraction in (0.25, 0.5, 0.9, 0.99):
+            exact = fraction * 100
+            self.assertGreaterEqual(self.histogram.percentile(fraction), exact)
+            self.assertLessEqual(self.histogram.percentile(fraction), exact * BUCKET_RATIO)
+
+    def test_summary(self):
+        for value in (1, 2, 3, 10):
+            self.histogram.add(value)
+        summary = self.histogram.summary()
+        self.assertEqual((summary['count'], summary['mean'], summary['min'], summary['max']), (4, 4, 1, 10))
+        self.assertEqual([summary['p{:g}'.format(fraction * 100)] for fraction in SUMMARY_PERCENTILES],
+                         [self.histogram.percentile(fraction) for fraction in SUMMARY_PERCENTILES])
+
+
+class JSONLinesExportTest(unittest.TestCase):
+    def test_one_line_per_snapshot(self):
+        file = io.StringIO()
+        metrics = TransferMetrics(export_json_lines(file), interval=10)
+        metrics.rtt.add(0.02)
+        metrics.report(metrics.snapshot('sender', 1000, retransmissions=3))
+        metrics.report(metrics.snapshot('sender', 2000, final=True, retransmissions=4))
+        self.assertGreater(metrics.next_report, metrics.start_time + 10)
+
+        lines = file.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        first, last = map(json.loads, lines)
+        self.assertEqual((first['role'], first['final'], first['delivered_bytes'], first['retransmissions']),
+                         ('sender', False, 1000, 3))
+        self.assertEqual((last['final'], last['delivered_bytes'], last['retransmissions']), (True, 2000, 4))
+        self.assertEqual(first['rtt']['count'], 1)
+        self.assertEqual(first['rtt']['p50'], 0.02)
+        self.assertEqual(first['delivery_gap']['count'], 0)
+        self.assertGreaterEqual(last['elapsed'], first['elapsed'])
+
+    def test_without_export_nothing_is_scheduled(self):
+        self.assertEqual(TransferMetrics().next_report, float('inf'))
+
+    # The counters of the real receiver must all be serializable
+    def test_receiver_snapshot(self):
+        file = io.StringIO()
+        receiver = UDPClient('127.0.0.1', 0, metrics_export=export_json_lines(file))
+        receiver.report_metrics(final=True)
+        snapshot = json.loads(file.getvalue())
+        self.assertEqual((snapshot['role'], snapshot['final'], snapshot['delivered_bytes']), ('receiver', True, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
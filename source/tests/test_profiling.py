@@ -0,0 +1,97 @@
+import io
+import unittest
+from include import *
+from include import reliable_udp
+from include.profiling import MODULE_PROFILERS, MODULE_SECTIONS
+
+
+# Returns the module functions of MODULE_SECTIONS as they are now.
+def module_functions():
+    return {name: getattr(reliable_udp, name) for name in MODULE_SECTIONS}
+
+
+# Returns the calls a profiler counted for a module function.
+def module_calls(profiler, name='unpack_package'):
+    return profiler.sections.get('reliable_udp.' + name, [0])[0]
+
+
+class ModulePatchTest(unittest.TestCase):
+    def setUp(self):
+        self.originals = module_functions()
+
+    def tearDown(self):
+        # A failed test must not leave timers behind for the others
+        for profiler in list(MODULE_PROFILERS):
+            profiler.close()
+
+    def test_close_restores_the_originals(self):
+        profiler = Profiler()
+        profiler.patch_module()
+        profiler.patch_module()  # Once per profiler
+        self.assertNotEqual(module_functions(), self.originals)
+        reliable_udp.unpack_package(b'')
+        self.assertEqual(module_calls(profiler), 1)
+        profiler.close()
+        self.assertEqual(module_functions(), self.originals)
+        profiler.close()  # Closing twice is harmless
+        self.assertEqual(module_functions(), self.originals)
+
+    def test_context_manager(self):
+        with Profiler() as profiler:
+            profiler.patch_module()
+        self.assertEqual(module_functions(), self.originals)
+
+    def test_nested_profilers_closed_in_order(self):
+        outer, inner = Profiler(), Profiler()
+        outer.patch_module()
+        outer_functions = module_functions()
+        inner.patch_module()
+        reliable_udp.unpack_package(b'')
+        self.assertEqual((module_calls(outer), module_calls(inner)), (0, 1))  # The timers do not nest
+        inner.close()
+        self.assertEqual(module_functions(), outer_functions)
+        reliable_udp.unpack_package(b'')
+        self.assertEqual((module_calls(outer), module_calls(inner)), (1, 1))
+        outer.close()
+        self.assertEqual(module_functions(), self.originals)
+
+    def test_nested_profilers_closed_out_of_order(self):
+        first, second = Profiler(), Profiler()
+        first.patch_module()
+        second.patch_module()
+        second_functions = module_functions()
+        first.close()
+        self.assertEqual(module_functions(), second_functions)
+        second.close()
+        self.assertEqual(module_functions(), self.originals)
+
+        # A profiler patching in after the others closed starts from the originals again
+        third = Profiler()
+        third.patch_module()
+        third.close()
+        self.assertEqual(module_functions(), self.originals)
+
+    def test_attached_transfer(self):
+        with Profiler() as profiler:
+            receiver = UDPClient('127.0.0.1', 0, profiler=profiler)
+            self.assertIn(profiler, MODULE_PROFILERS)
+            receiver.handle_control(b'', None)
+        self.assertEqual(module_functions(), self.originals)
+        self.assertEqual(profiler.sections['receiver.handle_control'][0], 1)
+
+
+class TraceLogTest(unittest.TestCase):
+    def test_dump_and_read(self):
+        trace = TraceLog(capacity=4)
+        for seq_no in range(6):
+            trace.record(EVENT_SEND, seq_no)
+        file = io.BytesIO()
+        trace.dump(file)
+        file.seek(0)
+        records = list(read_trace(file))
+        self.assertEqual([(event, seq_no) for _, event, seq_no in records], [('send', seq_no) for seq_no in range(2, 6)])
+        self.assertEqual([timestamp for timestamp, _, _ in records], sorted(timestamp for timestamp, _, _ in records))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import heapq
+import random
+import unittest
+from include import *
+from include.rtt import RTT_ALPHA, RTT_BETA, RTT_VARIANCE_FACTOR
+from benchmarks.netem import Impairment
+from .loopback import bound_socket, transfer
+
+# Chunk size of the unit tests, small enough for any loopback MTU
+CHUNK_SIZE = 1000
+
+
+class RTTEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.estimator = RTTEstimator(initial_timeout=1.0, min_timeout=0.01, max_timeout=4.0)
+
+    def test_first_sample(self):
+        self.estimator.add_sample(0.1)
+        self.assertEqual(self.estimator.srtt, 0.1)
+        self.assertEqual(self.estimator.rttvar, 0.05)
+        self.assertAlmostEqual(self.estimator.rto, 0.1 + RTT_VARIANCE_FACTOR * 0.05)
+
+    def test_update(self):
+        self.estimator.add_sample(0.1)
+        self.estimator.add_sample(0.2)
+        rttvar = (1 - RTT_BETA) * 0.05 + RTT_BETA * 0.1  # With the old SRTT
+        srtt = (1 - RTT_ALPHA) * 0.1 + RTT_ALPHA * 0.2
+        self.assertAlmostEqual(self.estimator.rttvar, rttvar)
+        self.assertAlmostEqual(self.estimator.srtt, srtt)
+        self.assertAlmostEqual(self.estimator.rto, srtt + RTT_VARIANCE_FACTOR * rttvar)
+
+    def test_bounds(self):
+        self.estimator.add_sample(0.0001)
+        self.assertEqual(self.estimator.rto, 0.01)
+        self.estimator.add_sample(10.0)
+        self.assertEqual(self.estimator.rto, 4.0)
+        self.assertEqual(RTTEstimator().min_timeout, constants.MIN_TIMEOUT)
+        self.assertGreater(constants.MIN_TIMEOUT, 10 * constants.ACK_DELAY)
+
+    def test_samples_of_retransmitted_packets_are_ignored(self):
+        self.estimator.add_sample(0.1)
+        self.estimator.backoff()
+        rto = self.estimator.rto
+        self.estimator.add_sample(5.0, retransmitted=True)
+        self.assertEqual((self.estimator.srtt, self.estimator.rto), (0.1, rto))  # The backoff is kept too
+        self.estimator.add_sample(0.1)
+        self.assertLess(self.estimator.rto, rto)
+
+    def test_backoff_doubles_up_to_the_maximum(self):
+        self.estimator.backoff()
+        self.assertEqual(self.estimator.rto, 2.0)
+        self.estimator.backoff()
+        self.estimator.backoff()
+        self.assertEqual(self.estimator.rto, 4.0)
+
+
+class RetransmissionTimerTest(unittest.TestCase):
+    def setUp(self):
+        # The packets go to a socket that is never read
+        self.target_socket = bound_socket()
+        self.sender = UDPServer(0, *self.target_socket.getsockname(), iter([bytes(CHUNK_SIZE)] * 4), connection_id=7,
+                                sock=bound_socket())
+        self.sender.sender = BatchSender(self.sender.socket, self.sender.target, 'sendto')
+        for seq_no in range(4):
+            self.sender.send_packet(self.sender.window.get(seq_no))
+        self.sender.next_seq_no = 4
+
+    def tearDown(self):
+        self.sender.socket.close()
+        self.target_socket.close()
+
+    # Moves the timer of a packet to the given deadline, as if it had been sent with another RTO.
+    def set_deadline(self, seq_no, deadline):
+        timers = self.sender.timers
+        index = next(i for i, timer in enumerate(timers) if timer[1] == seq_no)
+        timers[index] = (deadline, seq_no, timers[index][2])
+        heapq.heapify(timers)
+
+    def test_only_due_timers_expire(self):
+        now = get_timestamp()
+        self.set_deadline(0, now - 1)
+        self.set_deadline(2, now - 1)
+        self.sender.ack_packet(2)  # Its timer is stale
+        self.sender.resend_packets()
+        self.assertEqual(self.sender.retransmission_count, 1)
+        self.assertTrue(self.sender.window.get(0).retransmitted)
+        self.assertEqual(sorted(seq_no for _, seq_no, _ in self.sender.timers), [0, 1, 3])
+        self.assertTrue(all(deadline > now for deadline, _, _ in self.sender.timers))
+
+
+class CleanPathTransferTest(unittest.TestCase):
+    # Without loss no timer may expire, the RTO stays above the ACK delay and the jitter of a loaded host
+    def test_no_retransmissions_on_a_clean_path(self):
+        data = random.Random(5).randbytes(3 << 20)
+        sender, receiver, received = transfer(data, Impairment())
+        self.assertEqual(received, data)
+        self.assertLessEqual(sender.retransmission_count, 1)
+        self.assertLessEqual(receiver.duplicate_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+import client
+import server
+from include import *
+from .loopback import bound_socket
+
+# Files of the tests by name: several chunks ending in a partial one, an empty file, and one outside the glob pattern
+FILES = {'a1.obj': random.Random(10).randbytes(150 * 1024 + 3), 'a2.obj': b'', 'b.txt': random.Random(11).randbytes(5000)}
+
+
+class ExpandRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for filename in ('b.obj', 'a.obj', 'c.txt'):
+            open(os.path.join(self.directory.name, filename), 'wb').close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_patterns_are_expanded_in_sorted_order(self):
+        pattern = os.path.join(self.directory.name, '*.obj')
+        missing = os.path.join(self.directory.name, 'missing.obj')
+        request = pack_request([missing, pattern, '', os.path.join(self.directory.name, '*.none')])
+        self.assertEqual(expand_request(request),
+                         [missing] + [os.path.join(self.directory.name, filename) for filename in ('a.obj', 'b.obj')])
+
+
+class SessionTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'source')
+        self.output = os.path.join(self.directory.name, 'output')
+        os.mkdir(self.source)
+        os.mkdir(self.output)
+        for filename, data in FILES.items():
+            with open(os.path.join(self.source, filename), 'wb') as file:
+                file.write(data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Serves one request with the server's UDP path in a thread and receives it with the client's session path.
+    # Returns the names of the files received.
+    def receive_session(self, names):
+        listen_socket = bound_socket(timeout=constants.RECEIVE_TIMEOUT)
+
+        def serve():
+            server.send_udp(server.listen_for_requests(listen_socket), 0, fec_ratio=0)
+
+        serving_thread = threading.Thread(target=serve, daemon=True)
+        serving_thread.start()
+        try:
+            received = client.receive_udp_files('127.0.0.1', 0, listen_socket.getsockname(), names,
+                                                output_prefix=self.output + os.sep)
+            serving_thread.join()
+        finally:
+            listen_socket.close()
+        return received
+
+    # The missing name is skipped by the sender, the files after it still arrive
+    def test_glob_and_missing_name(self):
+        names = [os.path.join(self.source, 'a*.obj'), os.path.join(self.source, 'missing.obj'), os.path.join(self.source, 'b.txt')]
+        received = self.receive_session(names)
+        self.assertEqual(received, [os.path.join(self.source, filename) for filename in FILES])
+        self.assertEqual(sorted(os.listdir(self.output)), sorted(FILES))
+        for filename, data in FILES.items():
+            with open(os.path.join(self.output, filename), 'rb') as file:
+                self.assertEqual(file.read(), data, filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
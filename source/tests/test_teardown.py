@@ -0,0 +1,57 @@
+import random
+import time
+import unittest
+from include import *
+from include.reliable_udp import FIN_RETRIES, FLAG_FIN
+from .loopback import transfer
+
+
+# Drops the first count FIN-ACKs of the receiver, all of them by default, and counts the FIN-ACKs sent.
+class FinAckLoss:
+    def __init__(self, count=None):
+        self.count = count
+        self.sent_count = 0
+
+    def __call__(self, data, from_client):
+        if not from_client or len(data) < ACK_HEADER.size or not data[1] & FLAG_ACK or not data[1] & FLAG_FIN:
+            return False
+        self.sent_count += 1
+        return self.count is None or self.sent_count <= self.count
+
+
+class TeardownTest(unittest.TestCase):
+    def setUp(self):
+        self.data = random.Random(9).randbytes(200 * 1024)
+
+    def test_fin_ack(self):
+        loss = FinAckLoss(0)
+        sender, receiver, received = transfer(self.data, drop=loss)
+        self.assertEqual(received, self.data)
+        self.assertTrue(sender.fin_acked)
+        self.assertEqual(sender.fin_count, 1)
+        self.assertEqual(loss.sent_count, 1)
+
+    # The receiver lingers after its FIN-ACK, a repeated FIN means the FIN-ACK was lost and is answered again
+    def test_repeated_fin_is_acknowledged_again(self):
+        loss = FinAckLoss(1)
+        sender, receiver, received = transfer(self.data, drop=loss)
+        self.assertEqual(received, self.data)
+        self.assertTrue(sender.fin_acked)
+        self.assertEqual(sender.fin_count, 2)
+        self.assertEqual(loss.sent_count, 2)
+
+    # With every FIN-ACK lost the sender gives up after FIN_RETRIES repetitions instead of waiting for RECEIVE_TIMEOUT
+    def test_sender_ends_when_every_fin_ack_is_lost(self):
+        loss = FinAckLoss()
+        start_time = time.monotonic()
+        sender, receiver, received = transfer(self.data, drop=loss)
+        self.assertEqual(received, self.data)
+        self.assertFalse(sender.fin_acked)
+        self.assertEqual(sender.fin_count, FIN_RETRIES + 1)
+        self.assertGreaterEqual(loss.sent_count, 1)
+        self.assertLess(time.monotonic() - start_time, constants.RECEIVE_TIMEOUT / 2)
+        self.assertEqual(sender.acked_bytes, len(self.data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from include import *
+
+
+# A package stand-in, the window only looks at the sequence number
+class Slot:
+    def __init__(self, seq_no):
+        self.seq_no = seq_no
+
+
+class UnwrapSeqNoTest(unittest.TestCase):
+    def test_values_near_the_reference(self):
+        self.assertEqual(unwrap_seq_no(10, 0), 10)
+        self.assertEqual(unwrap_seq_no(5, 10), 5)
+        self.assertEqual(unwrap_seq_no(3 % SEQUENCE_NUM_MODULO, 3 + 4 * SEQUENCE_NUM_MODULO), 3 + 4 * SEQUENCE_NUM_MODULO)
+
+    def test_wraparound_forward(self):
+        reference = SEQUENCE_NUM_MODULO - 2
+        for seq_no in range(reference, reference + 5):
+            self.assertEqual(unwrap_seq_no(seq_no % SEQUENCE_NUM_MODULO, reference), seq_no)
+
+    def test_wraparound_backward(self):
+        reference = SEQUENCE_NUM_MODULO + 1
+        for seq_no in range(reference - 4, reference + 1):
+            self.assertEqual(unwrap_seq_no(seq_no % SEQUENCE_NUM_MODULO, reference), seq_no)
+
+    def test_half_range_boundary(self):
+        half = SEQUENCE_NUM_MODULO // 2
+        self.assertEqual(unwrap_seq_no(half - 1, 0), half - 1)
+        self.assertEqual(unwrap_seq_no(half, 0), -half)
+
+
+class RingWindowTest(unittest.TestCase):
+    def fill(self, window):
+        while not window.is_full():
+            window.append(Slot(window.end))
+
+    def test_slides_past_the_wire_modulo(self):
+        base = SEQUENCE_NUM_MODULO - 3
+        window = RingWindow(4, base)
+        self.fill(window)
+        for _ in range(8):
+            self.assertEqual(window.popleft().seq_no, window.base - 1)
+            window.append(Slot(window.end))
+            self.assertEqual([slot.seq_no for slot in window], list(range(window.base, window.end)))
+        self.assertEqual(window.base, base + 8)
+        self.assertEqual(window.get(window.base + 3).seq_no, base + 11)
+        self.assertIsNone(window.get(window.base - 1))
+        self.assertIsNone(window.get(window.end))
+
+    def test_append_out_of_order_or_past_capacity(self):
+        window = RingWindow(2)
+        with self.assertRaises(ValueError):
+            window.append(Slot(1))
+        self.fill(window)
+        with self.assertRaises(ValueError):
+            window.append(Slot(window.end))
+
+    def test_truncate(self):
+        window = RingWindow(4, 10)
+        self.fill(window)
+        window.truncate(12)
+        self.assertEqual(len(window), 2)
+        self.assertNotIn(12, window)
+        window.truncate(0)
+        self.assertFalse(window)
+
+
+if __name__ == '__main__':
+    unittest.main()